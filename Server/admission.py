@@ -0,0 +1,126 @@
+import asyncio
+import http
+import random
+from collections.abc import Callable
+
+from config import CONFIG
+from game_define import LOAD_LEVEL
+import logger
+from logger import LOG_CATEGORY
+import metrics
+
+
+# 各項負載指標的 (軟上限, 硬上限)
+# 超過軟上限時不再建立新房間，超過硬上限時在 websocket 握手階段拒絕新連線
+ADMISSION_CONNECTIONS: tuple[int, int] = tuple(CONFIG.get("ADMISSION_CONNECTIONS", (4000, 5000)))
+ADMISSION_LOOP_LAG: tuple[float, float] = tuple(CONFIG.get("ADMISSION_LOOP_LAG", (0.1, 0.5)))
+ADMISSION_PENDING_PACKETS: tuple[int, int] = tuple(CONFIG.get("ADMISSION_PENDING_PACKETS", (20000, 100000)))
+# 被拒絕的連線在 Retry-After 中收到的秒數，實際值會在 1 到 2 倍之間隨機分散，避免同時重連
+ADMISSION_RETRY_AFTER: int = CONFIG.get("ADMISSION_RETRY_AFTER", 5)
+# 量測 event loop 延遲的間隔 (秒)
+ADMISSION_PROBE_INTERVAL: float = CONFIG.get("ADMISSION_PROBE_INTERVAL", 0.25)
+
+
+class AdmissionController:
+	"""依照伺服器負載決定是否接受新的連線與新的房間。
+
+	連線數在每次檢查時即時取得；event loop 延遲與待送封包總數由背景 task
+	定期量測，延遲取最近幾次量測中逐次減半的最大值，短暫的尖峰也會維持一段時間。
+	"""
+	def __init__(self):
+		self._connection_count: Callable[[], int] = lambda: 0
+		self._pending_packets: Callable[[], int] = lambda: 0
+		self.loop_lag = 0.0
+		self.pending_packets = 0
+		self._level = LOAD_LEVEL.NORMAL
+		self._task: asyncio.Task | None = None
+		self._draining = False
+		
+		metrics.LOAD.set_function(lambda: { (): self.get_level() })
+		metrics.LOOP_LAG.set_function(lambda: { (): self.loop_lag })
+		metrics.PENDING_PACKETS.set_function(lambda: { (): self.pending_packets })
+
+	def set_sources(self, connection_count: Callable[[], int], pending_packets: Callable[[], int]):
+		"""設定取得當前連線數與待送封包總數的函式。"""
+		self._connection_count = connection_count
+		self._pending_packets = pending_packets
+
+	def start(self):
+		"""開始定期量測負載。"""
+		if not self._task:
+			self._task = asyncio.create_task(self._probe_loop())
+
+	def start_draining(self):
+		"""伺服器準備關閉，之後不再接受新的連線與新的房間。"""
+		self._draining = True
+
+	def get_level(self) -> LOAD_LEVEL:
+		"""取得當前的負載等級。"""
+		if self._draining:
+			return LOAD_LEVEL.HARD
+		level = LOAD_LEVEL.NORMAL
+		for value, (soft, hard) in (
+			(self._connection_count(), ADMISSION_CONNECTIONS),
+			(self.loop_lag, ADMISSION_LOOP_LAG),
+			(self.pending_packets, ADMISSION_PENDING_PACKETS),
+		):
+			if value >= hard:
+				return LOAD_LEVEL.HARD
+			if value >= soft:
+				level = LOAD_LEVEL.SOFT
+		return level
+
+	def can_create_room(self) -> bool:
+		"""是否允許建立新房間。"""
+		return self.get_level() < LOAD_LEVEL.SOFT
+
+	def can_accept_connection(self) -> bool:
+		"""是否允許新的連線。"""
+		return self.get_level() < LOAD_LEVEL.HARD
+
+	async def _probe_loop(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			expected = loop.time() + ADMISSION_PROBE_INTERVAL
+			await asyncio.sleep(ADMISSION_PROBE_INTERVAL)
+			self.loop_lag = max(loop.time() - expected, self.loop_lag / 2)
+			self.pending_packets = self._pending_packets()
+
+			level = self.get_level()
+			if level != self._level:
+				log = logger.info if level < self._level else logger.warning
+				log(LOG_CATEGORY.SERVER, "負載等級變為 %s", level.name, connections=self._connection_count(),
+					loop_lag=f"{self.loop_lag:.3f}", pending_packets=self.pending_packets)
+				self._level = level
+
+	def _retry_after(self) -> str:
+		return str(random.randint(ADMISSION_RETRY_AFTER, ADMISSION_RETRY_AFTER * 2))
+
+	def process_request(self, connection, request):
+		"""websockets.serve 的 `process_request` (新版 API)，負載過高時在握手階段返回 503。"""
+		del request  # unused parameter
+		if self.can_accept_connection():
+			return None
+
+		metrics.ADMISSION_REJECTED.inc(1, "connection")
+		logger.debug(LOG_CATEGORY.CONNECTION, "負載過高或伺服器關閉中，拒絕新連線", address=connection.remote_address)
+		response = connection.respond(http.HTTPStatus.SERVICE_UNAVAILABLE, "Server is busy, please retry later.\n")
+		response.headers["Retry-After"] = self._retry_after()
+		return response
+
+	def process_request_legacy(self, path: str, request_headers):
+		"""websockets.serve 的 `process_request` (舊版 API)。"""
+		del path, request_headers  # unused parameter
+		if self.can_accept_connection():
+			return None
+
+		metrics.ADMISSION_REJECTED.inc(1, "connection")
+		return (
+			http.HTTPStatus.SERVICE_UNAVAILABLE,
+			[("Retry-After", self._retry_after())],
+			b"Server is busy, please retry later.\n",
+		)
+
+
+# 每個 worker 行程各自一個
+controller = AdmissionController()
@@ -0,0 +1,84 @@
+from collections.abc import Sequence
+from typing import override
+
+from websockets.extensions.base import Extension, ServerExtensionFactory
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES, Frame, Opcode
+from websockets.typing import ExtensionParameter
+
+from config import CONFIG
+import metrics
+
+
+# 是否和客戶端協商 permessage-deflate
+COMPRESSION_ENABLED: bool = CONFIG.get("COMPRESSION_ENABLED", True)
+# 小於這個大小 (bytes) 的訊息直接送出不壓縮，大部分封包只有幾個 bytes，壓縮只會變大又浪費 CPU
+COMPRESSION_MIN_SIZE: int = CONFIG.get("COMPRESSION_MIN_SIZE", 128)
+# 伺服器壓縮使用的 LZ77 視窗大小 (2 ^ bits bytes，9 ~ 15)，也會要求客戶端使用不超過這個大小的視窗
+COMPRESSION_WINDOW_BITS: int = CONFIG.get("COMPRESSION_WINDOW_BITS", 11)
+# zlib 的 memLevel (1 ~ 9)，每條連線壓縮器佔用約 2 ^ (WINDOW_BITS + 2) + 2 ^ (MEMORY_LEVEL + 9) bytes
+COMPRESSION_MEMORY_LEVEL: int = CONFIG.get("COMPRESSION_MEMORY_LEVEL", 4)
+# zlib 的壓縮等級 (1 ~ 9)
+COMPRESSION_LEVEL: int = CONFIG.get("COMPRESSION_LEVEL", 6)
+
+
+class SizeAwarePerMessageDeflate(PerMessageDeflate):
+	"""只壓縮夠大的訊息的 permessage-deflate。
+
+	RFC 7692 允許每則訊息各自決定是否壓縮 (RSV1)，跳過的訊息不經過壓縮器，
+	也不影響 context takeover 保留的視窗，之後壓縮的訊息仍然可以引用先前送出的大封包內容。
+	"""
+	def __init__(self, *args, min_size: int, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.min_size = min_size
+		self._skipping = False  # 目前的分段訊息是否沒有壓縮
+
+	@override
+	def encode(self, frame: Frame) -> Frame:
+		if frame.opcode in CTRL_OPCODES:
+			return frame
+		if frame.opcode is not Opcode.CONT:
+			self._skipping = len(frame.data) < self.min_size
+		if self._skipping:
+			return frame
+
+		encoded = super().encode(frame)
+		metrics.observe_compression(len(frame.data), len(encoded.data))
+		return encoded
+
+
+class SizeAwareDeflateFactory(ServerPerMessageDeflateFactory):
+	"""協商結果與 `ServerPerMessageDeflateFactory` 相同，但產生 `SizeAwarePerMessageDeflate`。"""
+	def __init__(self, *args, min_size: int, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.min_size = min_size
+
+	@override
+	def process_request_params(
+		self,
+		params: Sequence[ExtensionParameter],
+		accepted_extensions: Sequence[Extension],
+	) -> tuple[list[ExtensionParameter], PerMessageDeflate]:
+		response_params, extension = super().process_request_params(params, accepted_extensions)
+		return response_params, SizeAwarePerMessageDeflate(
+			extension.remote_no_context_takeover,
+			extension.local_no_context_takeover,
+			extension.remote_max_window_bits,
+			extension.local_max_window_bits,
+			extension.compress_settings,
+			min_size=self.min_size,
+		)
+
+
+def create_extensions() -> Sequence[ServerExtensionFactory]:
+	"""依設定建立 `websockets.serve(extensions=...)` 使用的擴充協商設定。"""
+	if not COMPRESSION_ENABLED:
+		return []
+	return [
+		SizeAwareDeflateFactory(
+			server_max_window_bits=COMPRESSION_WINDOW_BITS,
+			client_max_window_bits=COMPRESSION_WINDOW_BITS,
+			compress_settings={"memLevel": COMPRESSION_MEMORY_LEVEL, "level": COMPRESSION_LEVEL},
+			min_size=COMPRESSION_MIN_SIZE,
+		)
+	]
@@ -0,0 +1,10 @@
+import json
+import os
+
+
+# load config
+if os.path.isfile("config.json"):
+	with open("config.json", "r") as f:
+		CONFIG: dict = json.loads(f.read())
+else:
+	CONFIG: dict = dict()
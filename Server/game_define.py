@@ -5,6 +5,12 @@ class CONST(enum.IntEnum):
 	GAME_VERSION				= 4
 	START_COUNTDOWN_DURATION	= 5
 
+@enum.unique
+class SLOW_CONSUMER_POLICY(enum.StrEnum):
+	DROP			= "drop"		# 發送逾時或佇列已滿時丟棄封包，不中斷連線，斷線重連時改為完整同步
+	QUEUE_LIMIT		= "queue_limit"	# 待送封包超過上限時中斷連線，單次發送逾時會再等一次，連續逾時才中斷
+	DISCONNECT		= "disconnect"	# 第一次發送逾時或待送封包超過上限時立即中斷連線
+
 @enum.unique
 class PROTOCOL_CLIENT(enum.IntEnum):
 	NAME					= 0
@@ -26,6 +32,12 @@ class PROTOCOL_CLIENT(enum.IntEnum):
 	SET_NUMBER_PER_PLAYER	= enum.auto()
 	POSE_NUMBER				= enum.auto()
 	SET_URGENT				= enum.auto()
+	BATCH					= enum.auto()	# 設定是否接收 BATCH 封包 (選用)
+	RESUME					= enum.auto()	# 斷線後用 SESSION_TOKEN 接回原本的使用者 (選用)
+	CREATE_LARGE_ROOM		= enum.auto()	# 建立可以容納大量觀眾的大型房間 (選用)
+	FETCH_USERS				= enum.auto()	# 取得房間使用者列表的下一頁 (選用)
+	BROWSE_ROOMS			= enum.auto()	# 在大廳依條件分頁瀏覽房間，並設定是否訂閱房間變動 (選用)
+	QUICK_JOIN				= enum.auto()	# 加入指定遊戲類型中合適的等待中房間，沒有時建立新房間 (選用)
 
 @enum.unique
 class PROTOCOL_SERVER(enum.IntEnum):
@@ -56,6 +68,60 @@ class PROTOCOL_SERVER(enum.IntEnum):
 	POSE_NUMBER		= enum.auto()
 	URGENT_PLAYER	= enum.auto()
 	RESET_GAME_DATA	= enum.auto()
+	BATCH			= enum.auto()	# 同一個 tick 內合併送出的多個封包
+	KICK			= enum.auto()	# 伺服器主動中斷連線前的通知 (KICK_REASON)
+	SESSION_TOKEN	= enum.auto()	# 斷線重連用的憑證
+	RESUME			= enum.auto()	# RESUME 的結果 (RESUME_RESULT)
+	SHUTDOWN		= enum.auto()	# 伺服器即將關閉，最多再等待的秒數
+	LARGE_INIT		= enum.auto()	# 大型房間的 INIT (數量欄位為 uint16，使用者列表只含第一頁)
+	USER_LIST		= enum.auto()	# FETCH_USERS 的結果
+	ROOM_LIST		= enum.auto()	# BROWSE_ROOMS 的結果
+	ROOM_UPDATE		= enum.auto()	# 訂閱的條件下新增或變動的房間
+	ROOM_REMOVED	= enum.auto()	# 訂閱的條件下關閉或不再符合條件的房間
+	ROOM_BUSY		= enum.auto()	# 房間忙碌，請求沒有被處理 (請求的 protocol)
+
+@enum.unique
+class LOAD_LEVEL(enum.IntEnum):
+	NORMAL			= 0				# 正常運作
+	SOFT			= enum.auto()	# 負載偏高，不再建立新房間
+	HARD			= enum.auto()	# 負載過高，拒絕新的連線
+
+@enum.unique
+class RATE_LIMIT_ACTION(enum.IntEnum):
+	ALLOW			= 0				# 正常處理
+	DROP			= enum.auto()	# 丟棄這則訊息
+	DISCONNECT		= enum.auto()	# 中斷連線
+
+@enum.unique
+class KICK_REASON(enum.IntEnum):
+	LOBBY_IDLE		= 0				# 在大廳閒置太久
+	ROOM_IDLE		= enum.auto()	# 所在的房間遊戲中太久沒有任何操作，房間已關閉
+	RATE_LIMIT		= enum.auto()	# 持續送出過多訊息
+	SHUTDOWN		= enum.auto()	# 伺服器關閉，稍後可以重新連線 (或用 RESUME 接回)
+	WAITING_IDLE	= enum.auto()	# 所在的房間等待太久沒有開始遊戲，房間已關閉
+
+@enum.unique
+class RESUME_RESULT(enum.IntEnum):
+	FAILED			= 0				# 憑證無效或已過期，以新的使用者繼續
+	REPLAY			= enum.auto()	# 接著重送斷線期間沒收到的封包
+	RESYNC			= enum.auto()	# 遺漏太多，接著重送房間的 INIT
+
+@enum.unique
+class ROOM_LIST_STATE(enum.IntEnum):
+	ANY				= 0				# 不限
+	WAITING			= enum.auto()	# 等待開始的房間
+	PLAYING			= enum.auto()	# 遊戲進行中的房間
+
+@enum.unique
+class JOURNAL_EVENT(enum.IntEnum):
+	SNAPSHOT		= 0				# 從快照還原的房間狀態 (房間快照)
+	JOIN			= enum.auto()	# 使用者進入房間 (uid, name)
+	LEAVE			= enum.auto()	# 使用者離開房間 (uid)
+	RENAME			= enum.auto()	# 使用者更名 (uid, name)
+	REQUEST			= enum.auto()	# 房間內的請求 (uid, protocol, 內容)
+	SEED			= enum.auto()	# 亂數種子 (uint64)
+	TIMER			= enum.auto()	# 計時器到期 (處理函式名稱)
+	CLOSE			= enum.auto()	# 房間關閉
 
 @enum.unique
 class GAME_TYPE(enum.IntEnum):
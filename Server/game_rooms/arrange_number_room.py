@@ -1,13 +1,25 @@
 from collections.abc import Collection
+import heapq
 import random
+import struct
 from typing import cast, override
 
 from game_rooms.base_game_room import BaseGameRoom
+from game_rooms import number_dealer
 from game_define import PROTOCOL_CLIENT, PROTOCOL_SERVER, ARRANGE_NUMBER_STATE, GAME_TYPE
-import network
+import logger
+from logger import LOG_CATEGORY
+import packet_builder
+from packet_builder import PacketWriter
+from snapshot import SnapshotReader
 from user import User, BasePlayer
 
 
+_UINT64 = struct.Struct("<Q")
+# 大廳房間列表中的遊戲設定：最大數字, 數字組數, 每人數字數量
+_LISTING_SETTINGS = struct.Struct("<HBB")
+
+
 class Player(BasePlayer):
 	@override
 	def reset(self):
@@ -15,22 +27,46 @@ class Player(BasePlayer):
 		self.is_urgent: bool = False
 	
 	@override
-	def to_bytes(self) -> bytes:
-		data = bytes()
-		data += self.user.uid.to_bytes(2, byteorder="little")
-		data += len(self.numbers).to_bytes(1, byteorder="little")
+	def write_to(self, writer: PacketWriter):
+		writer.write_uint16(self.user.uid)
+		writer.write_uint8(len(self.numbers))
+		for number in self.numbers:
+			writer.write_uint16(number)
+		writer.write_bool(self.is_urgent)
+	
+	@override
+	def write_snapshot(self, writer: PacketWriter):
+		writer.write_uint8(len(self.numbers))
 		for number in self.numbers:
-			data += number.to_bytes(2, byteorder="little")
-		data += self.is_urgent.to_bytes(1, byteorder="little")
-		return data
+			writer.write_uint16(number)
+		writer.write_bool(self.is_urgent)
+	
+	@override
+	def read_snapshot(self, reader: SnapshotReader):
+		self.numbers = [reader.read_uint16() for _ in range(reader.read_uint8())]
+		self.is_urgent = reader.read_bool()
 
 
 class ArrangeNumberRoom(BaseGameRoom):
+	@override
+	def get_game_type(self) -> GAME_TYPE:
+		return GAME_TYPE.ARRANGE_NUMBER
+	
+	@override
+	def get_game_state(self) -> ARRANGE_NUMBER_STATE:
+		return self._game_state
+
 	@override
 	def _init_setting(self):
 		self._max_number = 100
 		self._number_group_count = 1
 		self._number_per_player = 1
+		# 最近一次發牌使用的亂數種子，可以用來重現牌局
+		self._deal_seed = 0
+
+	@override
+	def _get_listing_settings(self) -> bytes:
+		return _LISTING_SETTINGS.pack(self._max_number, self._number_group_count, self._number_per_player)
 
 	@override
 	def _reset_game(self):
@@ -39,6 +75,9 @@ class ArrangeNumberRoom(BaseGameRoom):
 		self._game_state = ARRANGE_NUMBER_STATE.WAITING
 		self._last_player_uid = 0
 		self._current_number = 0
+		# 每個還有數字的玩家手上最小的數字 (數字, uid)
+		# 出牌或玩家離開時不會移除舊的項目，取用時再略過已經過期的
+		self._lowest_numbers: list[tuple[int, int]] = []
 
 	@override
 	def _generate_player_object(self, user: User) -> Player | None:
@@ -53,27 +92,26 @@ class ArrangeNumberRoom(BaseGameRoom):
 
 		# 給每個玩家分配數字並通知
 		player_list: list[Player] = cast(list[Player], self._players.values())
-		if self._number_group_count == 0:  # 代表無限組，每個人各自隨機生成就好
-			for player in player_list:
-				for _ in range(self._number_per_player):
-					player.numbers.append(random.randint(1, self._max_number))
-		else:  # 有限組數，隨機生成數字組
-			# 先檢查數字量是否足夠
-			if self._number_group_count * self._max_number < len(player_list) * self._number_per_player:
-				return False
-			
-			# 從列表中抽指定數量數字
-			numbers = list(range(1, self._max_number + 1)) * self._number_group_count
-			for player in player_list:
-				for _ in range(self._number_per_player):
-					index = random.randint(0, len(numbers) - 1)
-					numbers[index], numbers[-1] = numbers[-1], numbers[index]
-					player.numbers.append(numbers.pop())
+		self._deal_seed = self._journal.next_seed()
+		hands = number_dealer.deal(
+			random.Random(self._deal_seed), self._max_number, self._number_group_count, len(player_list), self._number_per_player
+		)
+		if hands is None:  # 數字量不足
+			return False
+		
+		for player, hand in zip(player_list, hands):
+			player.numbers = hand
+		logger.debug(LOG_CATEGORY.GAME, "發牌種子 %d", self._deal_seed, room_id=self._room_id)
+		
 		# 先排好玩家的數字方便之後出牌時 pop
 		for player in player_list:
 			player.numbers.sort(reverse=True)
+		self._lowest_numbers = [(player.numbers[-1], player.user.uid) for player in player_list if player.numbers]
+		heapq.heapify(self._lowest_numbers)
 		
 		self._game_state = ARRANGE_NUMBER_STATE.PLAYING
+		self._player_sections.clear()
+		self._mark_state_dirty()
 		
 		# 通知所有玩家持有的數字
 		for player in player_list:
@@ -98,10 +136,20 @@ class ArrangeNumberRoom(BaseGameRoom):
 		self._reset_game()
 		await self._broadcast_end(is_force)
 
+	def _peek_lowest_number(self) -> int | None:
+		"""取得所有玩家手上最小的數字，沒有人有剩餘數字時返回 None。"""
+		while self._lowest_numbers:
+			number, uid = self._lowest_numbers[0]
+			player: Player | None = self._players.get(uid)
+			# 玩家手上的最小數字只會越來越大，數字不同就代表項目已經過期
+			if player and player.numbers and player.numbers[-1] == number:
+				return number
+			heapq.heappop(self._lowest_numbers)
+		return None
+
 	async def _check_left_numbers(self):
 		"""檢查是否還有剩餘的數字可以出牌。"""
-		player_list: list[Player] = cast(list[Player], self._players.values())
-		if any(len(player.numbers) > 0 for player in player_list):
+		if self._peek_lowest_number() is not None:
 			return
 		
 		await self._on_game_end_process()
@@ -119,7 +167,8 @@ class ArrangeNumberRoom(BaseGameRoom):
 			return
 		
 		self._max_number = max_number
-		print(f"房間編號 {self._room_id} 使用者 {uid} 設定最大數字為 {max_number}")
+		self._mark_state_dirty()
+		logger.debug(LOG_CATEGORY.GAME, "使用者設定最大數字為 %d", max_number, uid=uid, room_id=self._room_id)
 
 		await self._broadcast_settings()
 	
@@ -134,7 +183,8 @@ class ArrangeNumberRoom(BaseGameRoom):
 			return
 		
 		self._number_group_count = group_count
-		print(f"房間編號 {self._room_id} 使用者 {uid} 設定數字組數為 {group_count}")
+		self._mark_state_dirty()
+		logger.debug(LOG_CATEGORY.GAME, "使用者設定數字組數為 %d", group_count, uid=uid, room_id=self._room_id)
 
 		await self._broadcast_settings()
 
@@ -149,7 +199,8 @@ class ArrangeNumberRoom(BaseGameRoom):
 			return
 		
 		self._number_per_player = number_per_player
-		print(f"房間編號 {self._room_id} 使用者 {uid} 設定每人數字數量為 {number_per_player}")
+		self._mark_state_dirty()
+		logger.debug(LOG_CATEGORY.GAME, "使用者設定每人數字數量為 %d", number_per_player, uid=uid, room_id=self._room_id)
 
 		await self._broadcast_settings()
 
@@ -165,17 +216,22 @@ class ArrangeNumberRoom(BaseGameRoom):
 		
 		self._last_player_uid = uid
 		self._current_number = player.numbers.pop()
+		if player.numbers and player.numbers[-1] != self._current_number:
+			heapq.heappush(self._lowest_numbers, (player.numbers[-1], uid))
+		self._mark_player_dirty(uid)
+		self._mark_state_dirty()
 		await self._broadcast_pose_number()
 
 		# 檢查是不是最小數字的玩家
-		player_list: list[Player] = cast(list[Player], self._players.values())
-		if any(p.numbers[-1] < self._current_number for p in player_list if p.numbers):  # 有人數字更小，爆了
+		lowest_number = self._peek_lowest_number()
+		if lowest_number is not None and lowest_number < self._current_number:  # 有人數字更小，爆了
 			await self._on_game_end_process()
 			return
 		
 		if not player.numbers:  # 如果出完了所有數字，檢查是否還有其他玩家有剩
 			if player.is_urgent:  # 出完數字就沒什麼好急的了
 				player.is_urgent = False
+				self._mark_player_dirty(uid)
 				await self._boardcast_urgent_players(uid, False)
 			await self._send_all_player_numbers(player.user)  # 猜完的玩家可以看所有玩家的數字狀況
 			await self._check_left_numbers()
@@ -194,130 +250,97 @@ class ArrangeNumberRoom(BaseGameRoom):
 			return
 		
 		player.is_urgent = is_urgent
+		self._mark_player_dirty(uid)
 		
 		await self._boardcast_urgent_players(uid, is_urgent)
 
-	@override
-	async def _process_room_specific_request(self, user: User, protocol: PROTOCOL_CLIENT, message: bytes):
-		match protocol:
-			case PROTOCOL_CLIENT.SET_MAX_NUMBER:
-				max_number = int.from_bytes(message, byteorder="little")
-				await self._request_set_max_number(user.uid, max_number)
-			case PROTOCOL_CLIENT.SET_NUMBER_GROUP_COUNT:
-				group_count = message[0]
-				await self._request_set_number_group_count(user.uid, group_count)
-			case PROTOCOL_CLIENT.SET_NUMBER_PER_PLAYER:
-				number_per_player = message[0]
-				await self._request_set_number_per_player(user.uid, number_per_player)
-			case PROTOCOL_CLIENT.POSE_NUMBER:
-				await self._request_pose_number(user.uid)
-			case PROTOCOL_CLIENT.SET_URGENT:
-				is_urgent = message[0] != 0
-				await self._request_set_urgent(user.uid, is_urgent)
+	_REQUEST_HANDLERS = BaseGameRoom._REQUEST_HANDLERS | {
+		PROTOCOL_CLIENT.SET_MAX_NUMBER:			lambda room, user, max_number: room._request_set_max_number(user.uid, max_number),
+		PROTOCOL_CLIENT.SET_NUMBER_GROUP_COUNT:	lambda room, user, group_count: room._request_set_number_group_count(user.uid, group_count),
+		PROTOCOL_CLIENT.SET_NUMBER_PER_PLAYER:	lambda room, user, number_per_player: room._request_set_number_per_player(user.uid, number_per_player),
+		PROTOCOL_CLIENT.POSE_NUMBER:			lambda room, user: room._request_pose_number(user.uid),
+		PROTOCOL_CLIENT.SET_URGENT:				lambda room, user, is_urgent: room._request_set_urgent(user.uid, is_urgent),
+	}
 	
 	# server messages ===========================================================================
 
 	@override
-	async def _send_init_packet(self, user: User):
-		data = bytes()
-		# 房間的遊戲類型
-		data += GAME_TYPE.ARRANGE_NUMBER.to_bytes(1, byteorder="little")
-
-		# 使用者列表
-		data += len(self._user_ids).to_bytes(1, byteorder="little")
-		for user_id in self._user_ids:
-			target_user = self._manager.get_user(user_id)
-			data += target_user.to_bytes()
-		# 玩家列表
-		data += len(self._players).to_bytes(1, byteorder="little")
-		for player in self._players.values():
-			data += player.to_bytes()
+	def _write_state_section(self, writer: PacketWriter):
 		# 遊戲設定
-		data += self._max_number.to_bytes(2, byteorder="little")
-		data += self._number_group_count.to_bytes(1, byteorder="little")
-		data += self._number_per_player.to_bytes(1, byteorder="little")
+		writer.write_uint16(self._max_number)
+		writer.write_uint8(self._number_group_count)
+		writer.write_uint8(self._number_per_player)
 		# 遊戲階段
-		data += self._game_state.to_bytes(1, byteorder="little")
+		writer.write_uint8(self._game_state)
 		# 當前數字
-		data += self._last_player_uid.to_bytes(2, byteorder="little")
-		data += self._current_number.to_bytes(2, byteorder="little")
+		writer.write_uint16(self._last_player_uid)
+		writer.write_uint16(self._current_number)
+	
+	@override
+	def _write_snapshot_state(self, writer: PacketWriter):
+		# 遊戲設定
+		writer.write_uint16(self._max_number)
+		writer.write_uint8(self._number_group_count)
+		writer.write_uint8(self._number_per_player)
+		writer.write_struct(_UINT64, self._deal_seed)
+		# 遊戲階段
+		writer.write_uint8(self._game_state)
+		writer.write_uint16(self._last_player_uid)
+		writer.write_uint16(self._current_number)
+	
+	@override
+	def _read_snapshot_state(self, reader: SnapshotReader):
+		self._max_number = reader.read_uint16()
+		self._number_group_count = reader.read_uint8()
+		self._number_per_player = reader.read_uint8()
+		self._deal_seed = reader.read_uint64()
+		self._game_state = ARRANGE_NUMBER_STATE(reader.read_uint8())
+		self._last_player_uid = reader.read_uint16()
+		self._current_number = reader.read_uint16()
 		
-		packet = network.new_packet(PROTOCOL_SERVER.INIT, data)
-		try:
-			await user.socket.send(packet)
-		except:
-			pass
+		self._lowest_numbers = [(player.numbers[-1], uid) for uid, player in self._players.items() if player.numbers]
+		heapq.heapify(self._lowest_numbers)
 	
 	async def _send_self_numbers(self, player: Player):
-		data = bytes()
-		data += (0).to_bytes(1, byteorder="little")  # 0 代表更新玩家自身，1 代表更新所有玩家
-		data += len(player.numbers).to_bytes(1, byteorder="little")
+		writer = packet_builder.begin(PROTOCOL_SERVER.PLAYER_NUMBERS)
+		writer.write_uint8(0)  # 0 代表更新玩家自身，1 代表更新所有玩家
+		writer.write_uint8(len(player.numbers))
 		for number in player.numbers:
-			data += number.to_bytes(2, byteorder="little")
+			writer.write_uint16(number)
 		
-		packet = network.new_packet(PROTOCOL_SERVER.PLAYER_NUMBERS, data)
-		try:
-			await player.user.socket.send(packet)
-		except:
-			pass
+		player.user.send(writer.finish())
 
-	def _get_all_player_numbers_packet(self) -> bytes:
+	def _build_all_player_numbers_packet(self) -> bytes:
 		player_list: list[Player] = cast(list[Player], self._players.values())
 
-		data = bytes()
-		data += len(player_list).to_bytes(1, byteorder="little")
+		writer = packet_builder.begin(PROTOCOL_SERVER.PLAYER_NUMBERS)
+		writer.write_uint8(1)  # 0 代表更新玩家自身，1 代表更新所有玩家
+		self._write_count(writer, len(player_list))
 		for player in player_list:
-			data += player.user.uid.to_bytes(2, byteorder="little")
-			data += len(player.numbers).to_bytes(1, byteorder="little")
+			writer.write_uint16(player.user.uid)
+			writer.write_uint8(len(player.numbers))
 			for number in player.numbers:
-				data += number.to_bytes(2, byteorder="little")
-		return data
+				writer.write_uint16(number)
+		return writer.finish()
 
 	async def _send_all_player_numbers(self, user: User):
-		data = bytes()
-		data += (1).to_bytes(1, byteorder="little")  # 0 代表更新玩家自身，1 代表更新所有玩家
-		data += self._get_all_player_numbers_packet()
-		
-		packet = network.new_packet(PROTOCOL_SERVER.PLAYER_NUMBERS, data)
-		try:
-			await user.socket.send(packet)
-		except:
-			pass
+		user.send(self._build_all_player_numbers_packet())
 
 	async def _broadcast_all_player_numbers(self, exclude_clients: Collection[int] = {}):
-		data = bytes()
-		data += (1).to_bytes(1, byteorder="little")  # 0 代表更新玩家自身，1 代表更新所有玩家
-		data += self._get_all_player_numbers_packet()
-		
-		packet = network.new_packet(PROTOCOL_SERVER.PLAYER_NUMBERS, data)
-		await self._broadcast(packet, exclude_clients)
+		await self._broadcast(self._build_all_player_numbers_packet(), exclude_clients)
 
 	async def _broadcast_settings(self):
-		data = bytes()
-		data += self._max_number.to_bytes(2, byteorder="little")
-		data += self._number_group_count.to_bytes(1, byteorder="little")
-		data += self._number_per_player.to_bytes(1, byteorder="little")
-		
-		packet = network.new_packet(PROTOCOL_SERVER.SETTINGS, data)
+		packet = packet_builder.pack(PROTOCOL_SERVER.SETTINGS, self._max_number, self._number_group_count, self._number_per_player)
 		await self._broadcast(packet)
 	
 	async def _broadcast_pose_number(self):
-		data = bytes()
-		data += self._last_player_uid.to_bytes(2, byteorder="little")
-		data += self._current_number.to_bytes(2, byteorder="little")
-		
-		packet = network.new_packet(PROTOCOL_SERVER.POSE_NUMBER, data)
+		packet = packet_builder.pack(PROTOCOL_SERVER.POSE_NUMBER, self._last_player_uid, self._current_number)
 		await self._broadcast(packet)
 
 	async def _boardcast_urgent_players(self, uid: int, is_urgent: bool):
-		data = bytes()
-		data += uid.to_bytes(2, byteorder="little")
-		data += (1 if is_urgent else 0).to_bytes(1, byteorder="little")
-		
-		packet = network.new_packet(PROTOCOL_SERVER.URGENT_PLAYER, data)
+		packet = packet_builder.pack(PROTOCOL_SERVER.URGENT_PLAYER, uid, 1 if is_urgent else 0)
 		await self._broadcast(packet)
 
 	async def _broadcast_end(self, is_force: bool = False):
-		end_type = 1 if is_force else 0
-		packet = network.new_packet(PROTOCOL_SERVER.END, end_type.to_bytes(1, byteorder="little"))
+		packet = packet_builder.pack(PROTOCOL_SERVER.END, 1 if is_force else 0)
 		await self._broadcast(packet)
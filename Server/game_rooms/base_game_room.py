@@ -1,23 +1,93 @@
 import asyncio
 import abc
-from collections.abc import Collection
+import bisect
+import enum
+import struct
+import time
+from collections.abc import Awaitable, Callable, Collection
 
-from game_define import PROTOCOL_CLIENT, PROTOCOL_SERVER, CONST
+from config import CONFIG
+from game_define import PROTOCOL_CLIENT, PROTOCOL_SERVER, GAME_TYPE, CONST
 from managers.user_manager_interface import IUserManager
 import id_generator
+import journal
+import logger
+from logger import LOG_CATEGORY
+from message_decoder import Request
+import metrics
 import network
+import packet_builder
+import room_directory
+from room_directory import RoomListing
+from snapshot import SnapshotError, SnapshotReader
+import timer_wheel
+from timer_wheel import Timer
 from user import User, BasePlayer
 
 
+ROOM_COMMAND_QUEUE_SIZE: int = CONFIG.get("ROOM_COMMAND_QUEUE_SIZE", 256)
+# 指令佇列已滿時，請求最多等待排入的秒數，等待期間暫停讀取該連線的訊息
+ROOM_REQUEST_WAIT: float = CONFIG.get("ROOM_REQUEST_WAIT", 2.0)
+# 一般房間的人數上限，INIT 等封包的數量欄位只有 1 byte，不能超過 255
+ROOM_MAX_USERS: int = min(CONFIG.get("ROOM_MAX_USERS", 255), 0xFF)
+# 大型房間的人數上限
+LARGE_ROOM_MAX_USERS: int = CONFIG.get("LARGE_ROOM_MAX_USERS", 2000)
+# 大型房間 LARGE_INIT 與 USER_LIST 每頁列出的使用者數量 (LARGE_INIT 另外一定會列出所有玩家)
+LARGE_ROOM_PAGE_SIZE: int = CONFIG.get("LARGE_ROOM_PAGE_SIZE", 100)
+# 大型房間累積觀眾封包後合併送出的間隔 (秒)
+SPECTATOR_FLUSH_INTERVAL: float = CONFIG.get("SPECTATOR_FLUSH_INTERVAL", 0.25)
+
+# protocol, 遊戲類型, 使用者總數, 列出的使用者數量
+_LARGE_INIT_HEADER = struct.Struct("<BBHH")
+# 下一頁的 after_uid (0 代表沒有下一頁), 玩家數量
+_LARGE_INIT_PLAYERS = struct.Struct("<HH")
+
+# 佇列已滿時直接丟棄的請求，遺失不會影響遊戲狀態
+_DROPPABLE_REQUESTS = frozenset((PROTOCOL_CLIENT.CHAT,))
+
+_Command = tuple[Callable[..., Awaitable], tuple, asyncio.Future | None]
+
+
 class BaseGameRoom(abc.ABC):
-	def __init__(self, id: int, user_manager: IUserManager):
+	"""遊戲房間的基礎類別。
+
+	房間狀態只會在房間自己的 task 中修改：所有操作都先排入指令佇列，
+	再由 `_run` 依序執行，因此不同使用者的請求不會在 await 之間交錯。
+
+	大型房間 (`large`) 可以容納超過 255 人，封包中的數量欄位改為 uint16，
+	INIT 改為只列出第一頁使用者的 LARGE_INIT，其餘由客戶端用 FETCH_USERS 分頁取得。
+	廣播只即時送給玩家，觀眾的封包每 SPECTATOR_FLUSH_INTERVAL 秒合併成 BATCH 送出一次。
+	"""
+	def __init__(self, id: int, user_manager: IUserManager, large: bool = False):
 		self._room_id = id
 		self._manager = user_manager
+		self._large = large
 		self._is_playing = False
 		
 		self._user_ids: set[int] = set()
+		self._sorted_uids: list[int] = []  # 依 UID 排序的使用者，用於分頁
 		self._players: dict[int, BasePlayer] = dict()
-		self._countdown_timer: asyncio.Task = None
+		self._countdown_timer: Timer | None = None
+		self._timers: dict[str, Timer] = {}  # 各計時器處理函式最後一次排定的計時器
+		
+		# INIT 封包的快取，各區段在對應的資料變動時才重新序列化
+		self._init_packet: bytes | None = None
+		self._user_sections: dict[int, bytes] = {}
+		self._player_sections: dict[int, bytes] = {}
+		self._state_section: bytes | None = None
+		# 房間快照的快取，INIT 的任何區段變動時一起作廢
+		self._snapshot: bytes | None = None
+		# 大型房間中等待合併送給觀眾的 (封包, 不送出的使用者)
+		self._spectator_packets: list[tuple[bytes, Collection[int]]] = []
+		# 累積期間才成為觀眾的使用者，只送出 _spectator_packets 中從這個位置開始的封包
+		self._spectator_offsets: dict[int, int] = {}
+		self._spectator_timer: Timer | None = None
+		
+		self._commands: asyncio.Queue[_Command] = asyncio.Queue(ROOM_COMMAND_QUEUE_SIZE)
+		self._actor: asyncio.Task | None = None
+		self._closed = False
+		self._last_active = time.monotonic()  # 最後一次處理房間指令的時間
+		self._journal = journal.open_room(self.get_game_type(), id, large)
 
 		self._init_setting()
 		self._reset_game()
@@ -26,12 +96,26 @@ class BaseGameRoom(abc.ABC):
 		"""遊戲房間初始設定。"""
 
 	@classmethod
-	def create(cls, user_manager: IUserManager):
+	def create(cls, user_manager: IUserManager, large: bool = False):
 		"""創建遊戲房間。"""
 		room_id = id_generator.generate_room_id()
 		if room_id < 0:
 			return None
-		return cls(room_id, user_manager)
+		return cls(room_id, user_manager, large)
+	
+	@classmethod
+	def create_restored(cls, user_manager: IUserManager, room_id: int, large: bool = False):
+		"""用快照中的房間編號創建遊戲房間，編號無法使用時返回 None。"""
+		if not id_generator.reserve_room_id(room_id):
+			return None
+		return cls(room_id, user_manager, large)
+	
+	@classmethod
+	def create_replay(cls, user_manager: IUserManager, room_id: int, room_journal: journal.Journal, large: bool = False):
+		"""創建重播紀錄用的遊戲房間，不佔用房間編號，亂數種子由 `room_journal` 提供。"""
+		room = cls(room_id, user_manager, large)
+		room._journal = room_journal
+		return room
 	
 	def get_id(self):
 		"""取得房間編號。"""
@@ -41,26 +125,233 @@ class BaseGameRoom(abc.ABC):
 		"""檢查是否為空房間。"""
 		return not self._user_ids
 	
-	async def add_user(self, user: User):
-		"""使用者進入房間。"""
-		if user.uid in self._user_ids:
+	def is_full(self) -> bool:
+		"""檢查房間人數是否已達上限。"""
+		return len(self._user_ids) >= (LARGE_ROOM_MAX_USERS if self._large else ROOM_MAX_USERS)
+	
+	def is_playing(self) -> bool:
+		"""檢查是否有進行中的遊戲。"""
+		return self._is_playing
+	
+	def get_user_ids(self) -> Collection[int]:
+		"""取得房間內所有使用者的 UID。"""
+		return self._user_ids
+	
+	def get_last_active(self) -> float:
+		"""取得最後一次處理房間指令的時間 (time.monotonic)。"""
+		return self._last_active
+	
+	def get_listing(self) -> RoomListing:
+		"""取得大廳房間列表中顯示的房間資訊。"""
+		return RoomListing(
+			self._room_id, self.get_game_type(), self._large, self._is_playing,
+			len(self._user_ids), len(self._players), self._get_listing_settings()
+		)
+	
+	def _get_listing_settings(self) -> bytes:
+		"""取得大廳房間列表中顯示的遊戲設定，沒有可調整設定的遊戲為空。"""
+		return b""
+	
+	@abc.abstractmethod
+	def get_game_type(self) -> GAME_TYPE:
+		"""取得房間的遊戲類型。"""
+	
+	@abc.abstractmethod
+	def get_game_state(self) -> enum.IntEnum:
+		"""取得房間目前的遊戲階段。"""
+	
+	# room actor ===========================================================================
+	
+	def _ensure_actor(self):
+		if not self._actor:
+			self._actor = asyncio.create_task(self._run())
+	
+	async def _run(self):
+		"""依序執行指令佇列中的操作。"""
+		while True:
+			handler, args, future = await self._commands.get()
+			self._last_active = time.monotonic()
+			try:
+				result = await handler(*args)
+			except Exception as e:
+				if future and not future.done():
+					future.set_exception(e)
+				else:
+					logger.exception(LOG_CATEGORY.ROOM, "處理房間指令時發生錯誤：%s", e, room_id=self._room_id)
+			else:
+				if future and not future.done():
+					future.set_result(result)
+	
+	async def post_request(self, user: User, request: Request) -> bool:
+		"""把使用者的請求排入指令佇列，不等待處理完成。
+		
+		佇列已滿時，聊天等可以遺失的請求直接丟棄，其他請求最多等待 ROOM_REQUEST_WAIT 秒，
+		期間呼叫端 (該連線的接收迴圈) 暫停讀取，仍然無法排入時回覆 ROOM_BUSY，
+		讓客戶端知道這個操作沒有生效。無法排入時返回 False
+		"""
+		if self._closed:
+			return False
+		
+		command = (self._process_posted_request, (user, request), None)
+		try:
+			self._commands.put_nowait(command)
+		except asyncio.QueueFull:
+			if request.protocol in _DROPPABLE_REQUESTS:
+				return False
+			try:
+				await asyncio.wait_for(self._commands.put(command), ROOM_REQUEST_WAIT)
+			except asyncio.TimeoutError:
+				user.send(packet_builder.pack(PROTOCOL_SERVER.ROOM_BUSY, request.protocol))
+				return False
+		
+		self._ensure_actor()
+		return True
+	
+	async def _process_posted_request(self, user: User, request: Request):
+		started = time.perf_counter()
+		self._journal.record_request(user.uid, request.protocol, request.payload)
+		await self.process_request(user, request)
+		metrics.observe_room_request(request.protocol, time.perf_counter() - started)
+	
+	async def _enqueue(self, handler: Callable[..., Awaitable], *args, future: asyncio.Future | None = None):
+		"""把房間操作排入指令佇列，佇列已滿時等待。"""
+		self._ensure_actor()
+		await self._commands.put((handler, args, future))
+	
+	async def submit(self, handler: Callable[..., Awaitable], *args):
+		"""把房間操作排入指令佇列並等待處理結果。
+		
+		房間已關閉時返回 None
+		"""
+		if self._closed:
+			return None
+		
+		future = asyncio.get_running_loop().create_future()
+		await self._enqueue(handler, *args, future=future)
+		return await future
+	
+	def _schedule(self, delay: float, handler: Callable[[Timer], Awaitable]) -> Timer:
+		"""在 `delay` 秒後於房間的 task 中執行 `handler(timer)`。
+		
+		計時器可能在取消前就已經排入指令佇列，`handler` 需要確認 timer 仍然是當前的計時器。
+		`handler` 必須是房間的方法，重播紀錄時以方法名稱找回。
+		"""
+		name = handler.__name__
+		timer = timer_wheel.schedule(delay, lambda: self._post_timer(name, timer))
+		self._timers[name] = timer
+		return timer
+	
+	def _post_timer(self, name: str, timer: Timer):
+		if self._closed:
 			return
 		
+		try:
+			self._commands.put_nowait((self._fire_timer, (name, timer), None))
+		except asyncio.QueueFull:
+			# 計時器事件不能丟棄，等佇列有空位再排入
+			asyncio.create_task(self._enqueue(self._fire_timer, name, timer))
+			return
+		self._ensure_actor()
+	
+	async def _fire_timer(self, name: str, timer: Timer):
+		# 已經被同名的新計時器取代的話 handler 不會有任何動作，不需要記錄
+		if self._timers.get(name) is timer:
+			self._journal.record_timer(name)
+		await getattr(self, name)(timer)
+	
+	async def fire_timer(self, name: str):
+		"""立即觸發最後一次排定的 `name` 計時器 (重播紀錄使用)。"""
+		timer = self._timers.get(name)
+		if timer:
+			await getattr(self, name)(timer)
+	
+	def close(self):
+		"""關閉房間、釋放房間編號並放棄佇列中還沒處理的指令。"""
+		if self._closed:
+			return
+		
+		self._closed = True
+		id_generator.release_room_id(self._room_id)
+		if self._actor:
+			self._actor.cancel()
+			self._actor = None
+		if self._countdown_timer:
+			self._countdown_timer.cancel()
+			self._countdown_timer = None
+		if self._spectator_timer:
+			self._spectator_timer.cancel()
+			self._spectator_timer = None
+		self._spectator_packets.clear()
+		self._spectator_offsets.clear()
+		self._journal.close()
+		
+		while not self._commands.empty():
+			_, _, future = self._commands.get_nowait()
+			if future and not future.done():
+				future.set_result(None)
+	
+	# room members ===========================================================================
+	
+	async def add_user(self, user: User) -> bool:
+		"""使用者進入房間。
+		
+		房間已關閉或已滿時返回 False
+		"""
+		if self._closed:
+			return False
+		if user.uid in self._user_ids:
+			return True
+		if self.is_full():
+			return False
+		
+		# 新使用者的 INIT 已經包含還在累積的觀眾封包
+		self._skip_pending_spectator_packets(user.uid)
+		self._journal.record_join(user.uid, user.name)
 		self._user_ids.add(user.uid)
+		bisect.insort(self._sorted_uids, user.uid)
+		self._mark_members_dirty()
 		
 		await self._send_init_packet(user)
 		await self._broadcast_connect(user.uid, user.name)
+		return True
 	
 	async def remove_user(self, uid: int):
 		"""使用者離開房間。"""
 		if uid not in self._user_ids:
 			return
 		
+		self._journal.record_leave(uid)
 		self._user_ids.remove(uid)
+		del self._sorted_uids[bisect.bisect_left(self._sorted_uids, uid)]
+		self._spectator_offsets.pop(uid, None)
+		self._mark_user_dirty(uid)
 		await self._remove_player(uid)
 		
 		await self._broadcast_disconnect(uid)
 	
+	def send_user_page(self, user: User, after_uid: int):
+		"""送出 UID 大於 `after_uid` 的下一頁使用者 (FETCH_USERS)。
+		
+		只讀取房間成員，由 `GameManager` 直接呼叫，不佔用指令佇列
+		"""
+		uids, next_uid = self._get_user_page(after_uid)
+		sections = [self._get_user_section(uid) for uid in uids]
+		
+		writer = packet_builder.begin(PROTOCOL_SERVER.USER_LIST)
+		writer.write_uint16(after_uid).write_uint16(len(sections))
+		for section in sections:
+			writer.write_bytes(section)
+		writer.write_uint16(next_uid)
+		user.send(writer.finish())
+	
+	async def resync_user(self, uid: int):
+		"""重新發送 INIT 給重新連線後無法補齊遺漏封包的使用者。"""
+		if uid not in self._user_ids:
+			return
+		if uid not in self._players:
+			self._skip_pending_spectator_packets(uid)
+		await self._send_init_packet(self._manager.get_user(uid))
+	
 	@abc.abstractmethod
 	def _generate_player_object(self, user: User) -> BasePlayer | None:
 		"""生成玩家物件。
@@ -77,8 +368,11 @@ class BaseGameRoom(abc.ABC):
 		if not player:
 			return
 		
+		# 觀眾改為即時收到廣播之前，先送出還在累積的封包以維持順序
+		self._send_pending_spectator_packets(user)
 		self._players[user.uid] = player
-		print(f"房間編號 {self._room_id} 使用者 {user.uid} 加入遊戲")
+		self._mark_members_dirty()
+		logger.debug(LOG_CATEGORY.GAME, "使用者加入遊戲", uid=user.uid, room_id=self._room_id)
 		
 		await self._stop_countdown()
 		await self._broadcast_join(user.uid)
@@ -93,8 +387,11 @@ class BaseGameRoom(abc.ABC):
 			return
 		
 		await self._stop_countdown()
+		# 改為觀眾之前的廣播都已經即時收到了
+		self._skip_pending_spectator_packets(uid)
 		del self._players[uid]
-		print(f"房間編號 {self._room_id} 使用者 {uid} 退出遊戲")
+		self._mark_player_dirty(uid)
+		logger.debug(LOG_CATEGORY.GAME, "使用者退出遊戲", uid=uid, room_id=self._room_id)
 
 		await self._on_remove_player_game_process(uid)
 		await self._broadcast_leave(uid)
@@ -110,7 +407,7 @@ class BaseGameRoom(abc.ABC):
 			return
 		
 		await self._start_countdown()
-		print(f"房間編號 {self._room_id} 使用者 {uid} 要求開始遊戲")
+		logger.debug(LOG_CATEGORY.GAME, "使用者要求開始遊戲", uid=uid, room_id=self._room_id)
 
 	async def _request_cancel_start(self, uid):
 		if self._is_playing:
@@ -119,38 +416,33 @@ class BaseGameRoom(abc.ABC):
 			return
 		
 		await self._stop_countdown()
-		print(f"房間編號 {self._room_id} 使用者 {uid} 取消開始遊戲倒數")
-	
-	async def process_request(self, user: User, protocol: PROTOCOL_CLIENT, message: bytes):
-		"""處理使用者的房間相關操作請求。"""
-		match protocol:
-			case PROTOCOL_CLIENT.JOIN_GAME:
-				await self._add_player(user)
-			case PROTOCOL_CLIENT.LEAVE_GAME:
-				await self._remove_player(user.uid)
-			case PROTOCOL_CLIENT.START:
-				await self._request_start(user.uid)
-			case PROTOCOL_CLIENT.CANCEL_START:
-				await self._request_cancel_start(user.uid)
-			case PROTOCOL_CLIENT.CHAT:
-				if len(message) > 257:  # 255 for name + 2 for hide_uid
-					return
-				
-				hide_uid = int.from_bytes(message[:2], byteorder="little")
-				await self._broadcast_chat(user.uid, message[2:], {hide_uid} if hide_uid > 0 else {})
-			case _:
-				# 處理不同類型房間特定的請求
-				await self._process_room_specific_request(user, protocol, message)
+		logger.debug(LOG_CATEGORY.GAME, "使用者取消開始遊戲倒數", uid=uid, room_id=self._room_id)
 	
-	@abc.abstractmethod
-	async def _process_room_specific_request(self, user: User, protocol: PROTOCOL_CLIENT, message: bytes):
-		"""處理非房間共用機制的客戶端請求。"""
+	async def _request_chat(self, uid: int, hide_uid: int, encoded_message: bytes):
+		await self._broadcast_chat(uid, encoded_message, {hide_uid} if hide_uid > 0 else {})
+	
+	# 房間內請求的處理函式，參數為 (room, user, 訊息欄位...)，欄位由 `message_decoder` 依格式解析
+	# 子類別以 `BaseGameRoom._REQUEST_HANDLERS | {...}` 加入自己的請求
+	_REQUEST_HANDLERS: dict[PROTOCOL_CLIENT, Callable[..., Awaitable]] = {
+		PROTOCOL_CLIENT.JOIN_GAME:		lambda room, user: room._add_player(user),
+		PROTOCOL_CLIENT.LEAVE_GAME:		lambda room, user: room._remove_player(user.uid),
+		PROTOCOL_CLIENT.START:			lambda room, user: room._request_start(user.uid),
+		PROTOCOL_CLIENT.CANCEL_START:	lambda room, user: room._request_cancel_start(user.uid),
+		PROTOCOL_CLIENT.CHAT:			lambda room, user, hide_uid, message: room._request_chat(user.uid, hide_uid, message),
+	}
+	
+	async def process_request(self, user: User, request: Request):
+		"""處理使用者的房間相關操作請求，這種房間不支援的請求直接忽略。"""
+		handler = self._REQUEST_HANDLERS.get(request.protocol)
+		if handler:
+			await handler(self, user, *request.args)
 	
 	# game flows ===========================================================================
 	
-	async def _countdown_async(self):
-		"""倒數開始計時器。"""
-		await asyncio.sleep(CONST.START_COUNTDOWN_DURATION)
+	async def _on_countdown_end(self, timer: Timer):
+		"""倒數結束，在房間的 task 中開始遊戲。"""
+		if self._countdown_timer is not timer:  # 排隊期間倒數已被取消
+			return
 		await self._start_game()
 
 	async def _start_countdown(self):
@@ -158,7 +450,7 @@ class BaseGameRoom(abc.ABC):
 		if self._countdown_timer:
 			return
 		
-		self._countdown_timer = asyncio.create_task(self._countdown_async())
+		self._countdown_timer = self._schedule(CONST.START_COUNTDOWN_DURATION, self._on_countdown_end)
 		await self._broadcast_start_countdown()
 	
 	async def _stop_countdown(self):
@@ -197,101 +489,287 @@ class BaseGameRoom(abc.ABC):
 		self._is_playing = False
 		for player in self._players.values():
 			player.reset()
+		
+		self._player_sections.clear()
+		self._mark_state_dirty()
 	
 	# server messages ===========================================================================
 
+	def _mark_members_dirty(self):
+		"""房間成員變動，INIT 封包需要重新組合。"""
+		self._init_packet = None
+		self._snapshot = None
+		room_directory.directory.mark_dirty(self._room_id)
+	
+	def _mark_user_dirty(self, uid: int):
+		"""使用者資訊變動，INIT 封包中該使用者的區段需要重建。"""
+		self._user_sections.pop(uid, None)
+		self._mark_members_dirty()
+	
+	def _mark_player_dirty(self, uid: int):
+		"""玩家資料變動，INIT 封包中該玩家的區段需要重建。"""
+		self._player_sections.pop(uid, None)
+		self._mark_members_dirty()
+	
+	def _mark_state_dirty(self):
+		"""房間的遊戲狀態變動，INIT 封包的狀態區段需要重建。"""
+		self._state_section = None
+		self._mark_members_dirty()
+	
+	@abc.abstractmethod
+	def _write_state_section(self, writer: packet_builder.PacketWriter):
+		"""寫入 INIT 封包中接在玩家列表後面的房間遊戲狀態。"""
+	
+	def _write_count(self, writer: packet_builder.PacketWriter, count: int):
+		"""寫入封包中的數量或索引欄位，大型房間使用 uint16。"""
+		if self._large:
+			writer.write_uint16(count)
+		else:
+			writer.write_uint8(count)
+	
+	def _get_user_section(self, uid: int) -> bytes:
+		"""取得使用者資訊序列化後的內容。"""
+		section = self._user_sections.get(uid)
+		if section is None:
+			writer = packet_builder.begin_section()
+			self._manager.get_user(uid).write_to(writer)
+			section = self._user_sections[uid] = writer.finish()
+		return section
+	
+	def _get_user_page(self, after_uid: int) -> tuple[list[int], int]:
+		"""取得 UID 大於 `after_uid` 的一頁使用者，返回 (UID 列表, 下一頁的 after_uid)。
+		
+		沒有下一頁時 after_uid 為 0
+		"""
+		start = bisect.bisect_right(self._sorted_uids, after_uid)
+		uids = self._sorted_uids[start:start + LARGE_ROOM_PAGE_SIZE]
+		has_more = start + LARGE_ROOM_PAGE_SIZE < len(self._sorted_uids)
+		return uids, uids[-1] if has_more else 0
+
+	def _build_init_packet(self) -> bytes:
+		"""取得房間當前狀態的初始化封包。
+		
+		沒有變動的區段直接沿用上次序列化的結果，只重建被標記過的部分。
+		"""
+		if self._init_packet is not None:
+			return self._init_packet
+		
+		if self._large:
+			uids, next_uid = self._get_user_page(0)
+			# 玩家不論在第幾頁都要列出，客戶端才能顯示玩家名稱
+			listed = set(uids)
+			uids += [uid for uid in self._players if uid not in listed]
+			sections = [_LARGE_INIT_HEADER.pack(PROTOCOL_SERVER.LARGE_INIT, self.get_game_type(), len(self._user_ids), len(uids))]
+		else:
+			uids = self._user_ids
+			sections = [bytes((PROTOCOL_SERVER.INIT, self.get_game_type(), len(self._user_ids)))]
+		# 使用者列表
+		for uid in uids:
+			sections.append(self._get_user_section(uid))
+		# 玩家列表
+		if self._large:
+			sections.append(_LARGE_INIT_PLAYERS.pack(next_uid, len(self._players)))
+		else:
+			sections.append(bytes((len(self._players),)))
+		for uid, player in self._players.items():
+			section = self._player_sections.get(uid)
+			if section is None:
+				writer = packet_builder.begin_section()
+				player.write_to(writer)
+				section = self._player_sections[uid] = writer.finish()
+			sections.append(section)
+		# 遊戲狀態
+		if self._state_section is None:
+			writer = packet_builder.begin_section()
+			self._write_state_section(writer)
+			self._state_section = writer.finish()
+		sections.append(self._state_section)
+		
+		self._init_packet = b"".join(sections)
+		return self._init_packet
+
+	# snapshot ===========================================================================
+	
+	def get_snapshot(self) -> bytes:
+		"""取得房間完整狀態的快照，沒有變動時直接返回上次的結果。
+		
+		格式為 [遊戲類型][房間編號][是否為大型房間][使用者列表][玩家列表][房間遊戲狀態]，
+		開頭到使用者列表由 `GameManager` 讀取，之後的部分由 `restore_snapshot` 讀取
+		"""
+		if self._snapshot is not None:
+			return self._snapshot
+		
+		writer = packet_builder.begin_section()
+		writer.write_uint8(self.get_game_type()).write_uint32(self._room_id).write_bool(self._large)
+		writer.write_uint16(len(self._user_ids))
+		for uid in self._user_ids:
+			user = self._manager.get_user(uid)
+			writer.write_uint16(uid).write_string(user.name).write_bytes(user.session_token or bytes(16))
+		writer.write_bool(self._is_playing)
+		writer.write_uint16(len(self._players))
+		for uid, player in self._players.items():
+			writer.write_uint16(uid)
+			player.write_snapshot(writer)
+		self._write_snapshot_state(writer)
+		
+		self._snapshot = writer.finish()
+		return self._snapshot
+	
+	def restore_snapshot(self, reader: SnapshotReader, users: Collection[User]):
+		"""從快照還原房間狀態，`users` 為已經還原的房間內使用者。"""
+		for user in users:
+			self._user_ids.add(user.uid)
+		self._sorted_uids = sorted(self._user_ids)
+		is_playing = reader.read_bool()
+		for _ in range(reader.read_uint16()):
+			uid = reader.read_uint16()
+			if uid not in self._user_ids:
+				raise SnapshotError("玩家不在房間內")
+			user = self._manager.get_user(uid)
+			# 還原遊戲狀態之前房間還在等待階段，一定可以建立玩家物件
+			player = self._generate_player_object(user)
+			player.read_snapshot(reader)
+			self._players[user.uid] = player
+		self._read_snapshot_state(reader)
+		self._is_playing = is_playing
+		# 還原後的狀態作為紀錄的起點
+		self._journal.record_snapshot(self.get_snapshot())
+	
+	@abc.abstractmethod
+	def _write_snapshot_state(self, writer: packet_builder.PacketWriter):
+		"""寫入快照中接在玩家列表後面的房間設定與遊戲狀態。"""
+	
 	@abc.abstractmethod
+	def _read_snapshot_state(self, reader: SnapshotReader):
+		"""讀取 `_write_snapshot_state` 寫入的內容。"""
+	
 	async def _send_init_packet(self, user: User):
 		"""發送初始化封包給新進房間的使用者。"""
+		user.send(self._build_init_packet())
 
 	async def _broadcast(self, packet: bytes, exclude_clients: Collection[int] = {}):
-		"""廣播訊息給所有房間內的使用者。"""
-		disconnected_users = []
-		for uid in self._user_ids:
+		"""廣播訊息給所有房間內的使用者。
+		
+		封包只建立一次，排入每個使用者各自的發送佇列後同時送出，不等待任何一個連線。
+		跟不上的連線由發送佇列依設定的策略處理，斷線清理則交給該連線的接收迴圈。
+		大型房間只即時送給玩家，觀眾的部分交給 `_flush_spectators` 合併送出。
+		"""
+		started = time.perf_counter()
+		if self._large:
+			recipients = self._players.keys()
+			self._spectator_packets.append((packet, exclude_clients))
+			if not self._spectator_timer:
+				self._spectator_timer = timer_wheel.schedule(SPECTATOR_FLUSH_INTERVAL, self._flush_spectators)
+		else:
+			recipients = self._user_ids
+		
+		fanout = 0
+		for uid in recipients:
 			if uid not in exclude_clients:
-				user = self._manager.get_user(uid)
-				try:
-					await user.socket.send(packet)
-				except:
-					disconnected_users.append(user)
+				self._manager.get_user(uid).send(packet)
+				fanout += 1
+		metrics.observe_broadcast(packet[0], fanout, time.perf_counter() - started)
+	
+	def _flush_spectators(self):
+		"""把累積的廣播合併成 BATCH 送給大型房間的觀眾 (不是玩家的使用者)。
 		
-		for user in disconnected_users:
-			await self._manager.remove_user(user)
+		合併後的封包只建立一次，所有觀眾共用，只有被排除在某個廣播之外
+		或累積期間才成為觀眾的使用者另外組合。
+		這裡只讀取房間成員而不修改房間狀態，所以由計時器直接呼叫，不經過指令佇列。
+		"""
+		self._spectator_timer = None
+		if not self._spectator_packets:
+			return
+		
+		started = time.perf_counter()
+		excluded = set(self._spectator_offsets).union(*(exclude_clients for _, exclude_clients in self._spectator_packets))
+		shared = network.pack_batches([packet for packet, _ in self._spectator_packets])
+		
+		fanout = 0
+		for uid in self._user_ids:
+			if uid in self._players:
+				continue
+			packets = self._get_pending_spectator_packets(uid) if uid in excluded else shared
+			user = self._manager.get_user(uid)
+			for packet in packets:
+				user.send(packet)
+			fanout += 1
+		
+		self._spectator_packets = []
+		self._spectator_offsets.clear()
+		metrics.observe_broadcast(PROTOCOL_SERVER.BATCH, fanout, time.perf_counter() - started)
+	
+	def _get_pending_spectator_packets(self, uid: int) -> list[bytes]:
+		"""組合還在累積的廣播中要送給 `uid` 的部分。"""
+		pending = self._spectator_packets[self._spectator_offsets.get(uid, 0):]
+		return network.pack_batches([packet for packet, exclude_clients in pending if uid not in exclude_clients])
+	
+	def _send_pending_spectator_packets(self, user: User):
+		"""觀眾改為即時收到廣播前，先單獨送出還在累積的部分。"""
+		if not self._spectator_packets:
+			return
+		for packet in self._get_pending_spectator_packets(user.uid):
+			user.send(packet)
+		self._spectator_offsets[user.uid] = len(self._spectator_packets)
+	
+	def _skip_pending_spectator_packets(self, uid: int):
+		"""剛成為觀眾的使用者不需要還在累積的廣播 (已經即時收到，或包含在 INIT 中)。"""
+		if self._spectator_packets:
+			self._spectator_offsets[uid] = len(self._spectator_packets)
 	
 	async def _broadcast_connect(self, uid: int, name: str):
 		"""廣播使用者進入房間。"""
-		data = bytes()
-		data += uid.to_bytes(2, byteorder="little")
-		encoded_name = name.encode("utf8")
-		data += len(encoded_name).to_bytes(1, byteorder="little")
-		data += encoded_name
-		
-		packet = network.new_packet(PROTOCOL_SERVER.CONNECT, data)
+		packet = packet_builder.begin(PROTOCOL_SERVER.CONNECT).write_uint16(uid).write_string(name).finish()
 		await self._broadcast(packet, {uid})
 	
 	async def _broadcast_disconnect(self, uid: int):
 		"""廣播使用者離開房間。"""
-		packet = network.new_packet(PROTOCOL_SERVER.DISCONNECT, uid.to_bytes(2, byteorder="little"))
+		packet = packet_builder.pack(PROTOCOL_SERVER.DISCONNECT, uid)
 		await self._broadcast(packet)
 	
 	async def broadcast_rename(self, uid: int, name: str):
 		"""廣播使用者更名。"""
-		data = bytes()
-		data += uid.to_bytes(2, byteorder="little")
-		encoded_name = name.encode("utf8")
-		data += len(encoded_name).to_bytes(1, byteorder="little")
-		data += encoded_name
-		
-		packet = network.new_packet(PROTOCOL_SERVER.NAME, data)
+		self._journal.record_rename(uid, self._manager.get_user(uid).name)
+		self._mark_user_dirty(uid)
+		packet = packet_builder.begin(PROTOCOL_SERVER.NAME).write_uint16(uid).write_string(name).finish()
 		await self._broadcast(packet)
 	
 	async def _broadcast_join(self, uid: int):
 		"""廣播使用者加入遊戲。"""
-		data = bytes()
-		data += uid.to_bytes(2, byteorder="little")
-		
-		packet = network.new_packet(PROTOCOL_SERVER.JOIN_GAME, data)
+		packet = packet_builder.pack(PROTOCOL_SERVER.JOIN_GAME, uid)
 		await self._broadcast(packet)
 	
 	async def _broadcast_leave(self, uid: int):
 		"""廣播使用者離開遊戲。"""
-		data = bytes()
-		data += uid.to_bytes(2, byteorder="little")
-		
-		packet = network.new_packet(PROTOCOL_SERVER.LEAVE_GAME, data)
+		packet = packet_builder.pack(PROTOCOL_SERVER.LEAVE_GAME, uid)
 		await self._broadcast(packet)
 	
 	async def _broadcast_start_countdown(self, is_stop: bool = False):
 		"""廣播遊戲開始倒數計時。"""
-		data = bytes()
+		writer = packet_builder.begin(PROTOCOL_SERVER.START_COUNTDOWN)
 		if is_stop:
-			data += int(0).to_bytes(1, byteorder="little")
+			writer.write_uint8(0)
 		else:
-			data += int(1).to_bytes(1, byteorder="little")
-			data += CONST.START_COUNTDOWN_DURATION.to_bytes(1, byteorder="little")
+			writer.write_uint8(1)
+			writer.write_uint8(CONST.START_COUNTDOWN_DURATION)
 		
-		packet = network.new_packet(PROTOCOL_SERVER.START_COUNTDOWN, data)
-		await self._broadcast(packet)
+		await self._broadcast(writer.finish())
 
 	async def _boradcast_reset_game_data(self):
 		"""廣播重置遊戲資料。"""
-		packet = network.new_packet(PROTOCOL_SERVER.RESET_GAME_DATA, bytes())
+		packet = packet_builder.pack(PROTOCOL_SERVER.RESET_GAME_DATA)
 		await self._broadcast(packet)
 	
 	async def _broadcast_start(self):
 		"""廣播遊戲開始。"""
-		packet = network.new_packet(PROTOCOL_SERVER.START, bytes())
+		packet = packet_builder.pack(PROTOCOL_SERVER.START)
 		await self._broadcast(packet)
 	
 	async def _broadcast_chat(self, uid: int, encoded_message: bytes, hide_uids: Collection[int]):
 		"""廣播使用者聊天訊息。"""
-		data = bytes()
-		data += uid.to_bytes(2, byteorder="little")
-		
-		data += len(encoded_message).to_bytes(1, byteorder="little")
-		data += encoded_message
-		
-		data += (1 if hide_uids else 0).to_bytes(1, byteorder="little")
+		writer = packet_builder.begin(PROTOCOL_SERVER.CHAT)
+		writer.write_uint16(uid)
+		writer.write_string(encoded_message)
+		writer.write_bool(bool(hide_uids))
 		
-		packet = network.new_packet(PROTOCOL_SERVER.CHAT, data)
-		await self._broadcast(packet, hide_uids)
+		await self._broadcast(writer.finish(), hide_uids)
@@ -1,12 +1,24 @@
 import random
 from typing import cast, override
 
+from config import CONFIG
 from game_rooms.base_game_room import BaseGameRoom
 from game_define import PROTOCOL_CLIENT, PROTOCOL_SERVER, GUESS_WORD_STATE, GAME_TYPE
-import network
+from managers.user_manager_interface import IUserManager
+import logger
+from logger import LOG_CATEGORY
+import packet_builder
+from packet_builder import PacketWriter
+from snapshot import SnapshotError, SnapshotReader
+from timer_wheel import Timer
 from user import User, BasePlayer
 
 
+# 猜題與投票的時間限制 (秒)，逾時自動跳過猜題或棄權，0 代表不限制
+GUESS_TIMEOUT: float = CONFIG.get("GUESS_TIMEOUT", 180)
+VOTE_TIMEOUT: float = CONFIG.get("VOTE_TIMEOUT", 60)
+
+
 class Player(BasePlayer):
 	@override
 	def reset(self):
@@ -17,23 +29,49 @@ class Player(BasePlayer):
 		self.skipped_round = 0
 	
 	@override
-	def to_bytes(self) -> bytes:
-		data = bytes()
-		data += self.user.uid.to_bytes(2, byteorder="little")
-		encoded_question = self.question.encode("utf8")
-		data += len(encoded_question).to_bytes(1, byteorder="little")
-		data += encoded_question
-		data += len(self.guess_history).to_bytes(1, byteorder="little")
-		for guess in self.guess_history:
-			encoded_guess = guess[0].encode("utf8")
-			data += len(encoded_guess).to_bytes(1, byteorder="little")
-			data += encoded_guess
-			data += guess[1].to_bytes(1, byteorder="little")
-		data += self.success_round.to_bytes(2, signed=True, byteorder="little")
-		return data
+	def write_to(self, writer: PacketWriter):
+		writer.write_uint16(self.user.uid)
+		writer.write_string(self.question)
+		writer.write_uint8(len(self.guess_history))
+		for guess, result in self.guess_history:
+			writer.write_string(guess)
+			writer.write_uint8(result)
+		writer.write_int16(self.success_round)
+	
+	@override
+	def write_snapshot(self, writer: PacketWriter):
+		writer.write_string(self.question)
+		writer.write_bool(self.question_locked)
+		writer.write_uint8(len(self.guess_history))
+		for guess, result in self.guess_history:
+			writer.write_string(guess)
+			writer.write_uint8(result)
+		writer.write_int16(self.success_round)
+		writer.write_uint16(self.skipped_round)
+	
+	@override
+	def read_snapshot(self, reader: SnapshotReader):
+		self.question = reader.read_string()
+		self.question_locked = reader.read_bool()
+		self.guess_history = [(reader.read_string(), reader.read_uint8()) for _ in range(reader.read_uint8())]
+		self.success_round = reader.read_int16()
+		self.skipped_round = reader.read_uint16()
 
 
 class GuessWordRoom(BaseGameRoom):
+	def __init__(self, id: int, user_manager: IUserManager, large: bool = False):
+		# 基底類別初始化時就會呼叫 _reset_game，計時器要先設定好
+		self._turn_timer: Timer | None = None  # 猜題或投票階段的時間限制
+		super().__init__(id, user_manager, large)
+	
+	@override
+	def get_game_type(self) -> GAME_TYPE:
+		return GAME_TYPE.GUESS_WORD
+	
+	@override
+	def get_game_state(self) -> GUESS_WORD_STATE:
+		return self._game_state
+
 	@override
 	def _reset_game(self):
 		super()._reset_game()
@@ -45,6 +83,12 @@ class GuessWordRoom(BaseGameRoom):
 		self._votes: dict[int, int] = {}
 		
 		self.temp_guess = ""
+		self._restart_turn_timer()
+	
+	@override
+	def close(self):
+		super().close()
+		self._restart_turn_timer()
 	
 	@override
 	def _generate_player_object(self, user: User) -> Player | None:
@@ -61,8 +105,9 @@ class GuessWordRoom(BaseGameRoom):
 		self._game_state = GUESS_WORD_STATE.PREPARING
 		
 		self._player_order = list(self._players.keys())
-		random.shuffle(self._player_order)
+		random.Random(self._journal.next_seed()).shuffle(self._player_order)
 		self._current_guessing_idx = 0
+		self._mark_state_dirty()
 		
 		await self._broadcast_player_order(include_list=True)
 		return True
@@ -86,6 +131,7 @@ class GuessWordRoom(BaseGameRoom):
 		
 		if uid in self._votes:
 			del self._votes[uid]
+		self._mark_state_dirty()
 		
 		await self._check_all_given_words()
 		await self._check_all_votes()
@@ -100,6 +146,8 @@ class GuessWordRoom(BaseGameRoom):
 			return
 		
 		self._game_state = GUESS_WORD_STATE.GUESSING
+		self._mark_state_dirty()
+		self._restart_turn_timer()
 		await self._broadcast_game_state()
 
 	async def _check_all_votes(self):
@@ -130,6 +178,8 @@ class GuessWordRoom(BaseGameRoom):
 			result = 1 if yes_votes > no_votes else 0
 		
 		player.guess_history.append((self.temp_guess, result))
+		self._mark_player_dirty(guessing_player_uid)
+		self._mark_state_dirty()
 		await self._broadcast_guess_record(guessing_player_uid, self.temp_guess, result)
 
 		await self._advance_to_next_player()
@@ -137,6 +187,7 @@ class GuessWordRoom(BaseGameRoom):
 	async def _advance_to_next_player(self):
 		"""移動到下一個需要猜測的玩家。"""
 		self.temp_guess = ""
+		self._mark_state_dirty()
 		
 		for i in range(len(self._player_order)):
 			self._current_guessing_idx += 1
@@ -151,6 +202,7 @@ class GuessWordRoom(BaseGameRoom):
 				continue
 			
 			self._game_state = GUESS_WORD_STATE.GUESSING
+			self._restart_turn_timer()
 			
 			await self._broadcast_player_order()
 			await self._broadcast_game_state()
@@ -160,6 +212,38 @@ class GuessWordRoom(BaseGameRoom):
 		self._reset_game()
 		await self._broadcast_end()
 	
+	def _restart_turn_timer(self):
+		"""依照目前的遊戲階段重新開始猜題或投票的時間限制。"""
+		if self._turn_timer:
+			self._turn_timer.cancel()
+			self._turn_timer = None
+		if self._closed:
+			return
+		
+		if self._game_state == GUESS_WORD_STATE.GUESSING and GUESS_TIMEOUT > 0:
+			self._turn_timer = self._schedule(GUESS_TIMEOUT, self._on_guess_timeout)
+		elif self._game_state == GUESS_WORD_STATE.VOTING and VOTE_TIMEOUT > 0:
+			self._turn_timer = self._schedule(VOTE_TIMEOUT, self._on_vote_timeout)
+
+	async def _on_guess_timeout(self, timer: Timer):
+		"""猜題逾時，視為跳過。"""
+		if self._turn_timer is not timer:
+			return
+		
+		uid = self._player_order[self._current_guessing_idx]
+		logger.debug(LOG_CATEGORY.GAME, "使用者猜題逾時", uid=uid, room_id=self._room_id)
+		await self._request_guess(uid, "")
+
+	async def _on_vote_timeout(self, timer: Timer):
+		"""投票逾時，還沒投票的玩家視為棄權。"""
+		if self._turn_timer is not timer:
+			return
+		
+		guessing_uid = self._player_order[self._current_guessing_idx]
+		for uid in [uid for uid in self._players if uid != guessing_uid and uid not in self._votes]:
+			logger.debug(LOG_CATEGORY.GAME, "使用者投票逾時", uid=uid, room_id=self._room_id)
+			await self._request_vote(uid, 0)
+
 	# user requests ===========================================================================
 
 	async def _request_assign_question(self, uid: int, word: str, is_locked: bool):
@@ -177,10 +261,11 @@ class GuessWordRoom(BaseGameRoom):
 		
 		next_player.question = word
 		next_player.question_locked = is_locked
+		self._mark_player_dirty(next_player.user.uid)
 		if is_locked:
-			print(f"房間編號 {self._room_id} 使用者 {uid} 向 {next_player.user.uid} 出題：{word}")
+			logger.debug(LOG_CATEGORY.GAME, "使用者向 %d 出題：%s", next_player.user.uid, word, uid=uid, room_id=self._room_id)
 		else:
-			print(f"房間編號 {self._room_id} 使用者 {uid} 展示 {next_player.user.uid} 的題目：{word}")
+			logger.debug(LOG_CATEGORY.GAME, "使用者展示 %d 的題目：%s", next_player.user.uid, word, uid=uid, room_id=self._room_id)
 		await self._broadcast_question(next_player)
 		
 		await self._check_all_given_words()
@@ -202,6 +287,7 @@ class GuessWordRoom(BaseGameRoom):
 		
 		if guess.lower() == player.question.lower():
 			player.success_round = self._current_round - player.skipped_round
+			self._mark_player_dirty(uid)
 			await self._broadcast_success(uid, player.success_round, guess)
 			await self._advance_to_next_player()
 			return
@@ -209,7 +295,9 @@ class GuessWordRoom(BaseGameRoom):
 		self.temp_guess = guess
 		self._votes.clear()
 		self._game_state = GUESS_WORD_STATE.VOTING
-		print(f"房間編號 {self._room_id} 使用者 {uid} 猜題：{guess}")
+		self._mark_state_dirty()
+		self._restart_turn_timer()
+		logger.debug(LOG_CATEGORY.GAME, "使用者猜題：%s", guess, uid=uid, room_id=self._room_id)
 		
 		await self._broadcast_guess()
 	
@@ -224,7 +312,8 @@ class GuessWordRoom(BaseGameRoom):
 			return
 		
 		self._votes[uid] = vote
-		print(f"房間編號 {self._room_id} 使用者 {uid} 進行投票：{vote}")
+		self._mark_state_dirty()
+		logger.debug(LOG_CATEGORY.GAME, "使用者進行投票：%d", vote, uid=uid, room_id=self._room_id)
 		await self._broadcast_vote(uid, vote)
 		await self._check_all_votes()
 	
@@ -236,161 +325,128 @@ class GuessWordRoom(BaseGameRoom):
 		
 		player: Player = self._players[uid]
 		player.success_round = -1
+		self._mark_player_dirty(uid)
 		await self._broadcast_success(uid, -1, player.question)
 		await self._advance_to_next_player()
 	
-	@override
-	async def _process_room_specific_request(self, user: User, protocol: PROTOCOL_CLIENT, message: bytes):
-		match protocol:
-			case PROTOCOL_CLIENT.QUESTION:
-				if len(message) > 256:
-					return
-				
-				is_locked = message[0] == 1
-				word = message[1:].decode("utf8").strip()
-				await self._request_assign_question(user.uid, word, is_locked)
-			case PROTOCOL_CLIENT.GUESS:
-				if len(message) > 255:
-					return
-				
-				guess = message.decode("utf8").strip()
-				await self._request_guess(user.uid, guess)
-			case PROTOCOL_CLIENT.VOTE:
-				vote = int.from_bytes(message, byteorder="little")
-				await self._request_vote(user.uid, vote)
-			case PROTOCOL_CLIENT.GIVE_UP:
-				await self._request_give_up(user.uid)
+	_REQUEST_HANDLERS = BaseGameRoom._REQUEST_HANDLERS | {
+		PROTOCOL_CLIENT.QUESTION:	lambda room, user, is_locked, word: room._request_assign_question(user.uid, word.strip(), is_locked == 1),
+		PROTOCOL_CLIENT.GUESS:		lambda room, user, guess: room._request_guess(user.uid, guess.strip()),
+		PROTOCOL_CLIENT.VOTE:		lambda room, user, vote: room._request_vote(user.uid, vote),
+		PROTOCOL_CLIENT.GIVE_UP:	lambda room, user: room._request_give_up(user.uid),
+	}
 	
 	# server messages ===========================================================================
 
 	@override
-	async def _send_init_packet(self, user: User):
-		data = bytes()
-		# 房間的遊戲類型
-		data += GAME_TYPE.GUESS_WORD.to_bytes(1, byteorder="little")
-
-		# 使用者列表
-		data += len(self._user_ids).to_bytes(1, byteorder="little")
-		for user_id in self._user_ids:
-			target_user = self._manager.get_user(user_id)
-			data += target_user.to_bytes()
-		# 玩家列表
-		data += len(self._players).to_bytes(1, byteorder="little")
-		for player in self._players.values():
-			data += player.to_bytes()
+	def _write_state_section(self, writer: PacketWriter):
 		# 遊戲階段
-		data += self._game_state.to_bytes(1, byteorder="little")
+		writer.write_uint8(self._game_state)
 		# 玩家順序
-		data += len(self._player_order).to_bytes(1, byteorder="little")
+		self._write_count(writer, len(self._player_order))
 		for player_uid in self._player_order:
-			data += player_uid.to_bytes(2, byteorder="little")
-		data += self._current_guessing_idx.to_bytes(1, byteorder="little")
+			writer.write_uint16(player_uid)
+		self._write_count(writer, self._current_guessing_idx)
 		# 投票狀況
-		encoded_guess = self.temp_guess.encode("utf8")
-		data += len(encoded_guess).to_bytes(1, byteorder="little")
-		data += encoded_guess
+		writer.write_string(self.temp_guess)
 		
-		data += len(self._votes).to_bytes(1, byteorder="little")
+		self._write_count(writer, len(self._votes))
 		for vote_uid, vote in self._votes.items():
-			data += vote_uid.to_bytes(2, byteorder="little")
-			data += vote.to_bytes(1, byteorder="little")
-		
-		packet = network.new_packet(PROTOCOL_SERVER.INIT, data)
-		try:
-			await user.socket.send(packet)
-		except:
-			pass
+			writer.write_uint16(vote_uid)
+			writer.write_uint8(vote)
 
+	@override
+	def _write_snapshot_state(self, writer: PacketWriter):
+		writer.write_uint8(self._game_state)
+		writer.write_uint16(self._current_round)
+		writer.write_uint16(len(self._player_order))
+		for player_uid in self._player_order:
+			writer.write_uint16(player_uid)
+		writer.write_uint16(self._current_guessing_idx)
+		writer.write_string(self.temp_guess)
+		writer.write_uint16(len(self._votes))
+		for vote_uid, vote in self._votes.items():
+			writer.write_uint16(vote_uid)
+			writer.write_uint8(vote)
+	
+	@override
+	def _read_snapshot_state(self, reader: SnapshotReader):
+		self._game_state = GUESS_WORD_STATE(reader.read_uint8())
+		self._current_round = reader.read_uint16()
+		self._player_order = [reader.read_uint16() for _ in range(reader.read_uint16())]
+		self._current_guessing_idx = reader.read_uint16()
+		self.temp_guess = reader.read_string()
+		self._votes = {reader.read_uint16(): reader.read_uint8() for _ in range(reader.read_uint16())}
+		if self._game_state != GUESS_WORD_STATE.WAITING and (
+			sorted(self._player_order) != sorted(self._players) or self._current_guessing_idx >= len(self._player_order)
+		):
+			raise SnapshotError("玩家順序與玩家列表不符")
+		# 猜題與投票的時間限制從還原時重新計算
+		self._restart_turn_timer()
+	
 	async def _broadcast_game_state(self):
-		packet = network.new_packet(PROTOCOL_SERVER.GAMESTATE, self._game_state.to_bytes(1, byteorder="little"))
+		packet = packet_builder.pack(PROTOCOL_SERVER.GAMESTATE, self._game_state)
 		await self._broadcast(packet)
 	
 	async def _broadcast_player_order(self, include_list: bool = False):
-		data = bytes()
-		data += self._current_guessing_idx.to_bytes(1, byteorder="little")
+		writer = packet_builder.begin(PROTOCOL_SERVER.PLAYER_ORDER)
+		self._write_count(writer, self._current_guessing_idx)
 		if include_list:
-			data += int(1).to_bytes(1, byteorder="little")
-			data += len(self._player_order).to_bytes(1, byteorder="little")
+			writer.write_uint8(1)
+			self._write_count(writer, len(self._player_order))
 			for uid in self._player_order:
-				data += uid.to_bytes(2, byteorder="little")
+				writer.write_uint16(uid)
 		else:
-			data += int(0).to_bytes(1, byteorder="little")
+			writer.write_uint8(0)
 		
-		packet = network.new_packet(PROTOCOL_SERVER.PLAYER_ORDER, data)
-		await self._broadcast(packet)
+		await self._broadcast(writer.finish())
 	
 	async def _broadcast_question(self, player: Player):
-		data = bytes()
-		data += player.user.uid.to_bytes(2, byteorder="little")
-		data += (1 if player.question_locked else 0).to_bytes(1, byteorder="little")
-		encoded_question = player.question.encode("utf8")
-		data += len(encoded_question).to_bytes(1, byteorder="little")
-		data += encoded_question
+		writer = packet_builder.begin(PROTOCOL_SERVER.QUESTION)
+		writer.write_uint16(player.user.uid)
+		writer.write_bool(player.question_locked)
+		writer.write_string(player.question)
 		
-		packet = network.new_packet(PROTOCOL_SERVER.QUESTION, data)
-		await self._broadcast(packet, {player.user.uid})
+		await self._broadcast(writer.finish(), {player.user.uid})
 		
 		# 傳給玩家本身的資訊不含題目，只做提示已經出好題了
-		data = bytes()
-		data += player.user.uid.to_bytes(2, byteorder="little")
-		data += (1 if player.question_locked else 0).to_bytes(1, byteorder="little")
-		packet = network.new_packet(PROTOCOL_SERVER.QUESTION, data)
-		try:
-			await player.user.socket.send(packet)
-		except:
-			pass
+		writer = packet_builder.begin(PROTOCOL_SERVER.QUESTION)
+		writer.write_uint16(player.user.uid)
+		writer.write_bool(player.question_locked)
+		player.user.send(writer.finish())
 	
 	async def _broadcast_success(self, uid: int, success_round: int, answer: str):
-		data = bytes()
-		data += uid.to_bytes(2, byteorder="little")
-		data += success_round.to_bytes(2, signed=True, byteorder="little")
-		
-		encoded_answer = answer.encode("utf8")
-		data += len(encoded_answer).to_bytes(1, byteorder="little")
-		data += encoded_answer
+		writer = packet_builder.begin(PROTOCOL_SERVER.SUCCESS)
+		writer.write_uint16(uid)
+		writer.write_int16(success_round)
+		writer.write_string(answer)
 		
-		packet = network.new_packet(PROTOCOL_SERVER.SUCCESS, data)
-		await self._broadcast(packet)
+		await self._broadcast(writer.finish())
 	
 	async def _broadcast_guess(self):
-		data = bytes()
-		encoded_guess = self.temp_guess.encode("utf8")
-		data += len(encoded_guess).to_bytes(1, byteorder="little")
-		data += encoded_guess
-		
-		packet = network.new_packet(PROTOCOL_SERVER.GUESS, data)
+		packet = packet_builder.begin(PROTOCOL_SERVER.GUESS).write_string(self.temp_guess).finish()
 		await self._broadcast(packet)
 	
 	async def _broadcast_vote(self, uid: int, vote: int):
-		data = bytes()
-		data += uid.to_bytes(2, byteorder="little")
-		data += vote.to_bytes(1, byteorder="little")
-		
-		packet = network.new_packet(PROTOCOL_SERVER.VOTE, data)
+		packet = packet_builder.pack(PROTOCOL_SERVER.VOTE, uid, vote)
 		await self._broadcast(packet)
 	
 	async def _broadcast_guess_again(self):
-		packet = network.new_packet(PROTOCOL_SERVER.GUESS_AGAIN, bytes())
+		packet = packet_builder.pack(PROTOCOL_SERVER.GUESS_AGAIN)
 		await self._broadcast(packet)
 	
 	async def _broadcast_guess_record(self, uid: int, guess: str, result: int):
-		data = bytes()
-		data += uid.to_bytes(2, byteorder="little")
-		
-		encoded_guess = guess.encode("utf8")
-		data += len(encoded_guess).to_bytes(1, byteorder="little")
-		data += encoded_guess
+		writer = packet_builder.begin(PROTOCOL_SERVER.GUESS_RECORD)
+		writer.write_uint16(uid)
+		writer.write_string(guess)
+		writer.write_uint8(result)
 		
-		data += result.to_bytes(1, byteorder="little")
-		
-		packet = network.new_packet(PROTOCOL_SERVER.GUESS_RECORD, data)
-		await self._broadcast(packet)
+		await self._broadcast(writer.finish())
 	
 	async def _broadcast_skip_guess(self, uid: int):
-		packet = network.new_packet(PROTOCOL_SERVER.SKIP_GUESS, uid.to_bytes(2, byteorder="little"))
+		packet = packet_builder.pack(PROTOCOL_SERVER.SKIP_GUESS, uid)
 		await self._broadcast(packet)
 	
 	async def _broadcast_end(self, is_force: bool = False):
-		end_type = 1 if is_force else 0
-		packet = network.new_packet(PROTOCOL_SERVER.END, end_type.to_bytes(1, byteorder="little"))
+		packet = packet_builder.pack(PROTOCOL_SERVER.END, 1 if is_force else 0)
 		await self._broadcast(packet)
@@ -0,0 +1,37 @@
+import random
+
+
+def _sample_indices(rng: random.Random, population: int, count: int) -> list[int]:
+	"""從 [0, population) 中不重複地隨機抽出 `count` 個編號，順序也是隨機的。
+
+	等同於對 [0, population) 做前 `count` 步的 Fisher-Yates 洗牌，
+	但只用 dict 記錄被交換過的位置，不需要建立整個 population。
+	"""
+	swapped: dict[int, int] = {}
+	result: list[int] = []
+	uniform = rng.random
+	for position in range(count):
+		# population 最多五萬，用 random() 取代 randrange 的偏差可以忽略
+		target = position + int(uniform() * (population - position))
+		result.append(swapped.get(target, target))
+		swapped[target] = swapped.get(position, position)
+	return result
+
+def deal(rng: random.Random, max_number: int, group_count: int, hand_count: int, hand_size: int) -> list[list[int]] | None:
+	"""發給 `hand_count` 個玩家各 `hand_size` 個 1 ~ `max_number` 之間的數字。
+
+	每個數字共有 `group_count` 張，0 代表無限組 (每張各自獨立隨機)。
+	有限組數時等同於從 `max_number * group_count` 張牌中不放回地抽牌，但不會建立整副牌。
+	同樣的 `rng` 狀態會發出同樣的牌，數字不足時返回 None。
+	"""
+	total = hand_count * hand_size
+	if group_count == 0:
+		numbers = [rng.randint(1, max_number) for _ in range(total)]
+	else:
+		population = max_number * group_count
+		if population < total:
+			return None
+		# 第 i 張牌的數字為 i % max_number + 1
+		numbers = [index % max_number + 1 for index in _sample_indices(rng, population, total)]
+	
+	return [numbers[start:start + hand_size] for start in range(0, total, hand_size)]
@@ -1,6 +1,8 @@
 import heapq
 import random
 
+from config import CONFIG
+
 
 class _SerialIDGenerator:
 	def __init__(self, max_id):
@@ -20,6 +22,26 @@ class _SerialIDGenerator:
 
 	def release(self, id):
 		heapq.heappush(self._free_id_list, id)
+	
+	def reserve(self, id) -> bool:
+		"""把指定的編號標記為使用中，編號已被使用或超出範圍時返回 False。"""
+		if id <= 0 or id > self._max_id:
+			return False
+		if id > self._id_serial:
+			# 跳過的編號之後仍然可以分配
+			for skipped in range(self._id_serial + 1, id):
+				heapq.heappush(self._free_id_list, skipped)
+			self._id_serial = id
+			return True
+		if id in self._free_id_list:
+			self._free_id_list.remove(id)
+			heapq.heapify(self._free_id_list)
+			return True
+		return False
+	
+	def remaining(self) -> int:
+		"""剩餘可以產生的編號數量。"""
+		return max(0, self._max_id - self._id_serial) + len(self._free_id_list)
 
 _user_id_generator = _SerialIDGenerator(0xffff)
 
@@ -29,37 +51,126 @@ def generate_user_id():
 def release_user_id(id):
 	_user_id_generator.release(id)
 
+def reserve_user_id(id) -> bool:
+	return _user_id_generator.reserve(id)
+
+def remaining_user_ids() -> int:
+	return _user_id_generator.remaining()
+
+
+class _RandomIDAllocator:
+	def __init__(self, max_id, *, capacity, step=1, offset=0):
+		"""隨機分配 1 ~ `max_id` 之間 `id % step == offset` 的編號，同時最多分配 `capacity` 個。
 
-class _RandomIDGenerator:
-	def __init__(self, max_id, *, max_generate_count=-1):
-		if max_generate_count > max_id:
+		把所有編號視為一個陣列，前 `_free_count` 格是未使用的編號，分配時從中隨機挑一格換到尾端取出，
+		釋放時換回未使用區的尾端，各操作都是 O(1)。
+		陣列只記錄位置被換動過的編號，並維持「原位在未使用區內的未使用編號都在原位」，
+		不在原位的只有使用中的編號與原位被使用中編號佔據的未使用編號，記錄數量不超過使用中數量的兩倍。
+		"""
+		self._first_id = offset if offset > 0 else step
+		self._step = step
+		self._slot_count = max(0, (max_id - self._first_id) // step + 1)
+		if capacity > self._slot_count:
 			raise Exception("Generation quota is greater than the total count of possible numbers")
 		
-		self._quota = max_generate_count
-		self._available_id_list = list(range(1, max_id + 1))
+		self._capacity = capacity
+		self._free_count = self._slot_count
+		# 位置 -> 編號格、編號格 -> 位置，只記錄不在原位的編號格
+		self._slot_at: dict[int, int] = {}
+		self._position_of: dict[int, int] = {}
+	
+	def _place(self, position: int, slot: int):
+		if position == slot:
+			self._slot_at.pop(position, None)
+			self._position_of.pop(slot, None)
+		else:
+			self._slot_at[position] = slot
+			self._position_of[slot] = position
+	
+	def _swap(self, a: int, b: int):
+		slot_a = self._slot_at.get(a, a)
+		slot_b = self._slot_at.get(b, b)
+		self._place(a, slot_b)
+		self._place(b, slot_a)
+	
+	def _slot_of(self, id) -> int:
+		"""返回編號所在的格子，編號不屬於這個分配器時返回 -1。"""
+		slot, remainder = divmod(id - self._first_id, self._step)
+		if remainder != 0 or not 0 <= slot < self._slot_count:
+			return -1
+		return slot
+	
+	def _take(self, position: int) -> int:
+		"""把未使用區中指定位置的編號格移出未使用區並返回。"""
+		last = self._free_count - 1
+		self._swap(position, last)
+		self._free_count = last
+		return self._slot_at.get(last, last)
 	
 	def generate(self):
-		if self._quota == 0:
+		if self.remaining() <= 0:
 			return -1
 		
-		if self._quota > 0:
-			self._quota -= 1
-		
-		max_index = len(self._available_id_list) - 1
-		index = random.randint(0, max_index)
-		self._available_id_list[index], self._available_id_list[max_index] = (
-			self._available_id_list[max_index], self._available_id_list[index]
-		)
-		return self._available_id_list.pop()
+		slot = self._take(random.randrange(self._free_count))
+		return self._first_id + slot * self._step
 	
 	def release(self, id):
-		self._available_id_list.append(id)
+		slot = self._slot_of(id)
+		if slot < 0:
+			return
+		position = self._position_of.get(slot, slot)
+		if position < self._free_count:
+			return
+		
+		opened = self._free_count
+		self._swap(position, opened)
+		self._free_count += 1
+		# 未使用區多了一格，釋放的編號與原位是新的這一格的編號若在未使用區內就放回原位
+		self._restore(slot)
+		self._restore(opened)
+	
+	def _restore(self, slot: int):
+		"""原位在未使用區內的未使用編號格不在原位時，換回原位。"""
+		position = self._position_of.get(slot, slot)
+		if slot < self._free_count and position < self._free_count and position != slot:
+			self._swap(position, slot)
+	
+	def reserve(self, id) -> bool:
+		"""把指定的編號標記為使用中，編號不屬於這個分配器、已被使用或數量已滿時返回 False。"""
+		slot = self._slot_of(id)
+		if slot < 0 or self.remaining() <= 0:
+			return False
+		position = self._position_of.get(slot, slot)
+		if position >= self._free_count:
+			return False
+		
+		self._take(position)
+		return True
+	
+	def remaining(self) -> int:
+		"""剩餘可以產生的編號數量。"""
+		return self._capacity - (self._slot_count - self._free_count)
+
+# 房間編號上限 (客戶端顯示 5 位數)
+_MAX_ROOM_ID = 99999
+# 同時存在的房間數量上限，多行程模式下為每個 worker 各自的上限
+MAX_ROOM_COUNT: int = CONFIG.get("MAX_ROOM_COUNT", 100)
+
+_room_id_generator = _RandomIDAllocator(_MAX_ROOM_ID, capacity=MAX_ROOM_COUNT)
 
-# 最多允許建立 100 個房間
-_room_id_generator = _RandomIDGenerator(99999, max_generate_count=100)
+def configure_room_id_space(worker_index: int, worker_count: int):
+	"""多行程模式下讓每個 worker 只產生 `id % worker_count == worker_index` 的房間編號。"""
+	global _room_id_generator
+	_room_id_generator = _RandomIDAllocator(_MAX_ROOM_ID, capacity=MAX_ROOM_COUNT, step=worker_count, offset=worker_index)
 
 def generate_room_id():
 	return _room_id_generator.generate()
 
 def release_room_id(id):
 	_room_id_generator.release(id)
+
+def reserve_room_id(id) -> bool:
+	return _room_id_generator.reserve(id)
+
+def remaining_room_ids() -> int:
+	return _room_id_generator.remaining()
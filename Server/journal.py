@@ -0,0 +1,247 @@
+import asyncio
+import collections
+import os
+import random
+import struct
+import time
+
+from config import CONFIG
+from game_define import GAME_TYPE, JOURNAL_EVENT, PROTOCOL_CLIENT, CONST
+import logger
+from logger import LOG_CATEGORY
+
+
+# 房間事件紀錄的目錄，未設定時不記錄
+JOURNAL_DIR: str | None = CONFIG.get("JOURNAL_DIR")
+# 累積的紀錄寫入檔案的間隔 (秒)，累積超過 JOURNAL_FLUSH_BYTES 時提早寫入
+JOURNAL_FLUSH_INTERVAL: float = CONFIG.get("JOURNAL_FLUSH_INTERVAL", 1.0)
+JOURNAL_FLUSH_BYTES: int = CONFIG.get("JOURNAL_FLUSH_BYTES", 65536)
+
+_MAGIC = b"MPGJ"
+_FORMAT_VERSION = 2
+# magic, 格式版本, 遊戲版本, 遊戲類型, 是否為大型房間, 房間編號, 建立時間
+_HEADER = struct.Struct("<4sHIB?Id")
+# 事件類型, 房間建立後經過的毫秒數, 內容長度
+_EVENT_HEADER = struct.Struct("<BII")
+_UID = struct.Struct("<H")
+_REQUEST = struct.Struct("<HB")
+_SEED = struct.Struct("<Q")
+
+
+class Journal:
+	"""房間事件紀錄的介面，本身不記錄任何東西 (未設定 JOURNAL_DIR 時使用)。
+
+	重播時只要依序套用紀錄中的事件，並在房間要求亂數種子時給出紀錄中的種子，
+	就能得到跟當時完全相同的房間狀態。
+	"""
+	def record_snapshot(self, snapshot: bytes):
+		pass
+
+	def record_join(self, uid: int, name: str):
+		pass
+
+	def record_leave(self, uid: int):
+		pass
+
+	def record_rename(self, uid: int, name: str):
+		pass
+
+	def record_request(self, uid: int, protocol: PROTOCOL_CLIENT, message: bytes | memoryview):
+		pass
+
+	def record_timer(self, name: str):
+		pass
+
+	def next_seed(self) -> int:
+		"""取得房間下一個使用的亂數種子。"""
+		return random.getrandbits(64)
+
+	def close(self):
+		pass
+
+
+class RoomJournal(Journal):
+	"""寫入檔案的房間事件紀錄。
+
+	紀錄只附加到記憶體中的緩衝區，由背景 task 定期批次交給執行緒寫入，
+	event loop 不會等待磁碟。每次寫入時才開啟檔案，房間數量不受檔案描述元上限限制。
+	"""
+	def __init__(self, path: str, game_type: GAME_TYPE, room_id: int, large: bool):
+		self.path = path
+		self._started = time.monotonic()
+		self._buffer = bytearray(_HEADER.pack(_MAGIC, _FORMAT_VERSION, CONST.GAME_VERSION, game_type, large, room_id, time.time()))
+		self._closed = False
+		_writer.mark_dirty(self)
+
+	def _append(self, event: JOURNAL_EVENT, payload: bytes):
+		if self._closed:
+			return
+		elapsed = int((time.monotonic() - self._started) * 1000)
+		self._buffer += _EVENT_HEADER.pack(event, elapsed, len(payload))
+		self._buffer += payload
+		_writer.mark_dirty(self, len(payload) + _EVENT_HEADER.size)
+
+	def record_snapshot(self, snapshot: bytes):
+		self._append(JOURNAL_EVENT.SNAPSHOT, snapshot)
+
+	def record_join(self, uid: int, name: str):
+		self._append(JOURNAL_EVENT.JOIN, _UID.pack(uid) + name.encode("utf8"))
+
+	def record_leave(self, uid: int):
+		self._append(JOURNAL_EVENT.LEAVE, _UID.pack(uid))
+
+	def record_rename(self, uid: int, name: str):
+		self._append(JOURNAL_EVENT.RENAME, _UID.pack(uid) + name.encode("utf8"))
+
+	def record_request(self, uid: int, protocol: PROTOCOL_CLIENT, message: bytes | memoryview):
+		self._append(JOURNAL_EVENT.REQUEST, _REQUEST.pack(uid, protocol) + message)
+
+	def record_timer(self, name: str):
+		self._append(JOURNAL_EVENT.TIMER, name.encode("utf8"))
+
+	def next_seed(self) -> int:
+		seed = super().next_seed()
+		self._append(JOURNAL_EVENT.SEED, _SEED.pack(seed))
+		return seed
+
+	def close(self):
+		self._append(JOURNAL_EVENT.CLOSE, b"")
+		self._closed = True
+
+	def _take(self) -> bytes:
+		data = bytes(self._buffer)
+		self._buffer.clear()
+		return data
+
+	def _write(self, data: bytes):
+		"""在寫入執行緒中附加到檔案。"""
+		if not data:
+			return
+		with open(self.path, "ab") as file:
+			file.write(data)
+
+
+class _JournalWriter:
+	"""把所有房間累積的紀錄批次寫入檔案。"""
+	def __init__(self):
+		self._dirty: dict[RoomJournal, None] = {}
+		self._pending_bytes = 0
+		self._wakeup = asyncio.Event()
+		self._lock = asyncio.Lock()  # 同一個檔案的寫入不能交錯
+		self._task: asyncio.Task | None = None
+
+	def mark_dirty(self, journal: RoomJournal, size: int = 0):
+		self._dirty[journal] = None
+		self._pending_bytes += size
+		if not self._task:
+			self._task = asyncio.get_running_loop().create_task(self._run())
+		if self._pending_bytes >= JOURNAL_FLUSH_BYTES:
+			self._wakeup.set()
+
+	async def flush(self):
+		"""把目前累積的紀錄寫入檔案。"""
+		async with self._lock:
+			batch = [(journal, journal._take()) for journal in self._dirty]
+			self._dirty.clear()
+			self._pending_bytes = 0
+			if batch:
+				await asyncio.to_thread(self._write_batch, batch)
+
+	@staticmethod
+	def _write_batch(batch: list[tuple[RoomJournal, bytes]]):
+		for journal, data in batch:
+			try:
+				journal._write(data)
+			except OSError as e:
+				logger.error(LOG_CATEGORY.SERVER, "寫入房間紀錄失敗：%s", e, path=journal.path)
+
+	async def _run(self):
+		try:
+			while self._dirty:
+				try:
+					await asyncio.wait_for(self._wakeup.wait(), JOURNAL_FLUSH_INTERVAL)
+				except asyncio.TimeoutError:
+					pass
+				self._wakeup.clear()
+				await self.flush()
+		finally:
+			self._task = None
+
+
+_writer = _JournalWriter()
+
+def open_room(game_type: GAME_TYPE, room_id: int, large: bool = False) -> Journal:
+	"""開始記錄新房間的事件，未設定 JOURNAL_DIR 時返回不記錄的 Journal。"""
+	if not JOURNAL_DIR:
+		return Journal()
+	os.makedirs(JOURNAL_DIR, exist_ok=True)
+	path = os.path.join(JOURNAL_DIR, f"room-{room_id}-{time.time_ns() // 1_000_000}.journal")
+	return RoomJournal(path, game_type, room_id, large)
+
+async def flush():
+	"""把所有房間累積的紀錄寫入檔案 (關閉伺服器前呼叫)。"""
+	await _writer.flush()
+
+def disable():
+	"""之後建立的房間都不再記錄 (重播工具使用)。"""
+	global JOURNAL_DIR
+	JOURNAL_DIR = None
+
+
+# replay ===========================================================================
+
+class JournalError(Exception):
+	"""紀錄檔案格式不符。"""
+
+
+Event = tuple[JOURNAL_EVENT, int, bytes]  # (事件類型, 經過的毫秒數, 內容)
+
+def read(path: str) -> tuple[GAME_TYPE, int, bool, list[Event]]:
+	"""讀取紀錄檔案，返回 (遊戲類型, 房間編號, 是否為大型房間, 事件列表)。
+
+	伺服器中斷時最後一筆事件可能只寫入一部分，不完整的結尾會被忽略。
+	"""
+	with open(path, "rb") as file:
+		data = file.read()
+	if len(data) < _HEADER.size:
+		raise JournalError("紀錄內容不完整")
+	magic, format_version, game_version, game_type, large, room_id, _ = _HEADER.unpack_from(data)
+	if magic != _MAGIC or format_version != _FORMAT_VERSION:
+		raise JournalError("不是房間紀錄檔案")
+	if game_version != CONST.GAME_VERSION:
+		raise JournalError(f"紀錄的遊戲版本 {game_version} 與目前的版本 {CONST.GAME_VERSION} 不符")
+
+	events: list[Event] = []
+	offset = _HEADER.size
+	while offset + _EVENT_HEADER.size <= len(data):
+		event, elapsed, size = _EVENT_HEADER.unpack_from(data, offset)
+		offset += _EVENT_HEADER.size
+		if offset + size > len(data):
+			break
+		events.append((JOURNAL_EVENT(event), elapsed, data[offset:offset + size]))
+		offset += size
+	return GAME_TYPE(game_type), room_id, large, events
+
+def parse_user(payload: bytes) -> tuple[int, str]:
+	"""拆開 JOIN 與 RENAME 事件的內容。"""
+	return _UID.unpack_from(payload)[0], payload[_UID.size:].decode("utf8")
+
+def parse_uid(payload: bytes) -> int:
+	return _UID.unpack_from(payload)[0]
+
+def parse_request(payload: bytes) -> tuple[int, int, bytes]:
+	"""拆開 REQUEST 事件的內容，返回 (uid, protocol, 內容)。"""
+	uid, protocol = _REQUEST.unpack_from(payload)
+	return uid, protocol, payload[_REQUEST.size:]
+
+
+class ReplayJournal(Journal):
+	"""重播用的 Journal，依序給出紀錄中的亂數種子。"""
+	def __init__(self, events: list[Event]):
+		self._seeds = collections.deque(_SEED.unpack(payload)[0] for event, _, payload in events if event == JOURNAL_EVENT.SEED)
+
+	def next_seed(self) -> int:
+		if not self._seeds:
+			raise JournalError("紀錄中的亂數種子不足")
+		return self._seeds.popleft()
+
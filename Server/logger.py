@@ -0,0 +1,102 @@
+import atexit
+import enum
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+from config import CONFIG
+
+
+@enum.unique
+class LOG_CATEGORY(enum.StrEnum):
+	SERVER		= "server"		# 伺服器啟動與關閉
+	CONNECTION	= "connection"	# 連線建立與中斷
+	MESSAGE		= "message"		# 每一則收到的訊息 (預設不記錄)
+	ROOM		= "room"		# 房間建立、進出
+	GAME		= "game"		# 遊戲內的操作
+
+
+class _StructuredFormatter(logging.Formatter):
+	"""在訊息後面附上 `key=value` 形式的結構化欄位。"""
+	def format(self, record: logging.LogRecord) -> str:
+		text = f"{self.formatTime(record)} {record.levelname} [{record.category}] {record.getMessage()}"
+		fields = record.fields
+		if fields:
+			text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+		if record.exc_info:
+			text += "\n" + self.formatException(record.exc_info)
+		return text
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+	"""把紀錄原封不動地放進佇列，連同格式化一起交給背景執行緒處理。"""
+	def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+		return record
+
+
+# 各分類的取樣比例，0 代表完全不記錄，1 代表全部記錄
+_sampling: dict[str, float] = { LOG_CATEGORY.MESSAGE: 0.0 } | CONFIG.get("LOG_SAMPLING", {})
+
+_logger = logging.getLogger("mioni")
+_logger.setLevel(CONFIG.get("LOG_LEVEL", "INFO"))
+_logger.propagate = False
+
+# 呼叫端只把紀錄放進佇列，實際的 stdout 寫入在背景執行緒進行，不會卡住 event loop
+_queue = queue.SimpleQueue()
+_logger.addHandler(_DeferredQueueHandler(_queue))
+
+_output_handler = logging.StreamHandler(sys.stdout)
+_output_handler.setFormatter(_StructuredFormatter())
+_listener = logging.handlers.QueueListener(_queue, _output_handler)
+_listener.start()
+
+def _restart_listener():
+	# fork 出來的子行程不會帶著背景執行緒，需要重新啟動
+	global _listener
+	_listener = logging.handlers.QueueListener(_queue, _output_handler)
+	_listener.start()
+
+os.register_at_fork(after_in_child=_restart_listener)
+
+def shutdown():
+	"""輸出佇列中剩餘的紀錄並停止背景執行緒。"""
+	if _listener._thread:
+		_listener.stop()
+
+atexit.register(shutdown)
+
+
+def is_enabled(level: int, category: LOG_CATEGORY) -> bool:
+	"""檢查這筆紀錄是否需要輸出 (等級與取樣)。"""
+	if not _logger.isEnabledFor(level):
+		return False
+
+	rate = _sampling.get(category, 1.0)
+	if rate >= 1.0:
+		return True
+	return rate > 0.0 and random.random() < rate
+
+def log(level: int, category: LOG_CATEGORY, message: str, *args, exc_info=None, **fields):
+	"""記錄一筆訊息，`fields` 會以 `key=value` 的形式附在訊息後面。"""
+	if not is_enabled(level, category):
+		return
+	_logger.log(level, message, *args, exc_info=exc_info, extra={ "category": category, "fields": fields })
+
+def debug(category: LOG_CATEGORY, message: str, *args, **fields):
+	log(logging.DEBUG, category, message, *args, **fields)
+
+def info(category: LOG_CATEGORY, message: str, *args, **fields):
+	log(logging.INFO, category, message, *args, **fields)
+
+def warning(category: LOG_CATEGORY, message: str, *args, **fields):
+	log(logging.WARNING, category, message, *args, **fields)
+
+def error(category: LOG_CATEGORY, message: str, *args, **fields):
+	log(logging.ERROR, category, message, *args, **fields)
+
+def exception(category: LOG_CATEGORY, message: str, *args, **fields):
+	"""記錄錯誤訊息與當前例外的 traceback。"""
+	log(logging.ERROR, category, message, *args, exc_info=True, **fields)
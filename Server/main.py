@@ -1,19 +1,22 @@
-import os
 import websockets
 import ssl
 import asyncio
-import json
+import signal
 
+import admission
+import compression
+from config import CONFIG
+import id_generator
+import journal
+import logger
+from logger import LOG_CATEGORY
 from managers.game_manager import GameManager
+import message_decoder
+import metrics
+import snapshot
+import worker_pool
 
 
-# load config
-if os.path.isfile("config.json"):
-	with open("config.json", "r") as f:
-		CONFIG = json.loads(f.read())
-else:
-	CONFIG = dict()
-
 async def main():
 	HOST = CONFIG.get("HOST", "127.0.0.1")
 	PORT = CONFIG.get("PORT", 11451)
@@ -27,17 +30,75 @@ async def main():
 		ssl_context = None
 	
 	"""伺服器主程式。"""
-	print(f"伺服器在 {HOST}:{PORT} 上監聽...")
+	logger.info(LOG_CATEGORY.SERVER, "伺服器在 %s:%d 上監聽...", HOST, PORT)
 	
 	manager = GameManager()
+	await manager.restore_snapshot()
+	manager.start_reaper()
+	snapshot_writer = snapshot.SnapshotWriter(manager.get_room_snapshots)
+	snapshot_writer.start()
+	admission.controller.start()
+	# 多行程模式下每個 worker 各自使用 METRICS_PORT + worker 編號
+	metrics_server = await metrics.start_server(worker_pool.worker_index)
+	extensions = compression.create_extensions()
 	if int(websockets.__version__.split(".")[0]) >= 13:
-		server = websockets.serve(manager.handle_client_new, HOST, PORT, ssl=ssl_context)
+		handler = manager.handle_client_new
+		process_request = admission.controller.process_request
 	else:
-		server = websockets.serve(manager.handle_client, HOST, PORT, ssl=ssl_context)
+		handler = manager.handle_client
+		process_request = admission.controller.process_request_legacy
+	
+	# 第一次收到訊號時開始關閉流程，再收到一次就不等遊戲結束
+	# 多行程模式下 SIGINT 由主行程轉成 SIGTERM 送給 worker
+	shutdown_requested = asyncio.Event()
+	force_shutdown = asyncio.Event()
+	def on_signal():
+		if shutdown_requested.is_set():
+			logger.info(LOG_CATEGORY.SERVER, "再次收到關閉訊號，不再等待進行中的遊戲")
+			force_shutdown.set()
+		shutdown_requested.set()
+	
+	loop = asyncio.get_running_loop()
+	loop.add_signal_handler(signal.SIGTERM, on_signal)
+	if not worker_pool.is_enabled():
+		loop.add_signal_handler(signal.SIGINT, on_signal)
+	
+	async def serve_until_shutdown():
+		await shutdown_requested.wait()
+		await manager.drain(force_shutdown)
+		# 在中斷剩餘的連線前寫入快照，進行中的遊戲可以在重新啟動後接回
+		await snapshot_writer.stop()
+		await manager.close_all_users()
+		await journal.flush()
+		if metrics_server:
+			metrics_server.close()
+		logger.info(LOG_CATEGORY.SERVER, "伺服器已關閉")
+	
+	if not worker_pool.is_enabled():
+		async with websockets.serve(handler, HOST, PORT, ssl=ssl_context, process_request=process_request, extensions=extensions, compression=None, max_size=message_decoder.MAX_MESSAGE_SIZE):
+			await serve_until_shutdown()
+		return
+	
+	# 多行程模式：所有 worker 共用對外的連接埠，另外各自監聽一個本機連接埠接收其他 worker 轉送的連線
+	# 轉送的連線屬於已經連上伺服器的使用者，不經過 admission 檢查
+	internal_port = worker_pool.get_internal_port(worker_pool.worker_index)
+	logger.info(LOG_CATEGORY.SERVER, "worker %d 在 127.0.0.1:%d 上接收轉送連線...", worker_pool.worker_index, internal_port)
+	async with (
+		websockets.serve(handler, HOST, PORT, ssl=ssl_context, reuse_port=True, process_request=process_request, extensions=extensions, compression=None, max_size=message_decoder.MAX_MESSAGE_SIZE),
+		websockets.serve(handler, "127.0.0.1", internal_port, compression=None),
+	):
+		await serve_until_shutdown()
 
-	async with server:
-		await asyncio.Future()  # run forever
+def run_worker():
+	"""worker 子行程的進入點。"""
+	id_generator.configure_room_id_space(worker_pool.worker_index, worker_pool.WORKER_COUNT)
+	snapshot.configure_path(worker_pool.worker_index)
+	asyncio.run(main())
 
 if __name__ == "__main__":
-	print("啟動喵喵小遊戲伺服器...")
-	asyncio.run(main())
\ No newline at end of file
+	logger.info(LOG_CATEGORY.SERVER, "啟動喵喵小遊戲伺服器...")
+	if worker_pool.is_enabled():
+		logger.info(LOG_CATEGORY.SERVER, "以 %d 個 worker 行程執行", worker_pool.WORKER_COUNT)
+		worker_pool.run_workers(run_worker)
+	else:
+		asyncio.run(main())
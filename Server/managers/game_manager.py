@@ -1,36 +1,112 @@
-import traceback
+import asyncio
+import collections
+from collections.abc import Awaitable, Callable
+import secrets
+import time
 from typing import override
 import websockets
 
-from game_define import PROTOCOL_CLIENT, PROTOCOL_SERVER, GAME_TYPE, CONST
+import admission
+from config import CONFIG
+from game_define import PROTOCOL_CLIENT, PROTOCOL_SERVER, GAME_TYPE, KICK_REASON, RATE_LIMIT_ACTION, RESUME_RESULT, ROOM_LIST_STATE, CONST
 from game_rooms.base_game_room import BaseGameRoom
 from game_rooms.guess_word_room import GuessWordRoom
 from game_rooms.arrange_number_room import ArrangeNumberRoom
 from managers.user_manager_interface import IUserManager
-import network
+import id_generator
+import logger
+from logger import LOG_CATEGORY
+import message_decoder
+from message_decoder import MessageError, Request
+import metrics
+import packet_builder
+import room_directory
+from room_directory import RoomFilter
+import snapshot
+from snapshot import SnapshotError, SnapshotReader
+import timer_wheel
+from timer_wheel import Timer
 from user import User
+import worker_pool
+
+
+# 閒置逾時 (秒)，0 代表不檢查
+LOBBY_IDLE_TIMEOUT: float = CONFIG.get("LOBBY_IDLE_TIMEOUT", 600)
+# 遊戲進行中的房間沒有任何操作多久後關閉
+ROOM_IDLE_TIMEOUT: float = CONFIG.get("ROOM_IDLE_TIMEOUT", 1800)
+# 等待開始的房間沒有任何操作多久後關閉，玩家可能只是在等朋友加入，所以比較寬鬆
+WAITING_ROOM_IDLE_TIMEOUT: float = CONFIG.get("WAITING_ROOM_IDLE_TIMEOUT", 7200)
+IDLE_CHECK_INTERVAL: float = CONFIG.get("IDLE_CHECK_INTERVAL", 30)
+# 房間內的使用者異常斷線後保留的秒數，期間可以用 RESUME 接回，0 代表不保留
+RESUME_GRACE: float = CONFIG.get("RESUME_GRACE", 60)
+# 每個使用者保留最近發送的封包數量，重新連線時用來補送遺漏的封包
+RESUME_HISTORY: int = CONFIG.get("RESUME_HISTORY", 256)
+# 從快照還原的使用者可以用 RESUME 接回的秒數
+SNAPSHOT_RESTORE_GRACE: float = CONFIG.get("SNAPSHOT_RESTORE_GRACE", 120)
+
+# 累積快速加入請求後一起分配房間的等待時間 (秒)
+QUICK_JOIN_BATCH_DELAY: float = CONFIG.get("QUICK_JOIN_BATCH_DELAY", 0.1)
+
+# 關閉伺服器時等待進行中的遊戲結束的秒數
+DRAIN_TIMEOUT: float = CONFIG.get("DRAIN_TIMEOUT", 60)
+_DRAIN_CHECK_INTERVAL = 1.0
+
+_SESSION_TOKEN_SIZE = 16
+
+_ROOM_CLASSES: dict[GAME_TYPE, type[BaseGameRoom]] = {
+	GAME_TYPE.GUESS_WORD:		GuessWordRoom,
+	GAME_TYPE.ARRANGE_NUMBER:	ArrangeNumberRoom,
+}
 
 
 class GameManager(IUserManager):
 	def __init__(self):
 		self._users: dict[int, User] = {}
 		self._rooms: dict[int, BaseGameRoom] = {}
+		self._sessions: dict[bytes, User] = {}
+		# 大廳的訊息處理函式，參數為 (user, 訊息欄位...)，返回 True 代表要中斷連線
+		# 不在表中的 protocol 轉交給使用者所在的房間
+		self._message_handlers: dict[PROTOCOL_CLIENT, Callable[..., Awaitable[bool]]] = {
+			PROTOCOL_CLIENT.VERSION:			self._on_version,
+			PROTOCOL_CLIENT.NAME:				self._on_name,
+			PROTOCOL_CLIENT.CREATE_ROOM:		self._on_create_room,
+			PROTOCOL_CLIENT.CREATE_LARGE_ROOM:	self._on_create_large_room,
+			PROTOCOL_CLIENT.JOIN_ROOM:			self._on_join_room,
+			PROTOCOL_CLIENT.LEAVE_ROOM:			self._on_leave_room,
+			PROTOCOL_CLIENT.BATCH:				self._on_batch,
+			PROTOCOL_CLIENT.FETCH_USERS:		self._on_fetch_users,
+			PROTOCOL_CLIENT.BROWSE_ROOMS:		self._on_browse_rooms,
+			PROTOCOL_CLIENT.QUICK_JOIN:			self._on_quick_join,
+		}
+		
+		metrics.USERS.set_function(lambda: { (): len(self._users) })
+		metrics.ROOMS.set_function(self._count_rooms)
+		admission.controller.set_sources(
+			lambda: len(self._users),
+			lambda: sum(user.sender.pending_count() for user in self._users.values()),
+		)
+		
+		self._reaper: asyncio.Task | None = None
+		
+		# 等待分配的快速加入請求，依遊戲類型分組並保持請求的順序
+		self._quick_joins: dict[GAME_TYPE, dict[int, User]] = {}
+		self._quick_join_timer: Timer | None = None
+		self._quick_join_task: asyncio.Task | None = None
+	
+	def _count_rooms(self) -> dict[tuple, int]:
+		"""依遊戲類型與階段統計房間數量。"""
+		counts = collections.Counter((room.get_game_type(), room.get_game_state()) for room in self._rooms.values())
+		return dict(counts)
 	
 	async def _send_uid(self, user: User):
 		"""發送使用者 ID 給使用者。"""
-		packet = network.new_packet(PROTOCOL_SERVER.UID, user.uid.to_bytes(2, byteorder="little"))
-		try:
-			await user.socket.send(packet)
-		except:
-			pass
+		packet = packet_builder.pack(PROTOCOL_SERVER.UID, user.uid)
+		user.send(packet)
 	
 	async def _send_version_check_result(self, user: User):
 		"""發送遊戲版本給使用者。"""
-		packet = network.new_packet(PROTOCOL_SERVER.VERSION, CONST.GAME_VERSION.to_bytes(4, byteorder="little"))
-		try:
-			await user.socket.send(packet)
-		except:
-			pass
+		packet = packet_builder.pack(PROTOCOL_SERVER.VERSION, CONST.GAME_VERSION)
+		user.send(packet)
 	
 	async def _send_room_id(self, user: User, id: int):
 		"""發送房間 ID 給使用者。
@@ -38,12 +114,61 @@ class GameManager(IUserManager):
 		正數時為進入的房間 ID
 		創建失敗為 -1
 		加入不存在房間為 -2
+		加入已滿的房間為 -3
 		"""
-		packet = network.new_packet(PROTOCOL_SERVER.ROOM_ID, id.to_bytes(4, signed=True, byteorder="little"))
-		try:
-			await user.socket.send(packet)
-		except:
-			pass
+		packet = packet_builder.pack(PROTOCOL_SERVER.ROOM_ID, id)
+		user.send(packet)
+	
+	async def _kick(self, user: User, reason: KICK_REASON):
+		"""通知使用者原因後中斷連線，後續清理交給該連線的接收迴圈。"""
+		if user.is_detached():
+			# 沒有接收迴圈，直接移除
+			await self.remove_user(user)
+			return
+		user.send(packet_builder.pack(PROTOCOL_SERVER.KICK, reason))
+		await user.close()
+	
+	def start_reaper(self):
+		"""開始定期清理閒置的連線與房間。"""
+		if (LOBBY_IDLE_TIMEOUT > 0 or ROOM_IDLE_TIMEOUT > 0 or WAITING_ROOM_IDLE_TIMEOUT > 0) and not self._reaper:
+			self._reaper = asyncio.create_task(self._reap_idle_loop())
+	
+	async def _reap_idle_loop(self):
+		while True:
+			await asyncio.sleep(IDLE_CHECK_INTERVAL)
+			try:
+				await self._reap_idle()
+			except Exception as e:
+				logger.exception(LOG_CATEGORY.SERVER, "清理閒置連線時發生錯誤：%s", e)
+	
+	async def _reap_idle(self):
+		"""中斷在大廳閒置太久的連線，並關閉太久沒有任何操作的房間。
+		
+		遊戲中與等待中的房間各自使用不同的閒置時間，被中斷的使用者會收到對應原因的 KICK。
+		"""
+		now = time.monotonic()
+		kicks = []
+		
+		if LOBBY_IDLE_TIMEOUT > 0:
+			for user in self._users.values():
+				if user.room_id < 0 and now - user.last_active > LOBBY_IDLE_TIMEOUT:
+					logger.info(LOG_CATEGORY.CONNECTION, "使用者在大廳閒置過久，中斷連線", uid=user.uid)
+					kicks.append(self._kick(user, KICK_REASON.LOBBY_IDLE))
+		
+		for room_id, room in self._rooms.items():
+			if room.is_playing():
+				timeout, reason = ROOM_IDLE_TIMEOUT, KICK_REASON.ROOM_IDLE
+			else:
+				timeout, reason = WAITING_ROOM_IDLE_TIMEOUT, KICK_REASON.WAITING_IDLE
+			if timeout <= 0 or now - room.get_last_active() <= timeout:
+				continue
+			
+			# 房間內的使用者斷線後房間就會被移除
+			logger.info(LOG_CATEGORY.ROOM, "房間閒置過久，中斷房間內所有連線", room_id=room_id, reason=reason.name)
+			for uid in room.get_user_ids():
+				kicks.append(self._kick(self._users[uid], reason))
+		
+		await asyncio.gather(*kicks)
 	
 	async def handle_client_new(self, websocket: websockets.ServerConnection):
 		"""處理單一客戶端的連線 (新版 websockets API 使用)。"""
@@ -53,123 +178,543 @@ class GameManager(IUserManager):
 		"""處理單一客戶端的連線。"""
 		del path  # unused parameter
 		
+		resumable = False
 		try:
 			user = User.create(websocket)
 			if user == None:
-				print(f"同時連線數超過上限，中斷來自 {websocket.remote_address} 的連線")
+				logger.warning(LOG_CATEGORY.CONNECTION, "同時連線數超過上限，中斷連線", address=websocket.remote_address)
 				return
 			
 			self.add_user(user)
-			print(f"新連線：{user.uid} ({websocket.remote_address})")
+			logger.info(LOG_CATEGORY.CONNECTION, "新連線", uid=user.uid, address=websocket.remote_address)
 			await self._send_uid(user)
+			self._start_session(user)
 			
 			async for message in websocket:
-				protocol = message[0]
-				if await self._process_message_check_should_close(user, protocol, message[1:]):
+				user.last_active = time.monotonic()
+				# 先用訊息類型與開頭的 protocol 判斷，文字或空的訊息不解析，只計入流量
+				if isinstance(message, str) or not message:
+					protocol = message_decoder.INVALID_PROTOCOL
+					rejected = "text" if isinstance(message, str) else "empty"
+				else:
+					protocol = message[0]
+					rejected = None
+				
+				# 被限制的訊息不會進到解析與後續流程
+				action = user.rate_limiter.check(protocol)
+				if action != RATE_LIMIT_ACTION.ALLOW:
+					metrics.observe_rate_limited(protocol, action)
+					if action == RATE_LIMIT_ACTION.DISCONNECT:
+						await self._kick(user, KICK_REASON.RATE_LIMIT)
+						break
+					continue
+				
+				if rejected:
+					error = MessageError(rejected)
+				else:
+					try:
+						request = message_decoder.decode(message)
+						error = None
+					except MessageError as e:
+						error = e
+				if error:
+					metrics.observe_rejected(error.protocol, error.reason)
+					logger.debug(LOG_CATEGORY.MESSAGE, "訊息格式錯誤，略過", uid=user.uid, protocol=error.protocol, reason=error.reason)
+					continue
+				
+				if user.relay:
+					await self._process_relayed_message(user, request, message)
+					continue
+				
+				if protocol == PROTOCOL_CLIENT.RESUME:
+					# 成功時這條連線改為代表斷線前的使用者
+					user = await self._resume_session(user, *request.args)
+					continue
+				
+				started = time.perf_counter()
+				should_close = await self._process_message_check_should_close(user, request)
+				metrics.observe_message(protocol, len(message), time.perf_counter() - started)
+				if should_close:
 					break
 		except websockets.exceptions.ConnectionClosedOK:
 			pass
+		except websockets.exceptions.ConnectionClosedError:
+			# 沒有正常關閉的連線 (多半是網路不穩)，保留使用者等待重新連線
+			resumable = True
 		except Exception as e:
-			print(f"處理 {user.uid} ({websocket.remote_address}) 的連線時發生錯誤：{e}")
-			print(traceback.format_exc())
+			logger.exception(LOG_CATEGORY.CONNECTION, "處理連線時發生錯誤：%s", e, uid=user.uid, address=websocket.remote_address)
 		finally:
-			print(f"{user.uid} ({websocket.remote_address}) 連線中斷")
-			await self.remove_user(user)
+			if user.socket is not websocket:
+				# 已經由新的連線接手
+				pass
+			elif resumable and self._can_detach(user):
+				self._detach_user(user)
+			else:
+				logger.info(LOG_CATEGORY.CONNECTION, "連線中斷", uid=user.uid, address=websocket.remote_address)
+				await self.remove_user(user)
+	
+	# sessions ===========================================================================
+	
+	def _start_session(self, user: User):
+		"""發送斷線重連用的憑證，之後發送的封包開始保留紀錄。"""
+		if RESUME_GRACE <= 0:
+			return
+		
+		token = secrets.token_bytes(_SESSION_TOKEN_SIZE)
+		user.session_token = token
+		self._sessions[token] = user
+		user.send(packet_builder.begin(PROTOCOL_SERVER.SESSION_TOKEN).write_bytes(token).finish())
+		user.sender.enable_history(RESUME_HISTORY)
+	
+	def _can_detach(self, user: User) -> bool:
+		"""斷線後是否保留使用者。
+		
+		只保留在本 worker 房間內的使用者，被伺服器中斷的連線 (踢除、發送太慢) 不保留
+		"""
+		return (
+			RESUME_GRACE > 0 and user.session_token is not None and
+			user.room_id >= 0 and not user.relay and not user.sender.is_closing()
+		)
+	
+	def _schedule_session_expiry(self, user: User, grace: float) -> Timer:
+		return timer_wheel.schedule(grace, lambda: asyncio.create_task(self._expire_session(user)))
+	
+	def _detach_user(self, user: User):
+		"""保留斷線的使用者，期限內沒有重新連線才移除。"""
+		user.detach(self._schedule_session_expiry(user, RESUME_GRACE))
+		metrics.SESSIONS.inc(1, "detached")
+		logger.info(LOG_CATEGORY.CONNECTION, "連線中斷，保留使用者等待重新連線", uid=user.uid, room_id=user.room_id)
+	
+	async def _expire_session(self, user: User):
+		if not user.is_detached() or self._users.get(user.uid) is not user:
+			return
+		
+		metrics.SESSIONS.inc(1, "expired")
+		logger.info(LOG_CATEGORY.CONNECTION, "重新連線期限已過", uid=user.uid, room_id=user.room_id)
+		await self.remove_user(user)
+	
+	async def _resume_session(self, user: User, token: bytes, received: int) -> User:
+		"""用 SESSION_TOKEN 接回斷線前的使用者。
+		
+		`received` 為客戶端已收到的封包數量，返回之後這條連線代表的使用者
+		"""
+		if user.room_id >= 0 or user.relay:
+			return user
+		
+		previous = self._sessions.get(token)
+		room = self._rooms.get(previous.room_id) if previous else None
+		if previous is None or previous is user or room is None:
+			metrics.SESSIONS.inc(1, "failed")
+			user.send(packet_builder.pack(PROTOCOL_SERVER.RESUME, RESUME_RESULT.FAILED, user.uid, 0))
+			return user
+		
+		# 新連線暫時分配的使用者已經用不到了
+		websocket = user.socket
+		await self.remove_user(user)
+		
+		previous_socket = previous.socket
+		if previous.sender.can_replay(received):
+			header = packet_builder.pack(PROTOCOL_SERVER.RESUME, RESUME_RESULT.REPLAY, previous.uid, received)
+			previous.attach(websocket, header, received)
+			metrics.SESSIONS.inc(1, "resumed")
+		else:
+			header = packet_builder.pack(PROTOCOL_SERVER.RESUME, RESUME_RESULT.RESYNC, previous.uid, previous.sender.get_sequence())
+			previous.attach(websocket, header, None)
+			await room.submit(room.resync_user, previous.uid)
+			metrics.SESSIONS.inc(1, "resynced")
+		previous.last_active = time.monotonic()
+		
+		if previous_socket:
+			# 舊的連線還沒被發現中斷，改由新的連線接手後關閉
+			asyncio.create_task(previous_socket.close())
+		
+		logger.info(LOG_CATEGORY.CONNECTION, "使用者重新連線", uid=previous.uid, room_id=previous.room_id, address=websocket.remote_address)
+		return previous
 
-	async def _process_message_check_should_close(self, user: User, protocol: PROTOCOL_CLIENT, message: bytes) -> bool:
+	async def _process_message_check_should_close(self, user: User, request: Request) -> bool:
 		"""處理來自客戶端的訊息。
 		
 		如果需要關閉連線則返回 True
 		"""
-		print(f"Received protocol {protocol} from user {user.uid}, size: {len(message)} bytes")
-		match protocol:
+		logger.debug(LOG_CATEGORY.MESSAGE, "收到訊息", uid=user.uid, room_id=user.room_id, protocol=request.protocol, size=len(request.payload))
+		handler = self._message_handlers.get(request.protocol)
+		if handler is None:
+			# 處理房間內操作的請求
+			await self._post_room_request(user, request)
+			return False
+		return bool(await handler(user, *request.args))
+	
+	async def _on_version(self, user: User, version: int) -> bool:
+		if user.version_checked:
+			return False
+		
+		await self._send_version_check_result(user)
+		if version != CONST.GAME_VERSION:
+			await user.close()
+			return True
+		
+		user.version_checked = True
+		return False
+	
+	async def _on_name(self, user: User, name: str) -> bool:
+		if not await user.check_version():
+			return True
+		
+		new_name = name.strip()
+		if new_name == user.name:
+			return False
+		
+		if '(' in new_name or ')' in new_name:
+			return False
+		
+		user.name = new_name
+		logger.info(LOG_CATEGORY.CONNECTION, "使用者設定名稱為 %s", new_name, uid=user.uid)
+		
+		if user.room_id >= 0:
+			room = self._rooms.get(user.room_id)
+			if room:
+				await room.submit(room.broadcast_rename, user.uid, new_name)
+		return False
+	
+	async def _on_create_room(self, user: User, game_type: int) -> bool:
+		return await self._create_room(user, game_type, False)
+	
+	async def _on_create_large_room(self, user: User, game_type: int) -> bool:
+		return await self._create_room(user, game_type, True)
+	
+	async def _create_room(self, user: User, game_type: int, large: bool) -> bool:
+		if not await user.check_version():
+			return True
+		if user.room_id >= 0:
+			return False
+		
+		room = self._open_room(game_type, large)
+		if room == None:
+			await self._send_room_id(user, -1)
+			return False
+		
+		await self._enter_room(user, room)
+		logger.info(LOG_CATEGORY.ROOM, "使用者建立房間", uid=user.uid, room_id=room.get_id(), large=large)
+		return False
+	
+	def _open_room(self, game_type: int, large: bool) -> BaseGameRoom | None:
+		"""建立新的房間並加入房間列表，負載偏高或無法建立時返回 None。"""
+		if not admission.controller.can_create_room():
+			# 負載偏高時只讓玩家加入既有的房間
+			metrics.ADMISSION_REJECTED.inc(1, "create_room")
+			return None
+		
+		room_class = _ROOM_CLASSES.get(game_type)
+		room = room_class.create(self, large) if room_class else None
+		if room == None:
+			return None
+		
+		self._rooms[room.get_id()] = room
+		room_directory.directory.add(room)
+		return room
+	
+	async def _enter_room(self, user: User, room: BaseGameRoom, reply_failure: bool = True) -> bool:
+		"""讓大廳中的使用者進入房間並通知結果，`reply_failure` 為 False 時失敗不通知，由呼叫端處理。"""
+		room_id = room.get_id()
+		user.room_id = room_id
+		if not await room.submit(room.add_user, user):
+			# 房間已滿，或等待期間房間已被關閉
+			user.room_id = -1
+			if reply_failure:
+				await self._send_room_id(user, -3 if room.is_full() else -2)
+			return False
+		
+		await self._send_room_id(user, room_id)
+		return True
+	
+	async def _on_join_room(self, user: User, room_id: int) -> bool:
+		if not await user.check_version():
+			return True
+		if user.room_id >= 0:
+			return False
+		
+		if worker_pool.is_enabled() and not worker_pool.is_local_room(room_id):
+			await self._relay_join_room(user, room_id)
+			return False
+		
+		room = self._rooms.get(room_id)
+		if room == None:
+			await self._send_room_id(user, -2)
+			return False
+		
+		if await self._enter_room(user, room):
+			logger.info(LOG_CATEGORY.ROOM, "使用者加入房間", uid=user.uid, room_id=room_id)
+		return False
+	
+	async def _on_quick_join(self, user: User, game_type: int) -> bool:
+		if not await user.check_version():
+			return True
+		if user.room_id >= 0:
+			return False
+		if game_type not in _ROOM_CLASSES:
+			await self._send_room_id(user, -1)
+			return False
+		
+		self._quick_joins.setdefault(GAME_TYPE(game_type), {})[user.uid] = user
+		if not self._quick_join_timer and not self._quick_join_task:
+			self._quick_join_timer = timer_wheel.schedule(QUICK_JOIN_BATCH_DELAY, self._start_quick_joins)
+		return False
+	
+	async def _on_leave_room(self, user: User) -> bool:
+		if user.room_id < 0:
+			return False
+		
+		await self._user_leave_room(user)
+		user.room_id = -1
+		return False
+	
+	async def _on_batch(self, user: User, enabled: bool) -> bool:
+		user.sender.batching = enabled
+		return False
+	
+	async def _on_fetch_users(self, user: User, after_uid: int) -> bool:
+		room = self._rooms.get(user.room_id)
+		if room:
+			room.send_user_page(user, after_uid)
+		return False
+	
+	async def _on_browse_rooms(
+		self, user: User, game_type: int, state: int, min_players: int, max_players: int,
+		after_room_id: int, subscribe: bool, settings: memoryview
+	) -> bool:
+		if not await user.check_version():
+			return True
+		if user.room_id >= 0:
+			return False
+		try:
+			state = ROOM_LIST_STATE(state)
+		except ValueError:
+			return False
+		
+		room_filter = RoomFilter(game_type, state, min_players, max_players or 0xFFFF, bytes(settings))
+		room_directory.directory.send_room_list(user, room_filter, after_room_id)
+		if subscribe:
+			room_directory.directory.subscribe(user, room_filter)
+		else:
+			room_directory.directory.unsubscribe(user.uid)
+		return False
+	
+	async def _post_room_request(self, user: User, request: Request):
+		if user.room_id < 0:
+			return
+		
+		room = self._rooms[user.room_id]
+		if not await room.post_request(user, request):
+			logger.warning(LOG_CATEGORY.ROOM, "房間指令佇列已滿，無法處理請求", uid=user.uid, room_id=user.room_id, protocol=request.protocol)
+	
+	async def _relay_join_room(self, user: User, room_id: int):
+		"""加入由其他 worker 負責的房間。"""
+		relay = worker_pool.WorkerRelay(user, worker_pool.get_room_worker(room_id))
+		if not await relay.open(room_id):
+			await self._send_room_id(user, -2)
+			return
+		
+		user.relay = relay
+		user.room_id = room_id
+		logger.info(LOG_CATEGORY.ROOM, "使用者轉送至 worker %d 加入房間", worker_pool.get_room_worker(room_id), uid=user.uid, room_id=room_id)
+	
+	async def _stop_relay(self, user: User):
+		"""中斷轉送連線並改回使用本 worker 的 UID。"""
+		relay = user.relay
+		user.relay = None
+		user.room_id = -1
+		await relay.close()
+	
+	async def _process_relayed_message(self, user: User, request: Request, message: bytes):
+		"""處理房間在其他 worker 時的客戶端訊息，`message` 為原始訊息。"""
+		match request.protocol:
 			case PROTOCOL_CLIENT.VERSION:
-				if user.version_checked:
-					return False
-				
-				version = int.from_bytes(message, byteorder="little")
-				await self._send_version_check_result(user)
-				if version != CONST.GAME_VERSION:
-					await user.socket.close()
-					return True
-				
-				user.version_checked = True
+				pass
+			case PROTOCOL_CLIENT.BATCH:
+				# 合併封包只在客戶端這一段連線上進行，轉送連線維持逐一發送
+				await self._process_message_check_should_close(user, request)
 			case PROTOCOL_CLIENT.NAME:
-				if not await user.check_version():
-					return True
-				if len(message) > 255:
-					return False
-				
-				new_name = message.decode("utf8").strip()
-				if new_name == user.name:
-					return False
-				
-				if '(' in new_name or ')' in new_name:
-					return False
-				
-				user.name = new_name
-				print(f"使用者 {user.uid} 設定名稱為 {new_name}")
-				
-				if user.room_id >= 0:
-					room = self._rooms.get(room_id)
-					if room:
-						await room.broadcast_rename(user.uid, new_name)
-			case PROTOCOL_CLIENT.CREATE_ROOM:
-				if not await user.check_version():
-					return True
-				if user.room_id >= 0:
-					return False
-				
-				game_type = int.from_bytes(message, byteorder="little")
-				match game_type:
-					case GAME_TYPE.GUESS_WORD:
-						room = GuessWordRoom.create(self)
-					case GAME_TYPE.ARRANGE_NUMBER:
-						room = ArrangeNumberRoom.create(self)
-					case _:
-						room = None
-				
-				if room == None:
-					await self._send_room_id(user, -1)
-					return False
-				
-				room_id = room.get_id()
-				user.room_id = room_id
-				self._rooms[room_id] = room
-				await room.add_user(user)
-				
-				await self._send_room_id(user, room_id)
-				print(f"使用者 {user.uid} 建立房間編號 {room_id}")
-			case PROTOCOL_CLIENT.JOIN_ROOM:
-				if not await user.check_version():
-					return True
-				if user.room_id >= 0:
-					return False
-				
-				room_id = int.from_bytes(message, byteorder="little")
-				room = self._rooms.get(room_id)
+				await self._process_message_check_should_close(user, request)
+				await user.relay.forward(message)
+			case PROTOCOL_CLIENT.LEAVE_ROOM:
+				await user.relay.forward(message)
+				await self._stop_relay(user)
+				await self._send_uid(user)
+			case _:
+				await user.relay.forward(message)
+	
+	# quick join ===========================================================================
+	
+	def _start_quick_joins(self):
+		self._quick_join_timer = None
+		self._quick_join_task = asyncio.create_task(self._process_quick_joins())
+	
+	async def _process_quick_joins(self):
+		"""分配累積的快速加入請求，處理期間新的請求在這一批完成後接著處理。"""
+		try:
+			while self._quick_joins:
+				batches = self._quick_joins
+				self._quick_joins = {}
+				for game_type, users in batches.items():
+					await self._place_quick_joins(game_type, list(users.values()))
+		except Exception as e:
+			logger.exception(LOG_CATEGORY.ROOM, "分配快速加入時發生錯誤：%s", e)
+		finally:
+			self._quick_join_task = None
+	
+	async def _place_quick_joins(self, game_type: GAME_TYPE, users: list[User]):
+		"""把同一批快速加入的使用者依序放進人數最多的等待中房間，沒有合適的房間時才建立新房間。
+		
+		加入既有房間失敗的使用者會改放進下一個候選房間，只有找不到也無法建立房間時才通知失敗。
+		"""
+		while users:
+			found = room_directory.directory.find_quick_join_room(game_type)
+			if found:
+				room, space = found
+				result = "existing"
+			else:
+				room = self._open_room(game_type, False)
 				if room == None:
-					await self._send_room_id(user, -2)
-					return False
-				
+					for user in users:
+						metrics.QUICK_JOINS.inc(1, "failed")
+						await self._send_room_id(user, -1)
+					return
+				space = room_directory.QUICK_JOIN_ROOM_SIZE
+				result = "created"
+			
+			placing, users = users[:space], users[space:]
+			retry = []
+			for user in placing:
+				# 等待期間已經自行進入房間或中斷連線
+				if user.room_id >= 0 or self._users.get(user.uid) is not user:
+					continue
+				if await self._enter_room(user, room, reply_failure=found is None):
+					metrics.QUICK_JOINS.inc(1, result)
+					logger.info(LOG_CATEGORY.ROOM, "使用者快速加入房間", uid=user.uid, room_id=room.get_id())
+				elif found:
+					retry.append(user)
+				else:
+					metrics.QUICK_JOINS.inc(1, "failed")
+			
+			if retry:
+				# 既有的房間在等待期間開始遊戲或已滿，不再作為候選，沒放進去的使用者改找下一個房間
+				room_directory.directory.discard_quick_join(room.get_id())
+				users = retry + users
+			
+			if room.is_empty() and self._rooms.get(room.get_id()) is room:
+				# 新建立的房間沒有任何人加入
+				del self._rooms[room.get_id()]
+				room_directory.directory.remove(room.get_id())
+				room.close()
+	
+	# shutdown ===========================================================================
+	
+	async def drain(self, force: asyncio.Event, timeout: float = DRAIN_TIMEOUT):
+		"""停止接受新的連線與房間，並等待進行中的遊戲結束。
+		
+		所有使用者會先收到 SHUTDOWN 通知，不在遊戲中的使用者直接中斷連線，
+		最多等待 `timeout` 秒，`force` 被設定時提前結束
+		"""
+		admission.controller.start_draining()
+		notice = packet_builder.pack(PROTOCOL_SERVER.SHUTDOWN, min(int(timeout), 0xFFFF))
+		for user in self._users.values():
+			user.send(notice)
+		logger.info(LOG_CATEGORY.SERVER, "伺服器準備關閉，等待進行中的遊戲結束", users=len(self._users), rooms=len(self._rooms), timeout=timeout)
+		
+		deadline = time.monotonic() + timeout
+		while not force.is_set():
+			await self._kick_users_not_playing()
+			remaining = deadline - time.monotonic()
+			if not self._users or remaining <= 0:
+				break
+			try:
+				await asyncio.wait_for(force.wait(), min(_DRAIN_CHECK_INTERVAL, remaining))
+			except asyncio.TimeoutError:
+				pass
+	
+	async def _kick_users_not_playing(self):
+		"""讓不在進行中遊戲裡的使用者離開。"""
+		kicks = []
+		for user in self._users.values():
+			if user.relay or user.sender.is_closing():
+				# 轉送中的使用者由負責房間的 worker 處理
+				continue
+			room = self._rooms.get(user.room_id)
+			if room is None or not room.is_playing():
+				kicks.append(self._kick(user, KICK_REASON.SHUTDOWN))
+		await asyncio.gather(*kicks)
+	
+	async def close_all_users(self):
+		"""送出剩餘的封包後中斷所有連線。"""
+		users = [user for user in self._users.values() if not user.sender.is_closing()]
+		logger.info(LOG_CATEGORY.SERVER, "中斷剩餘的連線", users=len(users))
+		await asyncio.gather(*(self._kick(user, KICK_REASON.SHUTDOWN) for user in users))
+	
+	# snapshots ===========================================================================
+	
+	def get_room_snapshots(self) -> dict[int, bytes]:
+		"""取得所有房間的快照。"""
+		return { room_id: room.get_snapshot() for room_id, room in self._rooms.items() }
+	
+	async def restore_snapshot(self):
+		"""從快照還原房間。
+		
+		房間內的使用者以斷線狀態還原，在 SNAPSHOT_RESTORE_GRACE 秒內可以用 RESUME 接回，
+		接回後因為封包紀錄已經不存在，會收到 RESYNC 與完整的 INIT
+		"""
+		readers = snapshot.load()
+		restored = 0
+		for reader in readers:
+			try:
+				if await self._restore_room(reader):
+					restored += 1
+			except (SnapshotError, ValueError, UnicodeDecodeError) as e:
+				logger.warning(LOG_CATEGORY.SERVER, "無法還原房間：%s", e)
+		if readers:
+			logger.info(LOG_CATEGORY.SERVER, "已從快照還原 %d / %d 個房間", restored, len(readers), path=snapshot.get_path())
+	
+	async def _restore_room(self, reader: SnapshotReader) -> bool:
+		"""還原單一房間，格式見 `BaseGameRoom.get_snapshot`。"""
+		game_type = reader.read_uint8()
+		room_id = reader.read_uint32()
+		large = reader.read_bool()
+		members = [(reader.read_uint16(), reader.read_string(), reader.read_bytes(_SESSION_TOKEN_SIZE)) for _ in range(reader.read_uint16())]
+		
+		room_class = _ROOM_CLASSES.get(game_type)
+		if not room_class or not members:
+			return False
+		room = room_class.create_restored(self, room_id, large)
+		if room is None:
+			raise SnapshotError(f"房間編號 {room_id} 無法使用")
+		
+		users: list[User] = []
+		try:
+			for uid, name, token in members:
+				if not id_generator.reserve_user_id(uid):
+					raise SnapshotError(f"使用者編號 {uid} 無法使用")
+				user = User(None, uid)
+				user.name = name
+				user.version_checked = True
 				user.room_id = room_id
-				await room.add_user(user)
-				
-				await self._send_room_id(user, room_id)
-				print(f"使用者 {user.uid} 加入房間編號 {room_id}")
-			case PROTOCOL_CLIENT.LEAVE_ROOM:
-				if user.room_id < 0:
-					return False
-				
-				await self._user_leave_room(user)
+				self.add_user(user)
+				users.append(user)
+				if token != bytes(_SESSION_TOKEN_SIZE):
+					user.session_token = token
+					self._sessions[token] = user
+				user.sender.enable_history(RESUME_HISTORY)
+				user.detach(self._schedule_session_expiry(user, SNAPSHOT_RESTORE_GRACE))
+			
+			room.restore_snapshot(reader, users)
+		except Exception:
+			room.close()
+			for user in users:
 				user.room_id = -1
-			case _:
-				# 處理房間內操作的請求
-				if user.room_id < 0:
-					return False
-				
-				room = self._rooms[user.room_id]
-				await room.process_request(user, protocol, message)
+				await self.remove_user(user)
+			raise
+		
+		self._rooms[room_id] = room
+		room_directory.directory.add(room)
+		return True
 	
 	@override
 	def get_user(self, uid: int) -> User | None:
@@ -184,15 +729,33 @@ class GameManager(IUserManager):
 		"""處理使用者離開房間。"""
 		room = self._rooms.get(user.room_id)
 		if room:
-			await room.remove_user(user.uid)
-			print(f"玩家 {user.uid} 已離開房間 {user.room_id}")
-			if room.is_empty():
+			await room.submit(room.remove_user, user.uid)
+			logger.info(LOG_CATEGORY.ROOM, "使用者已離開房間", uid=user.uid, room_id=user.room_id)
+			if room.is_empty() and self._rooms.get(user.room_id) is room:
 				del self._rooms[user.room_id]
-				print(f"已移除空房間 {user.room_id}")
+				room_directory.directory.remove(user.room_id)
+				room.close()
+				logger.info(LOG_CATEGORY.ROOM, "已移除空房間", room_id=user.room_id)
 
 	@override
 	async def remove_user(self, user: User):
+		# 閒置清理、重連期限與關閉伺服器都可能移除同一個使用者，已經移除過的不再處理
+		if self._users.get(user.uid) is not user:
+			return
+		if user.relay:
+			await self._stop_relay(user)
 		if user.room_id >= 0:
 			await self._user_leave_room(user)
+		if self._users.get(user.uid) is not user:
+			# 等待離開房間期間已經由其他呼叫移除
+			return
 		del self._users[user.uid]
-		print(f"玩家 {user.name} ({user.uid}) 已移除")
+		room_directory.directory.unsubscribe(user.uid)
+		for users in self._quick_joins.values():
+			users.pop(user.uid, None)
+		if user.session_token:
+			self._sessions.pop(user.session_token, None)
+		if user.resume_timer:
+			user.resume_timer.cancel()
+		user.sender.cancel()
+		logger.info(LOG_CATEGORY.CONNECTION, "使用者 %s 已移除", user.name, uid=user.uid)
@@ -0,0 +1,124 @@
+import struct
+
+from config import CONFIG
+from game_define import PROTOCOL_CLIENT
+
+
+# 客戶端訊息的大小上限 (bytes)，超過時由 websockets 直接中斷連線
+MAX_MESSAGE_SIZE: int = CONFIG.get("MAX_MESSAGE_SIZE", 1024)
+
+# 無法辨識 protocol 的訊息在流量限制與統計中使用的編號
+INVALID_PROTOCOL = 0xFF
+
+
+class MessageError(Exception):
+	"""客戶端訊息格式錯誤，`reason` 用於統計。"""
+	def __init__(self, reason: str, protocol: int = INVALID_PROTOCOL):
+		super().__init__(reason)
+		self.reason = reason
+		self.protocol = protocol
+
+
+class Request:
+	"""解析完成的客戶端訊息。
+
+	`args` 為依序解析出的欄位，`payload` 是不含 protocol 的原始內容 (指向原訊息的 memoryview，不複製)
+	"""
+	__slots__ = ("protocol", "args", "payload")
+
+	def __init__(self, protocol: PROTOCOL_CLIENT, args: tuple, payload: memoryview):
+		self.protocol = protocol
+		self.args = args
+		self.payload = payload
+
+
+class Schema:
+	"""一種客戶端訊息的格式：開頭的固定長度欄位 (struct 格式)，加上選用的結尾字串。
+
+	text: 結尾的 utf8 字串長度上限，解析為 str
+	raw: 結尾的字串長度上限，不解碼直接轉交 (memoryview)
+	default: 內容為空時使用的欄位值，None 代表不允許空內容
+	"""
+	__slots__ = ("layout", "tail_limit", "decode_tail", "default")
+
+	def __init__(self, layout: str = "<", text: int | None = None, raw: int | None = None, default: tuple | None = None):
+		self.layout = struct.Struct(layout)
+		self.tail_limit = text if text is not None else raw
+		self.decode_tail = text is not None
+		self.default = default
+
+	def decode(self, protocol: PROTOCOL_CLIENT, payload: memoryview) -> Request:
+		size = self.layout.size
+		if len(payload) < size:
+			if not payload and self.default is not None:
+				return Request(protocol, self.default, payload)
+			raise MessageError("truncated", protocol)
+
+		args = self.layout.unpack_from(payload)
+		if self.tail_limit is None:
+			if len(payload) > size:
+				raise MessageError("trailing", protocol)
+			return Request(protocol, args, payload)
+
+		tail = payload[size:]
+		if len(tail) > self.tail_limit:
+			raise MessageError("oversized", protocol)
+		if self.decode_tail:
+			try:
+				tail = str(tail, "utf8")
+			except UnicodeDecodeError:
+				raise MessageError("encoding", protocol) from None
+		return Request(protocol, args + (tail,), payload)
+
+
+# 各 protocol 的訊息格式 (不含開頭的 protocol)，欄位順序即為 Request.args 的順序
+SCHEMAS: dict[PROTOCOL_CLIENT, Schema] = {
+	PROTOCOL_CLIENT.NAME:					Schema(text=255),				# name
+	PROTOCOL_CLIENT.JOIN_GAME:				Schema(),
+	PROTOCOL_CLIENT.LEAVE_GAME:				Schema(),
+	PROTOCOL_CLIENT.START:					Schema(),
+	PROTOCOL_CLIENT.CANCEL_START:			Schema(),
+	PROTOCOL_CLIENT.QUESTION:				Schema("<B", text=255),			# is_locked, question
+	PROTOCOL_CLIENT.GUESS:					Schema(text=255),				# guess
+	PROTOCOL_CLIENT.VOTE:					Schema("<B"),					# vote
+	PROTOCOL_CLIENT.CHAT:					Schema("<H", raw=255),			# hide_uid, message
+	PROTOCOL_CLIENT.GIVE_UP:				Schema(),
+	PROTOCOL_CLIENT.VERSION:				Schema("<I"),					# version
+	PROTOCOL_CLIENT.CREATE_ROOM:			Schema("<B"),					# game_type
+	PROTOCOL_CLIENT.JOIN_ROOM:				Schema("<I"),					# room_id
+	PROTOCOL_CLIENT.LEAVE_ROOM:				Schema(),
+	PROTOCOL_CLIENT.SET_MAX_NUMBER:			Schema("<H"),					# max_number
+	PROTOCOL_CLIENT.SET_NUMBER_GROUP_COUNT:	Schema("<B"),					# group_count
+	PROTOCOL_CLIENT.SET_NUMBER_PER_PLAYER:	Schema("<B"),					# number_per_player
+	PROTOCOL_CLIENT.POSE_NUMBER:			Schema(),
+	PROTOCOL_CLIENT.SET_URGENT:				Schema("<?"),					# is_urgent
+	PROTOCOL_CLIENT.BATCH:					Schema("<?", default=(True,)),	# enabled (空內容視為啟用)
+	PROTOCOL_CLIENT.RESUME:					Schema("<16sI"),				# token, received_count
+	PROTOCOL_CLIENT.CREATE_LARGE_ROOM:		Schema("<B"),					# game_type
+	PROTOCOL_CLIENT.FETCH_USERS:			Schema("<H"),					# after_uid
+	PROTOCOL_CLIENT.BROWSE_ROOMS:			Schema("<BBHHI?", raw=32),		# game_type, state, min_players, max_players, after_room_id, subscribe, settings
+	PROTOCOL_CLIENT.QUICK_JOIN:				Schema("<B"),					# game_type
+}
+
+# 以 protocol 編號直接索引，不需要先轉成 enum 再查表
+_SCHEMA_TABLE: list[tuple[PROTOCOL_CLIENT, Schema] | None] = [None] * 256
+for _protocol, _schema in SCHEMAS.items():
+	_SCHEMA_TABLE[_protocol] = (_protocol, _schema)
+
+
+def decode(message: bytes | str) -> Request:
+	"""解析一則客戶端訊息，格式不符時拋出 `MessageError`。"""
+	if isinstance(message, str):
+		raise MessageError("text")
+	if not message:
+		raise MessageError("empty")
+
+	entry = _SCHEMA_TABLE[message[0]]
+	if entry is None:
+		raise MessageError("unknown", message[0])
+	protocol, schema = entry
+	return schema.decode(protocol, memoryview(message)[1:])
+
+def decode_payload(protocol: PROTOCOL_CLIENT, payload: bytes) -> Request:
+	"""解析不含 protocol 的訊息內容 (重播紀錄等已經知道 protocol 的情況使用)。"""
+	return SCHEMAS[protocol].decode(protocol, memoryview(payload))
@@ -0,0 +1,229 @@
+import asyncio
+import bisect
+import enum
+from collections.abc import Callable, Sequence
+
+from config import CONFIG
+from game_define import PROTOCOL_CLIENT, PROTOCOL_SERVER, RATE_LIMIT_ACTION
+import id_generator
+import logger
+from logger import LOG_CATEGORY
+
+
+METRICS_HOST: str = CONFIG.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT: int | None = CONFIG.get("METRICS_PORT")
+
+# 處理時間 (秒) 的 histogram 區間
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# 廣播對象人數的 histogram 區間
+FANOUT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _format_labels(names: Sequence[str], values: tuple) -> str:
+	if not names:
+		return ""
+	pairs = ",".join(f'{name}="{value.name if isinstance(value, enum.Enum) else value}"' for name, value in zip(names, values))
+	return "{" + pairs + "}"
+
+def _format_number(value: float) -> str:
+	if value == float("inf"):
+		return "+Inf"
+	return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+	TYPE = ""
+
+	def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+		self.name = name
+		self.help = help
+		self.labels = tuple(labels)
+		_registry.append(self)
+
+	def render(self, lines: list[str]):
+		lines.append(f"# HELP {self.name} {self.help}")
+		lines.append(f"# TYPE {self.name} {self.TYPE}")
+
+
+class Counter(_Metric):
+	"""只會增加的計數器。
+
+	標籤值可以直接傳入 enum 成員，輸出時才轉成名稱，熱路徑上不需要組字串。
+	"""
+	TYPE = "counter"
+
+	def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+		super().__init__(name, help, labels)
+		self._values: dict[tuple, float] = {}
+
+	def inc(self, amount: float = 1, *labels):
+		self._values[labels] = self._values.get(labels, 0) + amount
+
+	def render(self, lines: list[str]):
+		super().render(lines)
+		for labels, value in self._values.items():
+			lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_number(value)}")
+
+
+class Histogram(_Metric):
+	"""累計各區間次數的 histogram。"""
+	TYPE = "histogram"
+
+	def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+		super().__init__(name, help, labels)
+		self._bounds = tuple(buckets)
+		# 每組標籤的 [各區間次數..., 總和]，最後一個區間為 +Inf
+		self._values: dict[tuple, list] = {}
+
+	def observe(self, value: float, *labels):
+		data = self._values.get(labels)
+		if data is None:
+			data = self._values[labels] = [0] * (len(self._bounds) + 1) + [0.0]
+		data[bisect.bisect_left(self._bounds, value)] += 1
+		data[-1] += value
+
+	def render(self, lines: list[str]):
+		super().render(lines)
+		for labels, data in self._values.items():
+			cumulative = 0
+			for bound, count in zip(self._bounds + (float("inf"),), data):
+				cumulative += count
+				bucket_labels = _format_labels(self.labels + ("le",), labels + (_format_number(bound),))
+				lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+			label_text = _format_labels(self.labels, labels)
+			lines.append(f"{self.name}_sum{label_text} {_format_number(data[-1])}")
+			lines.append(f"{self.name}_count{label_text} {cumulative}")
+
+
+class Gauge(_Metric):
+	"""在輸出時才呼叫函式取得當前數值的 gauge。
+
+	函式返回 {標籤值 tuple: 數值}
+	"""
+	TYPE = "gauge"
+
+	def __init__(self, name: str, help: str, labels: Sequence[str] = (), function: Callable[[], dict[tuple, float]] | None = None):
+		super().__init__(name, help, labels)
+		self._function = function
+
+	def set_function(self, function: Callable[[], dict[tuple, float]]):
+		self._function = function
+
+	def render(self, lines: list[str]):
+		if not self._function:
+			return
+		super().render(lines)
+		for labels, value in self._function().items():
+			lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_number(value)}")
+
+
+_registry: list[_Metric] = []
+
+def _protocol_label(enum_type: type[enum.IntEnum], protocol: int) -> enum.IntEnum | int:
+	"""把協定編號轉成 enum 成員，未定義的編號維持原本的數字。"""
+	return enum_type._value2member_map_.get(protocol, protocol)
+
+
+MESSAGES = Counter("mioni_messages_received_total", "Client messages received.", ("protocol",))
+MESSAGE_SECONDS = Histogram("mioni_message_handler_seconds", "Time spent handling a client message in the game manager.", ("protocol",))
+ROOM_REQUEST_SECONDS = Histogram("mioni_room_request_seconds", "Time spent handling an in-room request in the room task.", ("protocol",))
+BROADCAST_FANOUT = Histogram("mioni_broadcast_fanout", "Number of users a room broadcast is queued to.", ("protocol",), FANOUT_BUCKETS)
+BROADCAST_SECONDS = Histogram("mioni_broadcast_seconds", "Time spent queueing a room broadcast.", ("protocol",))
+MESSAGES_REJECTED = Counter("mioni_messages_rejected_total", "Client messages rejected by the decoder.", ("protocol", "reason"))
+RATE_LIMITED = Counter("mioni_rate_limited_total", "Client messages rejected by the rate limiter.", ("protocol", "action"))
+ADMISSION_REJECTED = Counter("mioni_admission_rejected_total", "Connections and room creations refused by admission control.", ("kind",))
+SESSIONS = Counter("mioni_sessions_total", "Dropped connections kept for resume and how they ended.", ("event",))
+QUICK_JOINS = Counter("mioni_quick_joins_total", "Quick-join requests by whether they filled an existing room, opened a new one or failed.", ("result",))
+BYTES_RECEIVED = Counter("mioni_bytes_received_total", "Websocket payload bytes received from clients.")
+BYTES_SENT = Counter("mioni_bytes_sent_total", "Websocket payload bytes sent to clients.")
+FRAMES_SENT = Counter("mioni_frames_sent_total", "Websocket messages sent to clients.")
+COMPRESSION_BYTES = Counter("mioni_compression_bytes_total", "Payload bytes of compressed messages before and after permessage-deflate.", ("stage",))
+USERS = Gauge("mioni_users", "Connected users.")
+ROOMS = Gauge("mioni_rooms", "Live rooms by game type and state.", ("game_type", "state"))
+LOAD = Gauge("mioni_load_level", "Admission control load level (0 normal, 1 soft, 2 hard).")
+LOOP_LAG = Gauge("mioni_event_loop_lag_seconds", "Recent event loop scheduling delay.")
+PENDING_PACKETS = Gauge("mioni_pending_packets", "Packets queued for sending across all connections.")
+ID_CAPACITY = Gauge("mioni_id_capacity_remaining", "Remaining ids that can still be allocated.", ("kind",), lambda: {
+	("user",): id_generator.remaining_user_ids(),
+	("room",): id_generator.remaining_room_ids(),
+})
+
+def observe_message(protocol: int, size: int, seconds: float):
+	"""記錄一則客戶端訊息的處理結果。"""
+	label = _protocol_label(PROTOCOL_CLIENT, protocol)
+	MESSAGES.inc(1, label)
+	MESSAGE_SECONDS.observe(seconds, label)
+	BYTES_RECEIVED.inc(size)
+
+def observe_rejected(protocol: int, reason: str):
+	"""記錄一則格式錯誤的客戶端訊息。"""
+	MESSAGES_REJECTED.inc(1, _protocol_label(PROTOCOL_CLIENT, protocol), reason)
+
+def observe_rate_limited(protocol: int, action: RATE_LIMIT_ACTION):
+	"""記錄一則被流量限制擋下的訊息。"""
+	RATE_LIMITED.inc(1, _protocol_label(PROTOCOL_CLIENT, protocol), action)
+
+def observe_room_request(protocol: int, seconds: float):
+	"""記錄一則房間內請求的處理時間。"""
+	ROOM_REQUEST_SECONDS.observe(seconds, _protocol_label(PROTOCOL_CLIENT, protocol))
+
+def observe_broadcast(protocol: int, fanout: int, seconds: float):
+	"""記錄一次房間廣播。"""
+	label = _protocol_label(PROTOCOL_SERVER, protocol)
+	BROADCAST_FANOUT.observe(fanout, label)
+	BROADCAST_SECONDS.observe(seconds, label)
+
+def observe_sent(size: int):
+	"""記錄送出給客戶端的一則 websocket 訊息。"""
+	FRAMES_SENT.inc()
+	BYTES_SENT.inc(size)
+
+def observe_compression(raw_size: int, compressed_size: int):
+	"""記錄一則經過 permessage-deflate 壓縮的訊息。"""
+	COMPRESSION_BYTES.inc(raw_size, "raw")
+	COMPRESSION_BYTES.inc(compressed_size, "compressed")
+
+def render() -> str:
+	"""輸出 Prometheus text format。"""
+	lines: list[str] = []
+	for metric in _registry:
+		metric.render(lines)
+	lines.append("")
+	return "\n".join(lines)
+
+
+# HTTP ===========================================================================
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+	try:
+		request_line = await reader.readline()
+		while (await reader.readline()).strip():  # 略過 header
+			pass
+
+		parts = request_line.decode("latin-1").split()
+		if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+			status = "200 OK"
+			body = render().encode("utf8")
+		else:
+			status = "404 Not Found"
+			body = b""
+
+		writer.write(
+			f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+			f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+		)
+		await writer.drain()
+	except (ConnectionError, UnicodeDecodeError):
+		pass
+	finally:
+		writer.close()
+
+async def start_server(port_offset: int = 0) -> asyncio.Server | None:
+	"""在 `METRICS_PORT + port_offset` 上提供 /metrics，未設定 METRICS_PORT 時不啟動。"""
+	if METRICS_PORT is None:
+		return None
+
+	port = METRICS_PORT + port_offset
+	server = await asyncio.start_server(_handle_http, METRICS_HOST, port)
+	logger.info(LOG_CATEGORY.SERVER, "metrics 在 http://%s:%d/metrics 上提供", METRICS_HOST, port)
+	return server
@@ -1,8 +1,261 @@
-from game_define import PROTOCOL_SERVER
+import asyncio
+import collections
+import websockets
 
+from config import CONFIG
+from game_define import PROTOCOL_SERVER, SLOW_CONSUMER_POLICY
+import logger
+from logger import LOG_CATEGORY
+import metrics
+import packet_builder
 
-def new_packet(protocol: PROTOCOL_SERVER, data: bytes) -> bytes:
-	packet = bytes()
-	packet += protocol.to_bytes(1, byteorder="little")
-	packet += data
-	return packet
\ No newline at end of file
+
+SEND_TIMEOUT: float = CONFIG.get("SEND_TIMEOUT", 5)
+SEND_QUEUE_LIMIT: int = CONFIG.get("SEND_QUEUE_LIMIT", 256)
+SLOW_CONSUMER: SLOW_CONSUMER_POLICY = SLOW_CONSUMER_POLICY(CONFIG.get("SLOW_CONSUMER_POLICY", SLOW_CONSUMER_POLICY.QUEUE_LIMIT))
+BATCH_MAX_BYTES: int = CONFIG.get("BATCH_MAX_BYTES", 65536)
+
+# BATCH 內單一封包的長度上限 (uint16)，更大的封包直接單獨送出
+_BATCH_ENTRY_MAX = 0xFFFF
+
+
+def _can_batch(packet: bytes) -> bool:
+	"""封包是否可以放進 BATCH，本身已經是 BATCH 的封包不再包一層。"""
+	return len(packet) <= _BATCH_ENTRY_MAX and packet[0] != PROTOCOL_SERVER.BATCH
+
+def pack_batches(packets: list[bytes]) -> list[bytes]:
+	"""把多個封包依序合併成 BATCH 封包，格式與 `PacketSender` 合併的相同。
+	
+	每個 BATCH 不超過 `BATCH_MAX_BYTES`，無法放進 BATCH 或單獨成一組的封包原樣返回
+	"""
+	batches: list[bytes] = []
+	group: list[bytes] = []
+	size = 1
+	for packet in packets:
+		if group and (not _can_batch(packet) or size + 2 + len(packet) > BATCH_MAX_BYTES):
+			batches.append(_finish_batch(group))
+			group = []
+			size = 1
+		if not _can_batch(packet):
+			batches.append(packet)
+			continue
+		group.append(packet)
+		size += 2 + len(packet)
+	if group:
+		batches.append(_finish_batch(group))
+	return batches
+
+def _finish_batch(group: list[bytes]) -> bytes:
+	if len(group) == 1:
+		return group[0]
+	writer = packet_builder.begin(PROTOCOL_SERVER.BATCH)
+	for packet in group:
+		writer.write_uint16(len(packet)).write_bytes(packet)
+	return writer.finish()
+
+
+class PacketSender:
+	"""單一連線的發送佇列。
+
+	發送給連線的封包都會先排入佇列，再由各連線自己的 task 依序送出，
+	呼叫端不需要等待發送完成，慢速的客戶端也不會拖慢其他連線。
+
+	客戶端啟用 `batching` 後，發送 task 被喚醒時會把佇列中累積的多個封包
+	(同一個 event loop tick 內排入的封包) 合併成一個 BATCH 封包送出，
+	格式為 [BATCH] 後面接著多組 [uint16 長度][封包]。
+
+	啟用 `enable_history` 後會保留最近排入的封包，連線中斷 (`detach`) 期間
+	的封包也只記錄下來，重新連線 (`attach`) 時補送客戶端沒收到的部分。
+	"""
+	def __init__(self, websocket: websockets.ServerConnection | None):
+		self._socket: websockets.ServerConnection | None = websocket
+		self._queue: collections.deque[bytes] = collections.deque()
+		self._wakeup = asyncio.Event()
+		self._task: asyncio.Task | None = None
+		self._closing = False
+		self._disconnected = False  # 發送時發現連線已經中斷
+		self._dropped = False  # DROP 策略丟棄過封包，保留的紀錄不足以補送
+		self.batching = False
+		
+		self._history: collections.deque[bytes] | None = None
+		self._sequence = 0  # 啟用 history 後排入的封包總數
+	
+	def pending_count(self) -> int:
+		"""取得尚未送出的封包數量。"""
+		return len(self._queue)
+	
+	def is_closing(self) -> bool:
+		"""是否已經 (或正在) 由伺服器端關閉連線。"""
+		return self._closing
+	
+	def send(self, packet: bytes):
+		"""將封包排入發送佇列。"""
+		if self._closing:
+			return
+		if self._socket is None or self._disconnected:
+			# 等待重新連線 (或連線已中斷、等待接收迴圈清理)，只記錄不發送
+			self._record(packet)
+			return
+		
+		if len(self._queue) >= SEND_QUEUE_LIMIT:
+			if SLOW_CONSUMER == SLOW_CONSUMER_POLICY.DROP:
+				# 仍然計入序號，讓斷線重連時改為完整同步而不是補送缺了封包的紀錄
+				self._record(packet)
+				self._dropped = True
+				return
+			self._evict()
+			return
+		
+		self._record(packet)
+		self._queue.append(packet)
+		if not self._task:
+			self._task = asyncio.create_task(self._run())
+		self._wakeup.set()
+	
+	def _record(self, packet: bytes):
+		if self._history is not None:
+			self._history.append(packet)
+			self._sequence += 1
+	
+	def enable_history(self, size: int):
+		"""開始保留最近排入的 `size` 個封包，之後的封包才會被計入序號。"""
+		self._history = collections.deque(maxlen=size)
+	
+	def get_sequence(self) -> int:
+		"""取得啟用 history 後排入的封包總數。"""
+		return self._sequence
+	
+	def can_replay(self, received: int) -> bool:
+		"""客戶端已收到 `received` 個封包時，保留的紀錄是否足以補齊剩下的部分。"""
+		if self._history is None or self._dropped:
+			return False
+		return 0 <= self._sequence - received <= len(self._history)
+	
+	def detach(self):
+		"""連線中斷，停止發送並等待 `attach`。"""
+		if self._task:
+			self._task.cancel()
+			self._task = None
+		self._queue.clear()
+		self._socket = None
+		self._disconnected = False
+	
+	def attach(self, websocket: websockets.ServerConnection, header: bytes, received: int | None):
+		"""改用新的連線發送，先送出 `header`，再補送客戶端收到 `received` 個封包之後的紀錄。
+
+		`received` 為 None 時不補送 (客戶端會重新同步完整狀態)，`header` 不會被記錄或計入序號。
+		"""
+		self.detach()
+		self._socket = websocket
+		if received is None:
+			self._dropped = False
+		self._queue.append(header)
+		if received is not None:
+			missing = self._sequence - received
+			if missing > 0:
+				self._queue.extend(list(self._history)[-missing:])
+		self._task = asyncio.create_task(self._run())
+		self._wakeup.set()
+	
+	async def close(self, timeout: float = SEND_TIMEOUT):
+		"""送出佇列中剩餘的封包後關閉連線。"""
+		self._closing = True
+		self._wakeup.set()
+		if self._task:
+			try:
+				await asyncio.wait_for(self._task, timeout)
+			except (asyncio.TimeoutError, asyncio.CancelledError):
+				pass
+		if self._socket:
+			await self._socket.close()
+	
+	def cancel(self):
+		"""停止發送並丟棄佇列中的封包。"""
+		self._closing = True
+		self._queue.clear()
+		if self._task:
+			self._task.cancel()
+			self._task = None
+	
+	def _evict(self):
+		"""中斷跟不上發送速度的連線。
+		
+		這裡只負責關閉連線，使用者的清理工作交給該連線的接收迴圈處理。
+		"""
+		if self._closing:
+			return
+		
+		self.cancel()
+		asyncio.create_task(self._socket.close(code=1013, reason="too slow"))
+	
+	def _take_batch(self) -> bytes:
+		"""從佇列取出封包合併成一個 BATCH 封包，總長度不超過 `BATCH_MAX_BYTES`。"""
+		writer = packet_builder.begin(PROTOCOL_SERVER.BATCH)
+		size = 1
+		while self._queue:
+			packet = self._queue[0]
+			if not _can_batch(packet) or (size > 1 and size + 2 + len(packet) > BATCH_MAX_BYTES):
+				break
+			self._queue.popleft()
+			writer.write_uint16(len(packet)).write_bytes(packet)
+			size += 2 + len(packet)
+		return writer.finish()
+	
+	async def _send_with_policy(self, packet: bytes) -> bool:
+		"""依照慢速連線策略發送封包。
+		
+		發送超過 SEND_TIMEOUT 時，DROP 丟棄這個封包，DISCONNECT 中斷連線，
+		QUEUE_LIMIT 在待送封包未達上限時再等待一次，仍然逾時才中斷連線。
+		連線需要被中斷時返回 False
+		"""
+		send = asyncio.ensure_future(self._socket.send(packet))
+		try:
+			for _ in range(2 if SLOW_CONSUMER == SLOW_CONSUMER_POLICY.QUEUE_LIMIT else 1):
+				done, _ = await asyncio.wait((send,), timeout=SEND_TIMEOUT)
+				if done:
+					send.result()
+					metrics.observe_sent(len(packet))
+					return True
+				if len(self._queue) >= SEND_QUEUE_LIMIT:
+					break
+		finally:
+			if not send.done():
+				send.cancel()
+		
+		if SLOW_CONSUMER == SLOW_CONSUMER_POLICY.DROP:
+			self._dropped = True
+			return True
+		return False
+	
+	async def _run(self):
+		"""逐一送出佇列中的封包。"""
+		try:
+			while True:
+				while self._queue:
+					if self.batching and len(self._queue) > 1 and _can_batch(self._queue[0]):
+						packet = self._take_batch()
+					else:
+						packet = self._queue.popleft()
+					if not await self._send_with_policy(packet):
+						self._task = None
+						self._evict()
+						return
+				
+				if self._closing:
+					return
+				
+				self._wakeup.clear()
+				await self._wakeup.wait()
+		except websockets.exceptions.ConnectionClosed:
+			# 連線已中斷，剩下的清理交給接收迴圈
+			self._disconnected = True
+			self._queue.clear()
+		except Exception as e:
+			logger.exception(LOG_CATEGORY.CONNECTION, "發送封包時發生錯誤：%s", e)
+			self._disconnected = True
+			self._task = None
+			self._evict()
+		finally:
+			# detach 後可能已經換成新連線的 task
+			if self._task is asyncio.current_task():
+				self._task = None
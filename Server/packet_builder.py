@@ -0,0 +1,119 @@
+import struct
+
+from game_define import PROTOCOL_SERVER
+
+
+# 常用欄位格式
+_UINT16 = struct.Struct("<H")
+_INT16 = struct.Struct("<h")
+_UINT32 = struct.Struct("<I")
+_INT32 = struct.Struct("<i")
+
+# 固定長度封包的完整格式 (含開頭的 protocol)
+FIXED_LAYOUTS: dict[PROTOCOL_SERVER, struct.Struct] = {
+	PROTOCOL_SERVER.DISCONNECT:			struct.Struct("<BH"),		# uid
+	PROTOCOL_SERVER.JOIN_GAME:			struct.Struct("<BH"),		# uid
+	PROTOCOL_SERVER.LEAVE_GAME:			struct.Struct("<BH"),		# uid
+	PROTOCOL_SERVER.START:				struct.Struct("<B"),
+	PROTOCOL_SERVER.GAMESTATE:			struct.Struct("<BB"),		# state
+	PROTOCOL_SERVER.VOTE:				struct.Struct("<BHB"),		# uid, vote
+	PROTOCOL_SERVER.GUESS_AGAIN:		struct.Struct("<B"),
+	PROTOCOL_SERVER.END:				struct.Struct("<BB"),		# is_force
+	PROTOCOL_SERVER.SKIP_GUESS:			struct.Struct("<BH"),		# uid
+	PROTOCOL_SERVER.VERSION:			struct.Struct("<BI"),		# version
+	PROTOCOL_SERVER.ROOM_ID:			struct.Struct("<Bi"),		# room_id
+	PROTOCOL_SERVER.SETTINGS:			struct.Struct("<BHBB"),		# max_number, group_count, number_per_player
+	PROTOCOL_SERVER.UID:				struct.Struct("<BH"),		# uid
+	PROTOCOL_SERVER.POSE_NUMBER:		struct.Struct("<BHH"),		# uid, number
+	PROTOCOL_SERVER.URGENT_PLAYER:		struct.Struct("<BHB"),		# uid, is_urgent
+	PROTOCOL_SERVER.RESET_GAME_DATA:	struct.Struct("<B"),
+	PROTOCOL_SERVER.KICK:				struct.Struct("<BB"),		# reason
+	PROTOCOL_SERVER.RESUME:				struct.Struct("<BBHI"),		# result, uid, received_count
+	PROTOCOL_SERVER.SHUTDOWN:			struct.Struct("<BH"),		# seconds
+	PROTOCOL_SERVER.ROOM_REMOVED:		struct.Struct("<BI"),		# room_id
+	PROTOCOL_SERVER.ROOM_BUSY:			struct.Struct("<BB"),		# protocol
+}
+
+
+def pack(protocol: PROTOCOL_SERVER, *values) -> bytes:
+	"""用預先編譯的格式打包固定長度的封包。"""
+	return FIXED_LAYOUTS[protocol].pack(protocol, *values)
+
+
+class PacketWriter:
+	"""可重複使用的封包寫入緩衝區。
+
+	欄位以預先編譯的 struct 格式直接附加到同一個 bytearray 後面 (攤銷 O(1))，
+	避免 `bytes() += ...` 每次串接都複製整個封包。
+	"""
+	def __init__(self):
+		self._buffer = bytearray()
+
+	def begin(self, protocol: PROTOCOL_SERVER) -> 'PacketWriter':
+		"""清空緩衝區並開始寫入新的封包。"""
+		self._buffer.clear()
+		self._buffer.append(protocol)
+		return self
+
+	def begin_section(self) -> 'PacketWriter':
+		"""清空緩衝區並開始寫入不含 protocol 的封包片段。"""
+		self._buffer.clear()
+		return self
+
+	def finish(self) -> bytes:
+		"""取出目前寫入的封包內容。"""
+		return bytes(self._buffer)
+
+	def write_struct(self, layout: struct.Struct, *values) -> 'PacketWriter':
+		self._buffer += layout.pack(*values)
+		return self
+
+	def write_uint8(self, value: int) -> 'PacketWriter':
+		self._buffer.append(value)
+		return self
+
+	def write_bool(self, value: bool) -> 'PacketWriter':
+		self._buffer.append(1 if value else 0)
+		return self
+
+	def write_uint16(self, value: int) -> 'PacketWriter':
+		self._buffer += _UINT16.pack(value)
+		return self
+
+	def write_int16(self, value: int) -> 'PacketWriter':
+		self._buffer += _INT16.pack(value)
+		return self
+
+	def write_uint32(self, value: int) -> 'PacketWriter':
+		self._buffer += _UINT32.pack(value)
+		return self
+
+	def write_int32(self, value: int) -> 'PacketWriter':
+		self._buffer += _INT32.pack(value)
+		return self
+
+	def write_bytes(self, data: bytes) -> 'PacketWriter':
+		self._buffer += data
+		return self
+
+	def write_string(self, text: str | bytes) -> 'PacketWriter':
+		"""寫入 1 byte 長度開頭的 utf8 字串。"""
+		encoded = text.encode("utf8") if isinstance(text, str) else text
+		self._buffer.append(len(encoded))
+		self._buffer += encoded
+		return self
+
+
+# 封包都在同步流程中一次寫完，整個伺服器共用同一個緩衝區即可
+_writer = PacketWriter()
+
+def begin(protocol: PROTOCOL_SERVER) -> PacketWriter:
+	"""取得共用的封包寫入器並開始寫入新封包。
+
+	在呼叫 `finish()` 之前不可以開始寫入另一個封包。
+	"""
+	return _writer.begin(protocol)
+
+def begin_section() -> PacketWriter:
+	"""取得共用的封包寫入器並開始寫入封包片段，限制同 `begin`。"""
+	return _writer.begin_section()
@@ -0,0 +1,88 @@
+import time
+
+from config import CONFIG
+from game_define import PROTOCOL_CLIENT, RATE_LIMIT_ACTION
+import logger
+from logger import LOG_CATEGORY
+
+
+# 各協定的 [每秒補充數量, 最大累積數量]，沒有列出的協定使用 DEFAULT
+# ALL 為整條連線所有訊息共用的上限
+_DEFAULT_RATE_LIMITS: dict[str, tuple[float, float]] = {
+	"ALL":			(30, 60),
+	"DEFAULT":		(10, 30),
+	"NAME":			(1, 5),
+	"CHAT":			(3, 10),
+	"QUESTION":		(10, 20),
+	"GUESS":		(3, 10),
+	"VOTE":			(5, 10),
+	"SET_URGENT":	(5, 10),
+	"FETCH_USERS":	(5, 20),
+	"BROWSE_ROOMS":	(3, 10),
+	"QUICK_JOIN":	(1, 5),
+}
+RATE_LIMITS: dict[str, tuple[float, float]] = _DEFAULT_RATE_LIMITS | CONFIG.get("RATE_LIMITS", {})
+
+# 違規 (被丟棄的訊息) 累積到一定次數後禁言一段時間，再多就中斷連線
+# 超過 RATE_LIMIT_FORGIVE_AFTER 秒沒有違規時重新計算
+RATE_LIMIT_MUTE_AFTER: int = CONFIG.get("RATE_LIMIT_MUTE_AFTER", 10)
+RATE_LIMIT_MUTE_DURATION: float = CONFIG.get("RATE_LIMIT_MUTE_DURATION", 30)
+RATE_LIMIT_DISCONNECT_AFTER: int = CONFIG.get("RATE_LIMIT_DISCONNECT_AFTER", 50)
+RATE_LIMIT_FORGIVE_AFTER: float = CONFIG.get("RATE_LIMIT_FORGIVE_AFTER", 60)
+
+# 禁言期間仍然會處理的協定，讓使用者可以離開
+_MUTE_EXEMPT = frozenset((PROTOCOL_CLIENT.VERSION, PROTOCOL_CLIENT.LEAVE_GAME, PROTOCOL_CLIENT.LEAVE_ROOM))
+
+# 以協定編號為索引的 (rate, burst)，最後一個是未定義協定共用的 DEFAULT，再後面是 ALL
+_RULES: list[tuple[float, float]] = [
+	tuple(RATE_LIMITS.get(protocol.name, RATE_LIMITS["DEFAULT"])) for protocol in PROTOCOL_CLIENT
+] + [tuple(RATE_LIMITS["DEFAULT"]), tuple(RATE_LIMITS["ALL"])]
+_UNKNOWN_INDEX = len(PROTOCOL_CLIENT)
+_ALL_INDEX = _UNKNOWN_INDEX + 1
+
+
+class RateLimiter:
+	"""單一連線的 token bucket 流量限制。
+
+	只看訊息的第一個 byte (協定)，在解析訊息內容之前就決定是否處理。
+	"""
+	def __init__(self, uid: int):
+		self._uid = uid
+		now = time.monotonic()
+		self._tokens: list[float] = [burst for _, burst in _RULES]
+		self._updated: list[float] = [now] * len(_RULES)
+		self._violations = 0
+		self._last_violation = 0.0
+		self._muted_until = 0.0
+	
+	def _take(self, index: int, now: float) -> bool:
+		rate, burst = _RULES[index]
+		tokens = min(burst, self._tokens[index] + (now - self._updated[index]) * rate)
+		self._updated[index] = now
+		if tokens < 1:
+			self._tokens[index] = tokens
+			return False
+		self._tokens[index] = tokens - 1
+		return True
+	
+	def check(self, protocol: int) -> RATE_LIMIT_ACTION:
+		"""扣除協定與整條連線的 token，判斷這則訊息要如何處理。"""
+		now = time.monotonic()
+		index = protocol if protocol < _UNKNOWN_INDEX else _UNKNOWN_INDEX
+		if self._take(_ALL_INDEX, now) and self._take(index, now):
+			if now < self._muted_until and protocol not in _MUTE_EXEMPT:
+				return RATE_LIMIT_ACTION.DROP
+			return RATE_LIMIT_ACTION.ALLOW
+		
+		if now - self._last_violation > RATE_LIMIT_FORGIVE_AFTER:
+			self._violations = 0
+		self._last_violation = now
+		self._violations += 1
+		
+		if self._violations >= RATE_LIMIT_DISCONNECT_AFTER:
+			logger.warning(LOG_CATEGORY.CONNECTION, "使用者持續送出過多訊息，中斷連線", uid=self._uid, protocol=protocol)
+			return RATE_LIMIT_ACTION.DISCONNECT
+		if self._violations == RATE_LIMIT_MUTE_AFTER:
+			logger.warning(LOG_CATEGORY.CONNECTION, "使用者送出過多訊息，禁言 %d 秒", RATE_LIMIT_MUTE_DURATION, uid=self._uid, protocol=protocol)
+			self._muted_until = now + RATE_LIMIT_MUTE_DURATION
+		return RATE_LIMIT_ACTION.DROP
@@ -0,0 +1,340 @@
+import bisect
+import collections
+import heapq
+import itertools
+import struct
+import time
+from collections.abc import Callable, Hashable, Iterable, Iterator
+from typing import TYPE_CHECKING
+
+from config import CONFIG
+from game_define import GAME_TYPE, PROTOCOL_SERVER, ROOM_LIST_STATE
+import metrics
+import network
+import packet_builder
+import timer_wheel
+from timer_wheel import Timer
+from user import User
+
+if TYPE_CHECKING:
+	from game_rooms.base_game_room import BaseGameRoom
+
+
+# 大廳房間列表每頁的房間數量，ROOM_LIST 的數量欄位只有 1 byte，不能超過 255
+ROOM_LIST_PAGE_SIZE: int = min(CONFIG.get("ROOM_LIST_PAGE_SIZE", 20), 0xFF)
+# 每次瀏覽最多檢查的房間數量，超過時提早返回目前的結果與下一頁的位置
+ROOM_LIST_SCAN_LIMIT: int = CONFIG.get("ROOM_LIST_SCAN_LIMIT", 1000)
+# 房間資訊變動後更新索引並推送給訂閱中的大廳使用者的間隔 (秒)
+ROOM_LIST_UPDATE_INTERVAL: float = CONFIG.get("ROOM_LIST_UPDATE_INTERVAL", 1.0)
+# 快速加入時每個房間最多放入的人數 (不超過一般房間的人數上限)
+QUICK_JOIN_ROOM_SIZE: int = min(CONFIG.get("QUICK_JOIN_ROOM_SIZE", 8), 0xFF)
+
+# 房間編號, 遊戲類型, 是否為大型房間, 是否進行中, 使用者數量, 玩家數量
+_ENTRY = struct.Struct("<IB??HH")
+_ALL = None
+
+
+class RoomListing:
+	"""大廳房間列表中的一個房間。
+
+	`entry` 為序列化後的內容 ([_ENTRY][遊戲設定 (1 byte 長度開頭)])，ROOM_LIST 與 ROOM_UPDATE 共用，
+	內容相同就代表客戶端看到的資訊沒有變動
+	"""
+	__slots__ = ("room_id", "game_type", "large", "playing", "user_count", "player_count", "settings", "entry")
+
+	def __init__(self, room_id: int, game_type: GAME_TYPE, large: bool, playing: bool, user_count: int, player_count: int, settings: bytes):
+		self.room_id = room_id
+		self.game_type = game_type
+		self.large = large
+		self.playing = playing
+		self.user_count = user_count
+		self.player_count = player_count
+		self.settings = settings
+		self.entry = _ENTRY.pack(room_id, game_type, large, playing, user_count, player_count) + bytes((len(settings),)) + settings
+
+
+class RoomFilter:
+	"""BROWSE_ROOMS 的篩選條件，`game_type` 為 0、`settings` 為空時不限。"""
+	__slots__ = ("game_type", "state", "min_players", "max_players", "settings")
+
+	def __init__(self, game_type: int, state: ROOM_LIST_STATE, min_players: int, max_players: int, settings: bytes):
+		self.game_type = game_type
+		self.state = state
+		self.min_players = min_players
+		self.max_players = max_players
+		self.settings = settings
+
+	def limits_players(self) -> bool:
+		return self.min_players > 0 or self.max_players < 0xFFFF
+
+	def matches(self, listing: RoomListing) -> bool:
+		return (
+			(not self.game_type or listing.game_type == self.game_type) and
+			(self.state == ROOM_LIST_STATE.ANY or listing.playing == (self.state == ROOM_LIST_STATE.PLAYING)) and
+			self.min_players <= listing.player_count <= self.max_players and
+			(not self.settings or listing.settings == self.settings)
+		)
+
+
+class _SortedIndex:
+	"""房間列表的次要索引：欄位值 → 依房間編號排序的房間編號列表。"""
+	def __init__(self, key: Callable[[RoomListing], Hashable]):
+		self._key = key
+		self._buckets: dict[Hashable, list[int]] = {}
+
+	def add(self, listing: RoomListing):
+		bisect.insort(self._buckets.setdefault(self._key(listing), []), listing.room_id)
+
+	def remove(self, listing: RoomListing):
+		key = self._key(listing)
+		bucket = self._buckets[key]
+		del bucket[bisect.bisect_left(bucket, listing.room_id)]
+		if not bucket:
+			del self._buckets[key]
+
+	def get_keys(self) -> Iterable[Hashable]:
+		return self._buckets.keys()
+
+	def get_buckets(self, keys: Iterable[Hashable]) -> list[list[int]]:
+		return [self._buckets[key] for key in keys if key in self._buckets]
+
+
+def _iterate_after(bucket: list[int], after_room_id: int) -> Iterator[int]:
+	"""從排序好的列表中 `after_room_id` 之後的位置開始迭代，不需要走過前面的部分。"""
+	return map(bucket.__getitem__, range(bisect.bisect_right(bucket, after_room_id), len(bucket)))
+
+
+class RoomDirectory:
+	"""大廳的房間列表。
+
+	房間資訊依遊戲類型、是否進行中、玩家數量與遊戲設定各自建立依房間編號排序的索引，
+	瀏覽時只從最小的候選索引中 `after_room_id` 之後的位置開始檢查，不需要掃過所有房間。
+
+	房間狀態變動時只標記，由計時器每 ROOM_LIST_UPDATE_INTERVAL 秒統一更新索引，
+	再把這段期間有變動的房間推送給訂閱中的大廳使用者 (ROOM_UPDATE / ROOM_REMOVED)。
+	同一個房間在期間內的多次變動只推送最後的結果，訂閱者收到的是所有符合條件的房間的變動，
+	不限於已經瀏覽過的頁面。
+	每個 worker 行程只列出自己負責的房間。
+
+	快速加入使用的候選房間另外依遊戲類型放在 heap 中，人數最多 (但還沒到 QUICK_JOIN_ROOM_SIZE)
+	的房間優先，同樣人數時較早建立的優先。heap 中過期的項目不會移除，取用時再略過，
+	取用時也會用房間當下的狀態重新確認，不受索引更新的間隔影響。
+	"""
+	def __init__(self):
+		self._rooms: dict[int, 'BaseGameRoom'] = {}
+		self._listings: dict[int, RoomListing] = {}
+		self._all = _SortedIndex(lambda listing: _ALL)
+		self._by_type = _SortedIndex(lambda listing: listing.game_type)
+		self._by_playing = _SortedIndex(lambda listing: listing.playing)
+		self._by_players = _SortedIndex(lambda listing: listing.player_count)
+		self._by_settings = _SortedIndex(lambda listing: listing.settings)
+		self._indexes = (self._all, self._by_type, self._by_playing, self._by_players, self._by_settings)
+
+		# 需要重新取得資訊的房間
+		self._dirty: set[int] = set()
+		# 這段期間有變動的房間 → 訂閱者目前看到的資訊 (新房間為 None)
+		self._changes: dict[int, RoomListing | None] = {}
+		self._timer: Timer | None = None
+
+		# 依篩選的遊戲類型 (0 為不限) 分組的訂閱者
+		self._subscribers: dict[int, dict[int, tuple[User, RoomFilter]]] = collections.defaultdict(dict)
+		self._subscribed_types: dict[int, int] = {}
+
+		# 快速加入的候選房間 (-人數, 建立順序, 房間編號)，以及每個房間目前有效的 (-人數, 建立順序)
+		self._quick_join_rooms: dict[GAME_TYPE, list[tuple[int, int, int]]] = collections.defaultdict(list)
+		self._quick_join_keys: dict[int, tuple[int, int]] = {}
+		self._room_orders: dict[int, int] = {}
+		self._next_order = itertools.count()
+
+	def _index(self, listing: RoomListing):
+		self._listings[listing.room_id] = listing
+		for index in self._indexes:
+			index.add(listing)
+
+	def _unindex(self, listing: RoomListing):
+		del self._listings[listing.room_id]
+		for index in self._indexes:
+			index.remove(listing)
+
+	def add(self, room: 'BaseGameRoom'):
+		"""列出新的房間。"""
+		self._rooms[room.get_id()] = room
+		self._room_orders[room.get_id()] = next(self._next_order)
+		listing = room.get_listing()
+		self._index(listing)
+		self._update_quick_join(listing)
+		self._record_change(room.get_id(), None)
+
+	def remove(self, room_id: int):
+		"""移除已經關閉的房間。"""
+		if self._rooms.pop(room_id, None) is None:
+			return
+		self._dirty.discard(room_id)
+		del self._room_orders[room_id]
+		self._quick_join_keys.pop(room_id, None)
+		listing = self._listings[room_id]
+		self._unindex(listing)
+		self._record_change(room_id, listing)
+
+	def mark_dirty(self, room_id: int):
+		"""房間的成員或狀態變動，下次更新時重新取得房間資訊。"""
+		if room_id in self._rooms:
+			self._dirty.add(room_id)
+			self._schedule_update()
+
+	def _record_change(self, room_id: int, previous: RoomListing | None):
+		# 只保留這段期間第一次變動前的資訊，也就是訂閱者目前看到的版本
+		self._changes.setdefault(room_id, previous)
+		self._schedule_update()
+
+	def _schedule_update(self):
+		if not self._timer:
+			self._timer = timer_wheel.schedule(ROOM_LIST_UPDATE_INTERVAL, self._update)
+
+	def _update(self):
+		"""重新取得有變動的房間資訊並更新索引，再推送給訂閱者。"""
+		self._timer = None
+		for room_id in self._dirty:
+			previous = self._listings[room_id]
+			listing = self._rooms[room_id].get_listing()
+			if listing.entry != previous.entry:
+				self._unindex(previous)
+				self._index(listing)
+				self._changes.setdefault(room_id, previous)
+			# 列表內容沒變也可能在取用時被移出快速加入的候選 (例如短暫進入遊戲)
+			self._update_quick_join(listing)
+		self._dirty.clear()
+
+		changes = self._changes
+		self._changes = {}
+		if self._subscribed_types:
+			self._publish(changes)
+
+	def _publish(self, changes: dict[int, RoomListing | None]):
+		"""把房間的變動推送給篩選條件符合變動前或變動後的訂閱者。"""
+		started = time.perf_counter()
+		pending: dict[int, list[bytes]] = collections.defaultdict(list)
+		for room_id, previous in changes.items():
+			listing = self._listings.get(room_id)
+			if listing is previous or (listing and previous and listing.entry == previous.entry):
+				# 期間內建立又關閉，或變動後又恢復原狀
+				continue
+
+			game_type = (listing or previous).game_type
+			update = packet_builder.begin(PROTOCOL_SERVER.ROOM_UPDATE).write_bytes(listing.entry).finish() if listing else None
+			removed = packet_builder.pack(PROTOCOL_SERVER.ROOM_REMOVED, room_id) if previous else None
+			for subscribers in (self._subscribers[0], self._subscribers[game_type]):
+				for uid, (user, room_filter) in subscribers.items():
+					if listing and room_filter.matches(listing):
+						pending[uid].append(update)
+					elif previous and room_filter.matches(previous):
+						pending[uid].append(removed)
+
+		for uid, packets in pending.items():
+			user = self._subscribers[self._subscribed_types[uid]][uid][0]
+			if user.room_id >= 0 or user.sender.is_closing():
+				# 已經進入房間或中斷連線的使用者不再接收大廳的變動
+				self.unsubscribe(uid)
+				continue
+			for packet in network.pack_batches(packets):
+				user.send(packet)
+		if pending:
+			metrics.observe_broadcast(PROTOCOL_SERVER.ROOM_UPDATE, len(pending), time.perf_counter() - started)
+
+	def subscribe(self, user: User, room_filter: RoomFilter):
+		"""之後符合 `room_filter` 的房間變動都推送給 `user`，取代先前的訂閱。"""
+		self.unsubscribe(user.uid)
+		self._subscribers[room_filter.game_type][user.uid] = (user, room_filter)
+		self._subscribed_types[user.uid] = room_filter.game_type
+
+	def unsubscribe(self, uid: int):
+		"""取消大廳房間變動的訂閱。"""
+		game_type = self._subscribed_types.pop(uid, None)
+		if game_type is not None:
+			del self._subscribers[game_type][uid]
+
+	def _update_quick_join(self, listing: RoomListing):
+		"""依房間資訊加入、更新或移除快速加入的候選。"""
+		room_id = listing.room_id
+		if listing.large or listing.playing or listing.user_count >= QUICK_JOIN_ROOM_SIZE:
+			self._quick_join_keys.pop(room_id, None)
+			return
+		key = (-listing.user_count, self._room_orders[room_id])
+		if self._quick_join_keys.get(room_id) != key:
+			self._quick_join_keys[room_id] = key
+			heapq.heappush(self._quick_join_rooms[listing.game_type], key + (room_id,))
+
+	def discard_quick_join(self, room_id: int):
+		"""暫時不再把房間當作快速加入的候選，房間資訊下次變動時重新判斷。"""
+		self._quick_join_keys.pop(room_id, None)
+
+	def find_quick_join_room(self, game_type: GAME_TYPE) -> tuple['BaseGameRoom', int] | None:
+		"""找出可以快速加入的 `game_type` 房間，返回 (房間, 還可以放入的人數)，沒有時返回 None。
+
+		返回的房間仍然留在候選中，放入使用者後人數改變會在下次取用時重新排序
+		"""
+		heap = self._quick_join_rooms[game_type]
+		while heap:
+			negative_count, order, room_id = heap[0]
+			if self._quick_join_keys.get(room_id) != (negative_count, order):
+				heapq.heappop(heap)
+				continue
+			
+			room = self._rooms[room_id]
+			user_count = len(room.get_user_ids())
+			if room.is_playing() or room.is_full() or user_count >= QUICK_JOIN_ROOM_SIZE:
+				heapq.heappop(heap)
+				del self._quick_join_keys[room_id]
+				continue
+			if user_count != -negative_count:
+				# 索引更新前人數已經改變，用目前的人數重新排序
+				heapq.heapreplace(heap, (-user_count, order, room_id))
+				self._quick_join_keys[room_id] = (-user_count, order)
+				continue
+			return room, QUICK_JOIN_ROOM_SIZE - user_count
+		return None
+
+	def browse(self, room_filter: RoomFilter, after_room_id: int) -> tuple[list[RoomListing], int]:
+		"""取得房間編號大於 `after_room_id` 且符合條件的一頁房間，返回 (房間列表, 下一頁的 after_room_id)。
+
+		沒有下一頁時 after_room_id 為 0
+		"""
+		# 每個指定的條件都對應一組候選索引列表，從房間總數最少的一組開始找
+		candidates = [self._all.get_buckets((_ALL,))]
+		if room_filter.game_type:
+			candidates.append(self._by_type.get_buckets((room_filter.game_type,)))
+		if room_filter.state != ROOM_LIST_STATE.ANY:
+			candidates.append(self._by_playing.get_buckets((room_filter.state == ROOM_LIST_STATE.PLAYING,)))
+		if room_filter.limits_players():
+			counts = [count for count in self._by_players.get_keys() if room_filter.min_players <= count <= room_filter.max_players]
+			candidates.append(self._by_players.get_buckets(counts))
+		if room_filter.settings:
+			candidates.append(self._by_settings.get_buckets((room_filter.settings,)))
+		buckets = min(candidates, key=lambda buckets: sum(map(len, buckets)))
+
+		listings: list[RoomListing] = []
+		scanned = 0
+		for room_id in heapq.merge(*(_iterate_after(bucket, after_room_id) for bucket in buckets)):
+			listing = self._listings[room_id]
+			if room_filter.matches(listing):
+				if len(listings) == ROOM_LIST_PAGE_SIZE:
+					return listings, listings[-1].room_id
+				listings.append(listing)
+			scanned += 1
+			if scanned >= ROOM_LIST_SCAN_LIMIT:
+				return listings, room_id
+		return listings, 0
+
+	def send_room_list(self, user: User, room_filter: RoomFilter, after_room_id: int):
+		"""送出符合條件的下一頁房間 (BROWSE_ROOMS)。"""
+		listings, next_room_id = self.browse(room_filter, after_room_id)
+		writer = packet_builder.begin(PROTOCOL_SERVER.ROOM_LIST)
+		writer.write_uint32(after_room_id).write_uint8(len(listings))
+		for listing in listings:
+			writer.write_bytes(listing.entry)
+		writer.write_uint32(next_room_id)
+		user.send(writer.finish())
+
+
+# 每個 worker 行程各自一個
+directory = RoomDirectory()
@@ -0,0 +1,194 @@
+import asyncio
+import os
+import struct
+import time
+from collections.abc import Callable, Iterable
+
+from config import CONFIG
+from game_define import CONST
+import logger
+from logger import LOG_CATEGORY
+
+
+# 快照檔案路徑，未設定時不寫入也不還原
+SNAPSHOT_PATH: str | None = CONFIG.get("SNAPSHOT_PATH")
+# 檢查房間是否有變動並寫入快照的間隔 (秒)
+SNAPSHOT_INTERVAL: float = CONFIG.get("SNAPSHOT_INTERVAL", 5)
+# 超過這個秒數的快照視為過期，不還原
+SNAPSHOT_MAX_AGE: float = CONFIG.get("SNAPSHOT_MAX_AGE", 600)
+
+_MAGIC = b"MPGS"
+_FORMAT_VERSION = 2
+# magic, 格式版本, 遊戲版本, 寫入時間, 房間數量
+_HEADER = struct.Struct("<4sHIdI")
+_UINT8 = struct.Struct("<B")
+_UINT16 = struct.Struct("<H")
+_INT16 = struct.Struct("<h")
+_UINT32 = struct.Struct("<I")
+_UINT64 = struct.Struct("<Q")
+
+
+class SnapshotError(Exception):
+	"""快照內容不完整或格式不符。"""
+
+
+class SnapshotReader:
+	"""依序讀取快照內容，欄位格式與 `packet_builder.PacketWriter` 寫入的相同。"""
+	def __init__(self, data: bytes):
+		self._view = memoryview(data)
+		self._offset = 0
+
+	def _read(self, layout: struct.Struct):
+		if self._offset + layout.size > len(self._view):
+			raise SnapshotError("快照內容不完整")
+		value, = layout.unpack_from(self._view, self._offset)
+		self._offset += layout.size
+		return value
+
+	def read_uint8(self) -> int:
+		return self._read(_UINT8)
+
+	def read_bool(self) -> bool:
+		return self._read(_UINT8) != 0
+
+	def read_uint16(self) -> int:
+		return self._read(_UINT16)
+
+	def read_int16(self) -> int:
+		return self._read(_INT16)
+
+	def read_uint32(self) -> int:
+		return self._read(_UINT32)
+
+	def read_uint64(self) -> int:
+		return self._read(_UINT64)
+
+	def read_bytes(self, size: int) -> bytes:
+		if self._offset + size > len(self._view):
+			raise SnapshotError("快照內容不完整")
+		data = bytes(self._view[self._offset:self._offset + size])
+		self._offset += size
+		return data
+
+	def read_string(self) -> str:
+		"""讀取 1 byte 長度開頭的 utf8 字串。"""
+		return self.read_bytes(self.read_uint8()).decode("utf8")
+
+	def read_remaining(self) -> bytes:
+		"""讀取剩下的所有內容。"""
+		return self.read_bytes(len(self._view) - self._offset)
+
+
+_path = SNAPSHOT_PATH
+
+def configure_path(worker_index: int):
+	"""多行程模式下每個 worker 各自使用 `SNAPSHOT_PATH.<worker 編號>`。"""
+	global _path
+	if SNAPSHOT_PATH:
+		_path = f"{SNAPSHOT_PATH}.{worker_index}"
+
+def get_path() -> str | None:
+	"""取得當前 worker 使用的快照檔案路徑。"""
+	return _path
+
+def encode(records: Iterable[bytes]) -> bytes:
+	"""把各房間的快照組合成完整的快照檔案內容。"""
+	records = list(records)
+	parts = [_HEADER.pack(_MAGIC, _FORMAT_VERSION, CONST.GAME_VERSION, time.time(), len(records))]
+	for record in records:
+		parts.append(_UINT32.pack(len(record)))
+		parts.append(record)
+	return b"".join(parts)
+
+def decode(data: bytes) -> list[SnapshotReader]:
+	"""拆出各房間的快照，版本不符或已經過期時返回空列表。"""
+	if len(data) < _HEADER.size:
+		raise SnapshotError("快照內容不完整")
+	magic, format_version, game_version, written_at, count = _HEADER.unpack_from(data)
+	if magic != _MAGIC:
+		raise SnapshotError("不是快照檔案")
+	if format_version != _FORMAT_VERSION or game_version != CONST.GAME_VERSION:
+		logger.warning(LOG_CATEGORY.SERVER, "快照版本不符，略過還原", format_version=format_version, game_version=game_version)
+		return []
+	if time.time() - written_at > SNAPSHOT_MAX_AGE:
+		logger.warning(LOG_CATEGORY.SERVER, "快照已經過期，略過還原", age=f"{time.time() - written_at:.0f}")
+		return []
+
+	reader = SnapshotReader(data)
+	reader.read_bytes(_HEADER.size)
+	return [SnapshotReader(reader.read_bytes(reader.read_uint32())) for _ in range(count)]
+
+def load() -> list[SnapshotReader]:
+	"""讀取快照檔案，沒有可用的快照時返回空列表。"""
+	path = get_path()
+	if not path:
+		return []
+	try:
+		with open(path, "rb") as file:
+			data = file.read()
+	except FileNotFoundError:
+		return []
+
+	try:
+		return decode(data)
+	except SnapshotError as e:
+		logger.warning(LOG_CATEGORY.SERVER, "無法讀取快照：%s", e, path=path)
+		return []
+
+def _write_file(path: str, data: bytes):
+	# 先寫到暫存檔再取代，寫到一半中斷也不會留下損壞的快照
+	temp_path = path + ".tmp"
+	with open(temp_path, "wb") as file:
+		file.write(data)
+		file.flush()
+		os.fsync(file.fileno())
+	os.replace(temp_path, path)
+
+
+class SnapshotWriter:
+	"""定期把房間的快照寫入檔案。
+
+	每個房間自己快取序列化結果 (`BaseGameRoom.get_snapshot`)，只有變動過的房間
+	需要重新序列化；沒有任何房間變動時不寫入。檔案寫入在背景執行緒進行。
+	"""
+	def __init__(self, get_records: Callable[[], dict[int, bytes]]):
+		self._get_records = get_records
+		self._written: dict[int, bytes] = {}
+		self._task: asyncio.Task | None = None
+
+	def start(self):
+		"""開始定期寫入快照，未設定 SNAPSHOT_PATH 時不啟動。"""
+		if get_path() and not self._task:
+			self._task = asyncio.create_task(self._run())
+
+	async def stop(self):
+		"""停止定期寫入，並寫入最後一次快照。"""
+		if self._task:
+			self._task.cancel()
+			await asyncio.gather(self._task, return_exceptions=True)
+			self._task = None
+		await self.write()
+
+	async def write(self):
+		"""有房間變動時寫入快照。"""
+		path = get_path()
+		if not path:
+			return
+
+		records = self._get_records()
+		if records.keys() == self._written.keys() and all(records[id] is self._written[id] for id in records):
+			return
+
+		data = encode(records.values())
+		started = time.perf_counter()
+		await asyncio.to_thread(_write_file, path, data)
+		self._written = records
+		logger.debug(LOG_CATEGORY.SERVER, "已寫入快照", rooms=len(records), size=len(data), seconds=f"{time.perf_counter() - started:.3f}")
+
+	async def _run(self):
+		while True:
+			await asyncio.sleep(SNAPSHOT_INTERVAL)
+			try:
+				await self.write()
+			except OSError as e:
+				logger.error(LOG_CATEGORY.SERVER, "寫入快照失敗：%s", e, path=get_path())
@@ -0,0 +1,121 @@
+import asyncio
+import math
+from collections.abc import Callable
+
+from config import CONFIG
+import logger
+from logger import LOG_CATEGORY
+
+
+TIMER_TICK: float = CONFIG.get("TIMER_TICK", 0.1)
+
+# 每一層有 64 格，第 n 層每一格代表 64^n 個 tick
+_SLOT_BITS = 6
+_SLOT_COUNT = 1 << _SLOT_BITS
+_SLOT_MASK = _SLOT_COUNT - 1
+_LEVEL_COUNT = 4
+
+
+class Timer:
+	"""排程中的計時器，到期時呼叫 `callback()`。"""
+	__slots__ = ("_wheel", "_slot", "expires", "callback")
+
+	def __init__(self, wheel: 'TimerWheel', expires: int, callback: Callable[[], None]):
+		self._wheel = wheel
+		self._slot: set[Timer] | None = None
+		self.expires = expires
+		self.callback = callback
+
+	def cancel(self):
+		"""取消計時器，已經到期或取消過的計時器不會有任何作用。"""
+		if self._slot is None:
+			return
+		self._slot.discard(self)
+		self._slot = None
+		self._wheel._count -= 1
+
+
+class TimerWheel:
+	"""階層式時間輪。
+
+	所有計時器共用一個每 `tick` 秒推進一次的 task，排程與取消都是 O(1)。
+	到期時間較遠的計時器放在較高的層，在時間接近時才逐層往下搬，
+	每個計時器最多被搬動 `_LEVEL_COUNT` 次。
+	"""
+	def __init__(self, tick: float):
+		self._tick = tick
+		self._levels: list[list[set[Timer]]] = [[set() for _ in range(_SLOT_COUNT)] for _ in range(_LEVEL_COUNT)]
+		self._current = 0  # 已經處理到的 tick
+		self._count = 0
+		self._origin = 0.0
+		self._task: asyncio.Task | None = None
+
+	def schedule(self, delay: float, callback: Callable[[], None]) -> Timer:
+		"""在 `delay` 秒後呼叫 `callback()`，不會提早，延遲在一個 tick 以內。"""
+		loop = asyncio.get_running_loop()
+		if not self._task:
+			self._origin = loop.time() - self._current * self._tick
+			self._task = loop.create_task(self._run())
+		
+		expires = math.ceil((loop.time() - self._origin + delay) / self._tick)
+		timer = Timer(self, max(self._current + 1, expires), callback)
+		self._place(timer)
+		self._count += 1
+		return timer
+
+	def _place(self, timer: Timer):
+		"""依照到期時間與當前 tick 的差距放進對應的層。"""
+		level = 0
+		while level < _LEVEL_COUNT - 1 and (timer.expires >> (_SLOT_BITS * (level + 1))) != (self._current >> (_SLOT_BITS * (level + 1))):
+			level += 1
+		slot = self._levels[level][(timer.expires >> (_SLOT_BITS * level)) & _SLOT_MASK]
+		slot.add(timer)
+		timer._slot = slot
+
+	def _advance(self):
+		"""推進一個 tick 並執行到期的計時器。"""
+		self._current += 1
+
+		# 進入上層的下一格時，把那一格的計時器往下搬
+		for level in range(1, _LEVEL_COUNT):
+			if self._current & ((1 << (_SLOT_BITS * level)) - 1):
+				break
+			slots = self._levels[level]
+			index = (self._current >> (_SLOT_BITS * level)) & _SLOT_MASK
+			timers, slots[index] = slots[index], set()
+			for timer in timers:
+				self._place(timer)
+
+		slots = self._levels[0]
+		index = self._current & _SLOT_MASK
+		expired, slots[index] = slots[index], set()
+		# 計時器仍然指向 expired，前面的 callback 取消同一批的計時器時會從中移除並減少計數，
+		# 所以逐一處理快照，並跳過已經被取消的計時器
+		for timer in list(expired):
+			if timer._slot is None:
+				continue
+			timer._slot = None
+			self._count -= 1
+			try:
+				timer.callback()
+			except Exception as e:
+				logger.exception(LOG_CATEGORY.SERVER, "執行計時器時發生錯誤：%s", e)
+
+	async def _run(self):
+		loop = asyncio.get_running_loop()
+		try:
+			while self._count > 0:
+				await asyncio.sleep(self._origin + (self._current + 1) * self._tick - loop.time())
+				target = int((loop.time() - self._origin) / self._tick)
+				while self._current < target and self._count > 0:
+					self._advance()
+		finally:
+			self._task = None
+
+
+# 整個伺服器共用一個時間輪
+_wheel = TimerWheel(TIMER_TICK)
+
+def schedule(delay: float, callback: Callable[[], None]) -> Timer:
+	"""在 `delay` 秒後呼叫 `callback()`。"""
+	return _wheel.schedule(delay, callback)
@@ -0,0 +1,223 @@
+"""permessage-deflate 壓縮設定比較。
+
+在行程內用真實的房間程式跑完整的猜名詞與數字排列遊戲，錄下一個玩家收到的所有封包
+(中途另有使用者進房收到 INIT)，再用不同的壓縮設定逐則壓縮，比較每種遊戲類型下：
+- 實際送出的位元組數 (含 websocket frame 標頭) 與節省的比例
+- 壓縮花費的 CPU 時間
+- 每條連線壓縮器佔用的記憶體 (zlib 估算)
+
+「websockets 預設」是 `websockets.serve` 沒有指定 extensions 時的設定 (每則訊息都壓縮)。
+
+用法 (在 Server 目錄下執行)：
+	python tools/bench_compression.py [--players 8] [--wrong-guesses 6] [--numbers 10] [--repeat 20]
+		[--window-bits 9,11,15] [--mem-levels 1,4] [--min-sizes 0,128]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import override
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Frame, Opcode
+
+import compression
+from game_define import PROTOCOL_CLIENT, GUESS_WORD_STATE
+from game_rooms.base_game_room import BaseGameRoom
+from game_rooms.arrange_number_room import ArrangeNumberRoom
+from game_rooms.guess_word_room import GuessWordRoom
+from managers.user_manager_interface import IUserManager
+import message_decoder
+from user import User
+
+
+WORDS = ["長頸鹿", "珍珠奶茶", "摩天輪", "蝸牛", "電風扇", "火山", "望遠鏡", "仙人掌", "雨傘", "企鵝", "鋼琴", "颱風"]
+WRONG_GUESSES = ["動物", "食物", "會動的東西", "比人大", "在家裡", "電器", "植物", "交通工具", "需要插電", "在海邊", "圓形", "紅色"]
+
+
+class RecordingUser(User):
+	"""不連線，只記錄收到的封包。"""
+	def __init__(self, uid: int, name: str):
+		super().__init__(None, uid)
+		self.name = name
+		self.packets: list[bytes] = []
+
+	@override
+	def send(self, packet: bytes):
+		self.packets.append(packet)
+
+
+class _BenchManager(IUserManager):
+	def __init__(self):
+		self._users: dict[int, User] = {}
+
+	def get_user(self, uid: int) -> User | None:
+		return self._users.get(uid)
+
+	def add_user(self, user: User):
+		self._users[user.uid] = user
+
+	async def remove_user(self, user: User):
+		del self._users[user.uid]
+
+	def create_users(self, count: int, first_uid: int = 1) -> list[RecordingUser]:
+		users = []
+		for uid in range(first_uid, first_uid + count):
+			user = RecordingUser(uid, f"玩家{uid:03d}")
+			self.add_user(user)
+			users.append(user)
+		return users
+
+
+async def request(room: BaseGameRoom, user: User, protocol: PROTOCOL_CLIENT, payload: bytes = b""):
+	await room.process_request(user, message_decoder.decode_payload(protocol, payload))
+
+async def start_game(room: BaseGameRoom, users: list[RecordingUser]):
+	for user in users:
+		await room.add_user(user)
+		await request(room, user, PROTOCOL_CLIENT.JOIN_GAME)
+	await request(room, users[0], PROTOCOL_CLIENT.START)
+	await room.fire_timer("_on_countdown_end")
+
+async def record_guess_word(player_count: int, wrong_guesses: int) -> tuple[list[bytes], bytes]:
+	"""返回 (一個玩家整局收到的封包, 遊戲中途進房的使用者收到的 INIT)。"""
+	manager = _BenchManager()
+	room = GuessWordRoom(1, manager)
+	users = manager.create_users(player_count)
+	await start_game(room, users)
+	for i, user in enumerate(users):
+		await request(room, user, PROTOCOL_CLIENT.QUESTION, b"\x01" + WORDS[i % len(WORDS)].encode("utf8"))
+
+	guessed = {user.uid: 0 for user in users}
+	late_init = b""
+	while room.is_playing():
+		uid = room._player_order[room._current_guessing_idx]
+		user = manager.get_user(uid)
+		if guessed[uid] < wrong_guesses:
+			guess = WRONG_GUESSES[(uid + guessed[uid]) % len(WRONG_GUESSES)]
+		else:
+			guess = room._players[uid].question
+		guessed[uid] += 1
+		await request(room, user, PROTOCOL_CLIENT.GUESS, guess.encode("utf8"))
+		if room.get_game_state() == GUESS_WORD_STATE.VOTING:
+			for voter in users:
+				await request(room, voter, PROTOCOL_CLIENT.VOTE, bytes((2,)))
+
+		if not late_init and min(guessed.values()) >= wrong_guesses:
+			spectator = manager.create_users(1, player_count + 1)[0]
+			await room.add_user(spectator)
+			late_init = spectator.packets[0]
+	return users[0].packets, late_init
+
+async def record_arrange_number(player_count: int, numbers: int) -> tuple[list[bytes], bytes]:
+	"""返回 (一個玩家整局收到的封包, 遊戲中途進房的使用者收到的 INIT)。"""
+	manager = _BenchManager()
+	room = ArrangeNumberRoom(1, manager)
+	users = manager.create_users(player_count)
+	await room.add_user(users[0])
+	await request(room, users[0], PROTOCOL_CLIENT.JOIN_GAME)
+	await request(room, users[0], PROTOCOL_CLIENT.SET_MAX_NUMBER, (player_count * numbers * 2).to_bytes(2, "little"))
+	await request(room, users[0], PROTOCOL_CLIENT.SET_NUMBER_PER_PLAYER, bytes((numbers,)))
+	await start_game(room, users)
+
+	posed = 0
+	late_init = b""
+	while room.is_playing():
+		# 每次由手上最小數字的玩家出牌，最後一張故意出錯讓遊戲以公開所有數字結束
+		holders = [player for player in room._players.values() if player.numbers]
+		player = min(holders, key=lambda player: player.numbers[-1])
+		if len(holders) > 1 and sum(len(player.numbers) for player in holders) <= 2:
+			player = max(holders, key=lambda player: player.numbers[-1])
+		await request(room, player.user, PROTOCOL_CLIENT.POSE_NUMBER)
+		posed += 1
+		if posed % 3 == 0:
+			await request(room, player.user, PROTOCOL_CLIENT.SET_URGENT, bytes((posed % 2,)))
+
+		if not late_init and posed >= player_count * numbers // 2:
+			spectator = manager.create_users(1, player_count + 1)[0]
+			await room.add_user(spectator)
+			late_init = spectator.packets[0]
+	return users[0].packets, late_init
+
+
+def frame_size(payload_size: int) -> int:
+	"""伺服器送出的 websocket frame 大小 (伺服器端不加 mask)。"""
+	if payload_size < 126:
+		return payload_size + 2
+	if payload_size < 65536:
+		return payload_size + 4
+	return payload_size + 10
+
+def memory_estimate(window_bits: int, mem_level: int) -> int:
+	"""zlib 壓縮器與客戶端訊息解壓縮器的記憶體用量。"""
+	return (1 << (window_bits + 2)) + (1 << (mem_level + 9)) + (1 << window_bits)
+
+def measure(packets: list[bytes], create_extension, repeat: int) -> tuple[int, int, float]:
+	"""模擬一條連線依序送出 packets，返回 (送出的位元組數, 壓縮的訊息數, 每則訊息平均 CPU 秒數)。"""
+	frames = [Frame(Opcode.BINARY, packet) for packet in packets]
+	wire = 0
+	compressed = 0
+	seconds = 0.0
+	for i in range(repeat):
+		extension = create_extension()
+		started = time.process_time()
+		encoded = [extension.encode(frame) if extension else frame for frame in frames]
+		seconds += time.process_time() - started
+		if i == 0:
+			wire = sum(frame_size(len(frame.data)) for frame in encoded)
+			compressed = sum(1 for frame in encoded if frame.rsv1)
+	return wire, compressed, seconds / repeat / len(frames)
+
+def create_configs(args) -> list[tuple[str, int, object]]:
+	"""返回 (名稱, 每條連線的記憶體, 建立 extension 的函式)。"""
+	configs: list[tuple[str, int, object]] = [
+		("不壓縮", 0, lambda: None),
+		("websockets 預設 (12/5, 全部壓縮)", memory_estimate(12, 5), lambda: PerMessageDeflate(False, False, 12, 12, {"memLevel": 5})),
+	]
+	for window_bits in args.window_bits:
+		for mem_level in args.mem_levels:
+			for min_size in args.min_sizes:
+				def create(window_bits=window_bits, mem_level=mem_level, min_size=min_size):
+					return compression.SizeAwarePerMessageDeflate(
+						False, False, window_bits, window_bits, {"memLevel": mem_level, "level": args.level}, min_size=min_size
+					)
+				configs.append((f"window {window_bits:2d} mem {mem_level} min {min_size:4d}", memory_estimate(window_bits, mem_level), create))
+	return configs
+
+def report(title: str, packets: list[bytes], late_init: bytes, configs, repeat: int):
+	sizes = sorted(len(packet) for packet in packets)
+	print(f"\n{title}：{len(packets)} 則封包，共 {sum(sizes)} bytes，中位數 {sizes[len(sizes) // 2]} bytes，最大 {sizes[-1]} bytes，中途進房 INIT {len(late_init)} bytes")
+	print(f"{'設定':<36}{'送出 bytes':>12}{'節省':>8}{'壓縮則數':>10}{'µs/則':>9}{'INIT bytes':>12}{'記憶體 KiB':>12}")
+	baseline = None
+	for name, memory, create in configs:
+		wire, compressed, seconds = measure(packets, create, repeat)
+		init_wire, _, _ = measure([late_init], create, 1)
+		baseline = baseline or wire
+		print(f"{name:<36}{wire:>12}{1 - wire / baseline:>8.1%}{compressed:>10}{seconds * 1e6:>9.2f}{init_wire:>12}{memory / 1024:>12.1f}")
+
+def parse_ints(text: str) -> list[int]:
+	return [int(value) for value in text.split(",")]
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--players", type=int, default=8, help="每個房間的玩家數量")
+	parser.add_argument("--wrong-guesses", type=int, default=6, help="猜名詞每個玩家猜中前先猜錯的次數")
+	parser.add_argument("--numbers", type=int, default=10, help="數字排列每個玩家的數字數量")
+	parser.add_argument("--repeat", type=int, default=20, help="重複壓縮的次數 (計算平均 CPU 時間)")
+	parser.add_argument("--window-bits", type=parse_ints, default=[9, 11, 15])
+	parser.add_argument("--mem-levels", type=parse_ints, default=[1, 4])
+	parser.add_argument("--min-sizes", type=parse_ints, default=[0, 128])
+	parser.add_argument("--level", type=int, default=compression.COMPRESSION_LEVEL, help="zlib 壓縮等級")
+	args = parser.parse_args()
+
+	guess_word = asyncio.run(record_guess_word(args.players, args.wrong_guesses))
+	arrange_number = asyncio.run(record_arrange_number(args.players, args.numbers))
+	configs = create_configs(args)
+	report("猜名詞", *guess_word, configs, args.repeat)
+	report("數字排列", *arrange_number, configs, args.repeat)
+
+if __name__ == "__main__":
+	main()
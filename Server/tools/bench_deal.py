@@ -0,0 +1,88 @@
+"""發牌效能比較。
+
+比較舊版「建立整副牌再 swap-pop」的發牌方式與 `number_dealer.deal` 在各種設定下
+每次發牌的耗時與記憶體用量峰值 (tracemalloc)，並檢查發出的牌沒有超過每個數字的張數、
+同樣的種子會發出同樣的牌。
+
+用法 (在 Server 目錄下執行)：
+	python tools/bench_deal.py [--players 8] [--per-player 20] [--iterations 200]
+"""
+import argparse
+import collections
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_rooms import number_dealer
+
+
+def legacy_deal(rng: random.Random, max_number: int, group_count: int, hand_count: int, hand_size: int) -> list[list[int]] | None:
+	"""舊版 `ArrangeNumberRoom._on_start_game_process` 的發牌方式。"""
+	if group_count * max_number < hand_count * hand_size:
+		return None
+	
+	numbers = list(range(1, max_number + 1)) * group_count
+	hands = []
+	for _ in range(hand_count):
+		hand = []
+		for _ in range(hand_size):
+			index = rng.randint(0, len(numbers) - 1)
+			numbers[index], numbers[-1] = numbers[-1], numbers[index]
+			hand.append(numbers.pop())
+		hands.append(hand)
+	return hands
+
+def check_deal(max_number: int, group_count: int, hand_count: int, hand_size: int):
+	seed = random.getrandbits(64)
+	hands = number_dealer.deal(random.Random(seed), max_number, group_count, hand_count, hand_size)
+	if hands != number_dealer.deal(random.Random(seed), max_number, group_count, hand_count, hand_size):
+		raise RuntimeError("同樣的種子發出了不同的牌")
+	if len(hands) != hand_count or any(len(hand) != hand_size for hand in hands):
+		raise RuntimeError("發牌數量錯誤")
+	
+	counts = collections.Counter(number for hand in hands for number in hand)
+	if any(number < 1 or number > max_number or count > group_count for number, count in counts.items()):
+		raise RuntimeError("發出的牌超出牌組範圍")
+
+def measure(deal, iterations: int, *settings) -> tuple[float, int]:
+	"""返回 (每次發牌的微秒數, 記憶體用量峰值 bytes)。"""
+	rng = random.Random(0)
+	tracemalloc.start()
+	deal(rng, *settings)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	
+	start = time.perf_counter()
+	for _ in range(iterations):
+		deal(rng, *settings)
+	elapsed = time.perf_counter() - start
+	return elapsed / iterations * 1e6, peak
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--players", type=int, default=8, help="玩家數量")
+	parser.add_argument("--per-player", type=int, default=20, help="每個玩家的數字數量 (最多 20)")
+	parser.add_argument("--iterations", type=int, default=200)
+	args = parser.parse_args()
+
+	print(f"{'max_number':>10}{'groups':>8}{'legacy us':>12}{'dealer us':>12}{'speedup':>10}{'legacy peak':>14}{'dealer peak':>14}")
+	for max_number in (10, 100, 1000):
+		for group_count in (1, 10, 50):
+			settings = (max_number, group_count, args.players, args.per_player)
+			if max_number * group_count < args.players * args.per_player:
+				continue
+			
+			check_deal(*settings)
+			legacy_time, legacy_peak = measure(legacy_deal, args.iterations, *settings)
+			dealer_time, dealer_peak = measure(number_dealer.deal, args.iterations, *settings)
+			print(
+				f"{max_number:>10}{group_count:>8}{legacy_time:>12.1f}{dealer_time:>12.1f}{legacy_time / dealer_time:>9.2f}x"
+				f"{legacy_peak / 1024:>11.1f} KiB{dealer_peak / 1024:>10.1f} KiB"
+			)
+
+if __name__ == "__main__":
+	main()
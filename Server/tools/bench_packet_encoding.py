@@ -0,0 +1,232 @@
+"""封包編碼效能比較。
+
+比較舊版 `bytes() += ...` 串接的編碼方式與 `packet_builder` 的編碼速度 (bytes/s)，
+並確認兩者產生的封包內容完全相同。
+
+用法 (在 Server 目錄下執行)：
+	python tools/bench_packet_encoding.py [--users 30] [--history 40] [--iterations 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_define import PROTOCOL_SERVER, GAME_TYPE, GUESS_WORD_STATE, ARRANGE_NUMBER_STATE
+from game_rooms.guess_word_room import GuessWordRoom, Player as GuessWordPlayer
+from game_rooms.arrange_number_room import ArrangeNumberRoom, Player as ArrangeNumberPlayer
+from managers.user_manager_interface import IUserManager
+import packet_builder
+from user import User
+
+
+# 舊版編碼 ===========================================================================
+
+def legacy_new_packet(protocol: PROTOCOL_SERVER, data: bytes) -> bytes:
+	packet = bytes()
+	packet += protocol.to_bytes(1, byteorder="little")
+	packet += data
+	return packet
+
+def legacy_user_to_bytes(user: User) -> bytes:
+	data = bytes()
+	data += user.uid.to_bytes(2, byteorder="little")
+	encoded_name = user.name.encode("utf8")
+	data += len(encoded_name).to_bytes(1, byteorder="little")
+	data += encoded_name
+	return data
+
+def legacy_guess_word_player_to_bytes(player: GuessWordPlayer) -> bytes:
+	data = bytes()
+	data += player.user.uid.to_bytes(2, byteorder="little")
+	encoded_question = player.question.encode("utf8")
+	data += len(encoded_question).to_bytes(1, byteorder="little")
+	data += encoded_question
+	data += len(player.guess_history).to_bytes(1, byteorder="little")
+	for guess in player.guess_history:
+		encoded_guess = guess[0].encode("utf8")
+		data += len(encoded_guess).to_bytes(1, byteorder="little")
+		data += encoded_guess
+		data += guess[1].to_bytes(1, byteorder="little")
+	data += player.success_round.to_bytes(2, signed=True, byteorder="little")
+	return data
+
+def legacy_arrange_number_player_to_bytes(player: ArrangeNumberPlayer) -> bytes:
+	data = bytes()
+	data += player.user.uid.to_bytes(2, byteorder="little")
+	data += len(player.numbers).to_bytes(1, byteorder="little")
+	for number in player.numbers:
+		data += number.to_bytes(2, byteorder="little")
+	data += player.is_urgent.to_bytes(1, byteorder="little")
+	return data
+
+def legacy_guess_word_init(room: GuessWordRoom, manager: IUserManager) -> bytes:
+	data = bytes()
+	data += GAME_TYPE.GUESS_WORD.to_bytes(1, byteorder="little")
+	data += len(room._user_ids).to_bytes(1, byteorder="little")
+	for user_id in room._user_ids:
+		data += legacy_user_to_bytes(manager.get_user(user_id))
+	data += len(room._players).to_bytes(1, byteorder="little")
+	for player in room._players.values():
+		data += legacy_guess_word_player_to_bytes(player)
+	data += room._game_state.to_bytes(1, byteorder="little")
+	data += len(room._player_order).to_bytes(1, byteorder="little")
+	for player_uid in room._player_order:
+		data += player_uid.to_bytes(2, byteorder="little")
+	data += room._current_guessing_idx.to_bytes(1, byteorder="little")
+	encoded_guess = room.temp_guess.encode("utf8")
+	data += len(encoded_guess).to_bytes(1, byteorder="little")
+	data += encoded_guess
+	data += len(room._votes).to_bytes(1, byteorder="little")
+	for vote_uid, vote in room._votes.items():
+		data += vote_uid.to_bytes(2, byteorder="little")
+		data += vote.to_bytes(1, byteorder="little")
+	return legacy_new_packet(PROTOCOL_SERVER.INIT, data)
+
+def legacy_all_player_numbers(room: ArrangeNumberRoom) -> bytes:
+	data = bytes()
+	data += (1).to_bytes(1, byteorder="little")
+	data += len(room._players).to_bytes(1, byteorder="little")
+	for player in room._players.values():
+		data += player.user.uid.to_bytes(2, byteorder="little")
+		data += len(player.numbers).to_bytes(1, byteorder="little")
+		for number in player.numbers:
+			data += number.to_bytes(2, byteorder="little")
+	return legacy_new_packet(PROTOCOL_SERVER.PLAYER_NUMBERS, data)
+
+def legacy_chat(uid: int, encoded_message: bytes) -> bytes:
+	data = bytes()
+	data += uid.to_bytes(2, byteorder="little")
+	data += len(encoded_message).to_bytes(1, byteorder="little")
+	data += encoded_message
+	data += (0).to_bytes(1, byteorder="little")
+	return legacy_new_packet(PROTOCOL_SERVER.CHAT, data)
+
+def legacy_vote(uid: int, vote: int) -> bytes:
+	data = bytes()
+	data += uid.to_bytes(2, byteorder="little")
+	data += vote.to_bytes(1, byteorder="little")
+	return legacy_new_packet(PROTOCOL_SERVER.VOTE, data)
+
+
+# 測試資料 ===========================================================================
+
+class _BenchManager(IUserManager):
+	def __init__(self):
+		self._users: dict[int, User] = {}
+
+	def get_user(self, uid: int) -> User | None:
+		return self._users.get(uid)
+
+	def add_user(self, user: User):
+		self._users[user.uid] = user
+
+	async def remove_user(self, user: User):
+		del self._users[user.uid]
+
+def _make_users(manager: _BenchManager, count: int) -> list[User]:
+	users = []
+	for uid in range(1, count + 1):
+		user = User(None, uid)
+		user.name = f"玩家{uid:03d}"
+		manager.add_user(user)
+		users.append(user)
+	return users
+
+def build_guess_word_room(user_count: int, history_count: int) -> tuple[GuessWordRoom, _BenchManager]:
+	manager = _BenchManager()
+	room = GuessWordRoom(1, manager)
+	for user in _make_users(manager, user_count):
+		room._user_ids.add(user.uid)
+		player = GuessWordPlayer(user)
+		player.question = "長頸鹿"
+		player.guess_history = [(f"猜測{i}", i % 3) for i in range(history_count)]
+		room._players[user.uid] = player
+	room._game_state = GUESS_WORD_STATE.VOTING
+	room._player_order = list(room._players.keys())
+	room.temp_guess = "動物"
+	room._votes = {uid: uid % 3 for uid in room._player_order[1:]}
+	return room, manager
+
+def build_arrange_number_room(user_count: int, number_count: int) -> ArrangeNumberRoom:
+	manager = _BenchManager()
+	room = ArrangeNumberRoom(1, manager)
+	for user in _make_users(manager, user_count):
+		room._user_ids.add(user.uid)
+		player = ArrangeNumberPlayer(user)
+		player.numbers = list(range(number_count * 10, 0, -10))
+		room._players[user.uid] = player
+	room._game_state = ARRANGE_NUMBER_STATE.PLAYING
+	return room
+
+
+def build_init_uncached(room: GuessWordRoom) -> bytes:
+	"""清空 INIT 快取後重新建立，測量完整序列化的成本。"""
+	room._user_sections.clear()
+	room._player_sections.clear()
+	room._mark_state_dirty()
+	return room._build_init_packet()
+
+
+# 測量 ===========================================================================
+
+def measure(encode, iterations: int) -> tuple[float, int]:
+	"""重複編碼並返回 (bytes/s, 單一封包大小)。"""
+	size = len(encode())
+	start = time.perf_counter()
+	for _ in range(iterations):
+		encode()
+	elapsed = time.perf_counter() - start
+	return size * iterations / elapsed, size
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--users", type=int, default=30, help="房間內的使用者數量 (最多 255)")
+	parser.add_argument("--history", type=int, default=40, help="每個玩家的猜測紀錄數量 (最多 255)")
+	parser.add_argument("--numbers", type=int, default=20, help="每個玩家手上的數字數量")
+	parser.add_argument("--iterations", type=int, default=2000)
+	args = parser.parse_args()
+
+	guess_word_room, guess_word_manager = build_guess_word_room(args.users, args.history)
+	arrange_number_room = build_arrange_number_room(args.users, args.numbers)
+	message = "這是一段聊天訊息".encode("utf8")
+
+	cases = [
+		(
+			"GuessWord INIT",
+			lambda: legacy_guess_word_init(guess_word_room, guess_word_manager),
+			lambda: build_init_uncached(guess_word_room),
+		),
+		(
+			"GuessWord INIT (cached)",
+			lambda: legacy_guess_word_init(guess_word_room, guess_word_manager),
+			guess_word_room._build_init_packet,
+		),
+		(
+			"ArrangeNumber PLAYER_NUMBERS",
+			lambda: legacy_all_player_numbers(arrange_number_room),
+			arrange_number_room._build_all_player_numbers_packet,
+		),
+		(
+			"CHAT",
+			lambda: legacy_chat(1, message),
+			lambda: packet_builder.begin(PROTOCOL_SERVER.CHAT).write_uint16(1).write_string(message).write_bool(False).finish(),
+		),
+		(
+			"VOTE",
+			lambda: legacy_vote(1, 2),
+			lambda: packet_builder.pack(PROTOCOL_SERVER.VOTE, 1, 2),
+		),
+	]
+
+	print(f"{'packet':<30}{'size':>8}{'legacy MB/s':>14}{'builder MB/s':>14}{'speedup':>10}")
+	for name, legacy_encode, builder_encode in cases:
+		if legacy_encode() != builder_encode():
+			raise RuntimeError(f"{name}: 編碼結果與舊版不一致")
+		legacy_rate, size = measure(legacy_encode, args.iterations)
+		builder_rate, _ = measure(builder_encode, args.iterations)
+		print(f"{name:<30}{size:>8}{legacy_rate / 1e6:>14.2f}{builder_rate / 1e6:>14.2f}{builder_rate / legacy_rate:>9.2f}x")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,59 @@
+"""房間編號分配效能與記憶體檢查。
+
+以 `MAX_ROOM_COUNT` 的上限反覆隨機分配與釋放房間編號，量測每次操作的耗時，
+並檢查分配出的編號不重複、屬於指定的餘數類別，且分配器內部記錄的數量始終不超過使用中編號數量的兩倍。
+
+用法 (在 Server 目錄下執行)：
+	python tools/bench_room_ids.py [--capacity 100] [--operations 200000] [--workers 1]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import id_generator
+
+
+def churn(allocator, rng: random.Random, operations: int, step: int, offset: int) -> int:
+	"""隨機分配與釋放 `operations` 次，返回分配器內部記錄數量的峰值。"""
+	live: list[int] = []
+	live_set: set[int] = set()
+	peak = 0
+	for _ in range(operations):
+		if live and (rng.random() < 0.5 or allocator.remaining() <= 0):
+			index = rng.randrange(len(live))
+			live[index], live[-1] = live[-1], live[index]
+			id = live.pop()
+			live_set.discard(id)
+			allocator.release(id)
+		else:
+			id = allocator.generate()
+			if id < 0 or id in live_set or id % step != offset % step:
+				raise RuntimeError(f"分配出錯誤的編號 {id}")
+			live.append(id)
+			live_set.add(id)
+
+		entries = max(len(allocator._slot_at), len(allocator._position_of))
+		if entries > 2 * len(live):
+			raise RuntimeError(f"內部記錄 {entries} 筆超過使用中編號數量 {len(live)} 的兩倍")
+		peak = max(peak, entries)
+	return peak
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--capacity", type=int, default=id_generator.MAX_ROOM_COUNT, help="同時存在的房間數量上限")
+	parser.add_argument("--operations", type=int, default=200000, help="分配與釋放的總次數")
+	parser.add_argument("--workers", type=int, default=1, help="多行程模式的 worker 數量，只檢查第一個 worker 的編號空間")
+	args = parser.parse_args()
+
+	allocator = id_generator._RandomIDAllocator(id_generator._MAX_ROOM_ID, capacity=args.capacity, step=args.workers)
+	start = time.perf_counter()
+	peak = churn(allocator, random.Random(0), args.operations, args.workers, 0)
+	elapsed = time.perf_counter() - start
+	print(f"capacity={args.capacity} operations={args.operations}: {elapsed / args.operations * 1e6:.2f} us/op，內部記錄峰值 {peak} 筆")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,557 @@
+"""端對端 websocket 壓力測試。
+
+在本機開啟大量模擬客戶端，依照真正的協定流程 (VERSION、NAME、CREATE_ROOM/JOIN_ROOM)
+進入房間並重複進行完整的猜名詞 (QUESTION/GUESS/VOTE) 與數字排列 (POSE_NUMBER/SET_URGENT) 遊戲，
+最後輸出吞吐量、各協定的延遲百分位數、連線建立時間與伺服器記憶體用量。
+
+用法 (在 Server 目錄下執行)：
+	python tools/load_test.py --spawn-server --rooms 50 --players 8 --rounds 3
+	python tools/load_test.py --port 11451 --server-pid 12345 --game arrange_number
+	python tools/load_test.py --spawn-server --batch	# 啟用 BATCH 合併封包
+	python tools/load_test.py --spawn-server --rooms 2 --spectators 500 --large-room	# 大量觀眾的大型房間
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_define import PROTOCOL_CLIENT, PROTOCOL_SERVER, GAME_TYPE, GUESS_WORD_STATE, CONST
+
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+
+# 統計 ===========================================================================
+
+class Stats:
+	def __init__(self):
+		self.latencies: dict[str, list[float]] = collections.defaultdict(list)
+		self.connect_times: list[float] = []
+		self.sent_messages = 0
+		self.sent_bytes = 0
+		self.received_messages = 0
+		self.received_packets = 0
+		self.received_bytes = 0
+		self.spectator_packets = 0
+		self.completed_rounds: dict[str, int] = collections.defaultdict(int)
+		self.errors: dict[str, int] = collections.defaultdict(int)
+
+def percentile(values: list[float], ratio: float) -> float:
+	if not values:
+		return 0.0
+	index = min(len(values) - 1, int(len(values) * ratio))
+	return values[index]
+
+class RSSSampler:
+	"""定期讀取 /proc 取得伺服器 (含 worker 子行程) 的 RSS。"""
+	def __init__(self, pid: int | None):
+		self._pid = pid
+		self.samples: list[int] = []
+		self._task: asyncio.Task | None = None
+
+	@staticmethod
+	def _read_rss(pid: int) -> int:
+		try:
+			with open(f"/proc/{pid}/status") as f:
+				for line in f:
+					if line.startswith("VmRSS:"):
+						return int(line.split()[1]) * 1024
+		except OSError:
+			pass
+		return 0
+
+	@staticmethod
+	def _children(pid: int) -> list[int]:
+		try:
+			with open(f"/proc/{pid}/task/{pid}/children") as f:
+				return [int(child) for child in f.read().split()]
+		except OSError:
+			return []
+
+	def sample(self) -> int:
+		if not self._pid:
+			return 0
+		rss = self._read_rss(self._pid) + sum(self._read_rss(child) for child in self._children(self._pid))
+		self.samples.append(rss)
+		return rss
+
+	async def _run(self, interval: float):
+		while True:
+			self.sample()
+			await asyncio.sleep(interval)
+
+	def start(self, interval: float = 0.5):
+		if self._pid:
+			self._task = asyncio.create_task(self._run(interval))
+
+	def stop(self):
+		if self._task:
+			self._task.cancel()
+		self.sample()
+
+
+# 模擬客戶端 ===========================================================================
+
+class SimClient:
+	"""一個模擬的遊戲客戶端。
+
+	送出請求時記錄時間，收到對應的伺服器封包時計算延遲。
+	對應關係以 (伺服器協定, 封包內的 uid) 為鍵，避免把其他人的廣播算成自己的回應。
+	"""
+	def __init__(self, name: str, stats: Stats, batch: bool = False):
+		self.name = name
+		self.batch = batch
+		self.uid = 0
+		self.is_spectator = False
+		self.stats = stats
+		self.session: 'GameSession | None' = None
+		self._socket = None
+		self._reader: asyncio.Task | None = None
+		self._pending: dict[tuple, collections.deque] = collections.defaultdict(collections.deque)
+		self._waiters: dict[int, list[asyncio.Future]] = collections.defaultdict(list)
+
+	async def connect(self, uri: str):
+		start = time.perf_counter()
+		self._socket = await websockets.connect(uri, max_queue=None, compression=None)
+		uid_packet = await self._socket.recv()
+		self.stats.connect_times.append(time.perf_counter() - start)
+		self.uid = struct.unpack_from("<H", uid_packet, 1)[0]
+		self._reader = asyncio.create_task(self._read_loop())
+
+		version_ready = self.wait_for(PROTOCOL_SERVER.VERSION)
+		await self.send(PROTOCOL_CLIENT.VERSION, struct.pack("<I", CONST.GAME_VERSION), PROTOCOL_SERVER.VERSION)
+		await version_ready
+		await self.send(PROTOCOL_CLIENT.NAME, self.name.encode("utf8"))
+		if self.batch:
+			await self.send(PROTOCOL_CLIENT.BATCH, bytes([1]))
+
+	async def close(self):
+		if self._socket:
+			await self._socket.close()
+		if self._reader:
+			await asyncio.gather(self._reader, return_exceptions=True)
+
+	async def send(self, protocol: PROTOCOL_CLIENT, payload: bytes = b"", expect: PROTOCOL_SERVER | None = None, key: int | None = None):
+		"""送出請求，`expect` 為用來計算延遲的伺服器封包。"""
+		if expect is not None:
+			self._pending[(expect, key)].append((protocol.name, time.perf_counter()))
+		message = bytes([protocol]) + payload
+		self.stats.sent_messages += 1
+		self.stats.sent_bytes += len(message)
+		try:
+			await self._socket.send(message)
+		except websockets.exceptions.ConnectionClosed:
+			self.stats.errors["send on closed connection"] += 1
+
+	async def fetch_users(self) -> int:
+		"""用 FETCH_USERS 逐頁取得大型房間的使用者列表，返回取得的使用者數量。"""
+		after_uid = 0
+		total = 0
+		while True:
+			page = self.wait_for(PROTOCOL_SERVER.USER_LIST)
+			await self.send(PROTOCOL_CLIENT.FETCH_USERS, struct.pack("<H", after_uid), PROTOCOL_SERVER.USER_LIST)
+			data = await page
+			count = struct.unpack_from("<H", data, 2)[0]
+			offset = 4
+			for _ in range(count):
+				offset += 2
+				offset += 1 + data[offset]
+			total += count
+			after_uid = struct.unpack_from("<H", data, offset)[0]
+			if after_uid == 0:
+				return total
+
+	def wait_for(self, protocol: PROTOCOL_SERVER) -> asyncio.Future:
+		"""等待下一個指定協定的封包，返回封包內容 (不含協定)。"""
+		future = asyncio.get_running_loop().create_future()
+		self._waiters[protocol].append(future)
+		return future
+
+	@staticmethod
+	def _response_key(protocol: int, data: bytes) -> int | None:
+		match protocol:
+			case (PROTOCOL_SERVER.JOIN_GAME | PROTOCOL_SERVER.QUESTION | PROTOCOL_SERVER.SUCCESS | PROTOCOL_SERVER.VOTE
+					| PROTOCOL_SERVER.CHAT | PROTOCOL_SERVER.POSE_NUMBER | PROTOCOL_SERVER.URGENT_PLAYER):
+				return struct.unpack_from("<H", data)[0]
+		return None
+
+	async def _read_loop(self):
+		try:
+			async for message in self._socket:
+				now = time.perf_counter()
+				self.stats.received_messages += 1
+				self.stats.received_bytes += len(message)
+
+				if message[0] == PROTOCOL_SERVER.BATCH:
+					offset = 1
+					while offset < len(message):
+						length = struct.unpack_from("<H", message, offset)[0]
+						offset += 2
+						await self._handle_packet(message[offset:offset + length], now)
+						offset += length
+				else:
+					await self._handle_packet(message, now)
+		except websockets.exceptions.ConnectionClosed:
+			pass
+		except Exception as e:
+			self.stats.errors[f"client error: {e!r}"] += 1
+
+	async def _handle_packet(self, message: bytes, now: float):
+		self.stats.received_packets += 1
+		if self.is_spectator:
+			self.stats.spectator_packets += 1
+		protocol, data = message[0], message[1:]
+		pending = self._pending.get((protocol, self._response_key(protocol, data)))
+		if pending:
+			name, sent_at = pending.popleft()
+			self.stats.latencies[name].append(now - sent_at)
+
+		waiters = self._waiters.get(protocol)
+		if waiters:
+			for future in waiters:
+				if not future.done():
+					future.set_result(data)
+			waiters.clear()
+
+		if self.session:
+			await self.session.on_packet(self, protocol, data)
+
+
+# 遊戲流程 ===========================================================================
+
+class GameSession:
+	"""驅動一個房間內所有模擬客戶端進行指定局數的遊戲。"""
+	GAME_TYPE: GAME_TYPE
+
+	def __init__(
+		self, clients: list[SimClient], rounds: int, stats: Stats, chat_interval: float,
+		spectators: list[SimClient] = [], large: bool = False,
+	):
+		self.clients = clients
+		self.spectators = spectators
+		self.large = large
+		self.host = clients[0]
+		self.rounds = rounds
+		self.stats = stats
+		self.chat_interval = chat_interval
+		self.room_id = -1
+		self.joined_players: set[int] = set()
+		self.all_joined = asyncio.Event()
+		self.round_done = asyncio.Event()
+		for client in clients:
+			client.session = self
+		for client in spectators:
+			client.is_spectator = True
+
+	async def _join(self, client: SimClient) -> bool:
+		joined = client.wait_for(PROTOCOL_SERVER.ROOM_ID)
+		await client.send(PROTOCOL_CLIENT.JOIN_ROOM, struct.pack("<I", self.room_id), PROTOCOL_SERVER.ROOM_ID)
+		if struct.unpack("<i", await joined)[0] < 0:
+			self.stats.errors["JOIN_ROOM refused"] += 1
+			return False
+		return True
+
+	async def _join_spectator(self, client: SimClient):
+		"""觀眾只進入房間不加入遊戲，大型房間另外取得完整的使用者列表。"""
+		if await self._join(client) and self.large:
+			await client.fetch_users()
+
+	async def setup(self) -> bool:
+		room_id_ready = self.host.wait_for(PROTOCOL_SERVER.ROOM_ID)
+		create = PROTOCOL_CLIENT.CREATE_LARGE_ROOM if self.large else PROTOCOL_CLIENT.CREATE_ROOM
+		await self.host.send(create, bytes([self.GAME_TYPE]), PROTOCOL_SERVER.ROOM_ID)
+		self.room_id = struct.unpack("<i", await room_id_ready)[0]
+		if self.room_id < 0:
+			self.stats.errors["CREATE_ROOM refused"] += 1
+			return False
+
+		for client in self.clients[1:]:
+			if not await self._join(client):
+				return False
+		await asyncio.gather(*(self._join_spectator(client) for client in self.spectators))
+
+		for client in self.clients:
+			await client.send(PROTOCOL_CLIENT.JOIN_GAME, expect=PROTOCOL_SERVER.JOIN_GAME, key=client.uid)
+		# 所有人都加入遊戲後才能調整設定與開始
+		await self.all_joined.wait()
+		return True
+
+	async def configure(self):
+		"""每局開始前調整遊戲設定。"""
+
+	async def run(self):
+		if not await self.setup():
+			return
+
+		chat_task = asyncio.create_task(self._chat_loop()) if self.chat_interval > 0 else None
+		for _ in range(self.rounds):
+			self.round_done.clear()
+			await self.configure()
+			await self.host.send(PROTOCOL_CLIENT.START, expect=PROTOCOL_SERVER.START_COUNTDOWN)
+			await self.round_done.wait()
+			self.stats.completed_rounds[self.GAME_TYPE.name] += 1
+		if chat_task:
+			chat_task.cancel()
+
+	async def _chat_loop(self):
+		while True:
+			await asyncio.sleep(self.chat_interval * random.uniform(0.5, 1.5))
+			client = random.choice(self.clients)
+			await client.send(PROTOCOL_CLIENT.CHAT, struct.pack("<H", 0) + "壓力測試".encode("utf8"), PROTOCOL_SERVER.CHAT, client.uid)
+
+	async def on_packet(self, client: SimClient, protocol: int, data: bytes):
+		if client is not self.host:
+			return
+		match protocol:
+			case PROTOCOL_SERVER.JOIN_GAME:
+				self.joined_players.add(struct.unpack_from("<H", data)[0])
+				if len(self.joined_players) == len(self.clients):
+					self.all_joined.set()
+			case PROTOCOL_SERVER.END:
+				self.round_done.set()
+
+
+class GuessWordSession(GameSession):
+	"""猜名詞：每個玩家先猜錯 `wrong_guesses` 次 (其他人投票)，再猜出正確答案。"""
+	GAME_TYPE = GAME_TYPE.GUESS_WORD
+
+	def __init__(self, *args, wrong_guesses: int = 2, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.wrong_guesses = wrong_guesses
+		self.questions: dict[int, str] = {}
+		self.guess_counts: dict[int, int] = collections.defaultdict(int)
+		# 每個客戶端各自看到的順序與目前猜題者
+		self.orders: dict[int, list[int]] = {}
+		self.guessing_index: dict[int, int] = {}
+
+	async def configure(self):
+		self.questions.clear()
+		self.guess_counts.clear()
+
+	async def on_packet(self, client: SimClient, protocol: int, data: bytes):
+		await super().on_packet(client, protocol, data)
+		match protocol:
+			case PROTOCOL_SERVER.PLAYER_ORDER:
+				# 大型房間的索引與數量為 uint16
+				layout = "<HBH" if self.large else "<BBB"
+				if data[1 + self.large] == 1:
+					index, _, count = struct.unpack_from(layout, data)
+					self.orders[client.uid] = list(struct.unpack_from(f"<{count}H", data, struct.calcsize(layout)))
+				else:
+					index = struct.unpack_from(layout[:2], data)[0]
+				self.guessing_index[client.uid] = index
+			case PROTOCOL_SERVER.START:
+				# 出題給順序中的下一位玩家
+				order = self.orders[client.uid]
+				target = order[(order.index(client.uid) + 1) % len(order)]
+				word = f"題目{target}"
+				self.questions[target] = word
+				await client.send(
+					PROTOCOL_CLIENT.QUESTION, bytes([1]) + word.encode("utf8"), PROTOCOL_SERVER.QUESTION, target
+				)
+			case PROTOCOL_SERVER.GAMESTATE:
+				if data[0] != GUESS_WORD_STATE.GUESSING:
+					return
+				order = self.orders[client.uid]
+				if order[self.guessing_index[client.uid]] != client.uid:
+					return
+
+				self.guess_counts[client.uid] += 1
+				if self.guess_counts[client.uid] <= self.wrong_guesses:
+					guess = f"猜錯{self.guess_counts[client.uid]}"
+					await client.send(PROTOCOL_CLIENT.GUESS, guess.encode("utf8"), PROTOCOL_SERVER.GUESS)
+				else:
+					guess = self.questions[client.uid]
+					await client.send(PROTOCOL_CLIENT.GUESS, guess.encode("utf8"), PROTOCOL_SERVER.SUCCESS, client.uid)
+			case PROTOCOL_SERVER.GUESS:
+				order = self.orders[client.uid]
+				if order[self.guessing_index[client.uid]] == client.uid:
+					return
+				await client.send(PROTOCOL_CLIENT.VOTE, bytes([random.choice((1, 2))]), PROTOCOL_SERVER.VOTE, client.uid)
+
+
+class ArrangeNumberSession(GameSession):
+	"""數字排列：由手上數字最小的玩家出牌，偶爾先表示自己很急。"""
+	GAME_TYPE = GAME_TYPE.ARRANGE_NUMBER
+
+	def __init__(self, *args, number_per_player: int = 5, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.number_per_player = number_per_player
+		self.configured = False
+		self.hands: dict[int, list[int]] = {}
+		self.clients_by_uid = { client.uid: client for client in self.clients }
+
+	async def configure(self):
+		self.hands.clear()
+		if self.configured:
+			return
+		self.configured = True
+		await self.host.send(PROTOCOL_CLIENT.SET_MAX_NUMBER, struct.pack("<H", 1000), PROTOCOL_SERVER.SETTINGS)
+		await self.host.send(PROTOCOL_CLIENT.SET_NUMBER_PER_PLAYER, bytes([self.number_per_player]), PROTOCOL_SERVER.SETTINGS)
+
+	async def _pose_next(self):
+		"""讓手上數字最小的玩家出牌。"""
+		holders = [(hand[0], uid) for uid, hand in self.hands.items() if hand]
+		if not holders:
+			return
+		_, uid = min(holders)
+		self.hands[uid].pop(0)
+		client = self.clients_by_uid[uid]
+		if random.random() < 0.3:
+			await client.send(PROTOCOL_CLIENT.SET_URGENT, bytes([1]), PROTOCOL_SERVER.URGENT_PLAYER, uid)
+		await client.send(PROTOCOL_CLIENT.POSE_NUMBER, expect=PROTOCOL_SERVER.POSE_NUMBER, key=uid)
+
+	async def on_packet(self, client: SimClient, protocol: int, data: bytes):
+		await super().on_packet(client, protocol, data)
+		match protocol:
+			case PROTOCOL_SERVER.PLAYER_NUMBERS:
+				if data[0] == 0:
+					count = data[1]
+					self.hands[client.uid] = sorted(struct.unpack_from(f"<{count}H", data, 2))
+			case PROTOCOL_SERVER.START | PROTOCOL_SERVER.POSE_NUMBER:
+				if client is self.host:
+					await self._pose_next()
+
+
+# 主程式 ===========================================================================
+
+async def wait_for_port(host: str, port: int, timeout: float = 10):
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		try:
+			_, writer = await asyncio.open_connection(host, port)
+			writer.close()
+			return
+		except OSError:
+			await asyncio.sleep(0.1)
+	raise RuntimeError(f"伺服器沒有在 {host}:{port} 上監聽")
+
+def spawn_server(port: int, extra_config: dict) -> tuple[subprocess.Popen, tempfile.TemporaryDirectory]:
+	"""在暫存目錄中以指定設定啟動 main.py。"""
+	workdir = tempfile.TemporaryDirectory()
+	with open(os.path.join(workdir.name, "config.json"), "w") as f:
+		json.dump({ "HOST": "127.0.0.1", "PORT": port } | extra_config, f)
+	process = subprocess.Popen(
+		[sys.executable, SERVER_SCRIPT], cwd=workdir.name, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT
+	)
+	return process, workdir
+
+def raise_file_limit():
+	soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+	if soft < hard:
+		resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def report(stats: Stats, elapsed: float, rss: RSSSampler):
+	print(f"\n耗時 {elapsed:.2f} 秒，完成局數：{dict(stats.completed_rounds)}")
+	print(f"送出 {stats.sent_messages} 則 ({stats.sent_messages / elapsed:.0f} msg/s, {stats.sent_bytes / elapsed / 1024:.1f} KiB/s)")
+	print(f"收到 {stats.received_messages} 則 ({stats.received_messages / elapsed:.0f} msg/s, {stats.received_bytes / elapsed / 1024:.1f} KiB/s)，共 {stats.received_packets} 個封包")
+	if stats.spectator_packets:
+		print(f"其中觀眾收到 {stats.spectator_packets} 個封包")
+
+	connect_times = sorted(stats.connect_times)
+	print(
+		f"連線建立 {len(connect_times)} 次："
+		f"p50 {percentile(connect_times, 0.5) * 1000:.2f} ms, "
+		f"p99 {percentile(connect_times, 0.99) * 1000:.2f} ms, "
+		f"max {(connect_times[-1] if connect_times else 0) * 1000:.2f} ms"
+	)
+
+	print(f"\n{'protocol':<24}{'count':>9}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}{'max ms':>10}")
+	for name, values in sorted(stats.latencies.items()):
+		values.sort()
+		print(
+			f"{name:<24}{len(values):>9}"
+			f"{percentile(values, 0.5) * 1000:>10.2f}{percentile(values, 0.99) * 1000:>10.2f}"
+			f"{percentile(values, 0.999) * 1000:>10.2f}{values[-1] * 1000:>10.2f}"
+		)
+
+	if rss.samples:
+		print(f"\n伺服器 RSS：開始 {rss.samples[0] / 2**20:.1f} MiB，最高 {max(rss.samples) / 2**20:.1f} MiB，結束 {rss.samples[-1] / 2**20:.1f} MiB")
+	if stats.errors:
+		print(f"\n錯誤：{dict(stats.errors)}")
+
+async def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=11451)
+	parser.add_argument("--spawn-server", action="store_true", help="自動在本機啟動一個伺服器")
+	parser.add_argument("--server-config", default="{}", help="--spawn-server 時額外寫入 config.json 的 JSON 設定")
+	parser.add_argument("--server-pid", type=int, help="要測量 RSS 的伺服器行程 (未使用 --spawn-server 時)")
+	parser.add_argument("--game", choices=("guess_word", "arrange_number", "both"), default="both")
+	parser.add_argument("--rooms", type=int, default=20, help="房間數量")
+	parser.add_argument("--players", type=int, default=6, help="每個房間的玩家數量")
+	parser.add_argument("--rounds", type=int, default=2, help="每個房間進行的局數")
+	parser.add_argument("--spectators", type=int, default=0, help="每個房間只進入房間、不加入遊戲的觀眾數量")
+	parser.add_argument("--large-room", action="store_true", help="以 CREATE_LARGE_ROOM 建立大型房間")
+	parser.add_argument("--wrong-guesses", type=int, default=2, help="猜名詞每個玩家猜中前先猜錯的次數")
+	parser.add_argument("--numbers", type=int, default=5, help="數字排列每個玩家的數字數量")
+	parser.add_argument("--chat-interval", type=float, default=0, help="每個房間平均多久送出一則聊天訊息 (秒)，0 表示不聊天")
+	parser.add_argument("--batch", action="store_true", help="要求伺服器以 BATCH 封包合併同一個 tick 的輸出")
+	parser.add_argument("--connect-concurrency", type=int, default=200, help="同時進行的連線建立數量")
+	args = parser.parse_args()
+
+	raise_file_limit()
+	server_process = None
+	if args.spawn_server:
+		server_process, workdir = spawn_server(args.port, json.loads(args.server_config))
+	try:
+		await wait_for_port(args.host, args.port)
+		rss = RSSSampler(server_process.pid if server_process else args.server_pid)
+		rss.start()
+
+		stats = Stats()
+		uri = f"ws://{args.host}:{args.port}"
+		semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+		async def connect_client(name: str) -> SimClient:
+			client = SimClient(name, stats, args.batch)
+			async with semaphore:
+				await client.connect(uri)
+			return client
+
+		start = time.perf_counter()
+		sessions: list[GameSession] = []
+		for room_index in range(args.rooms):
+			clients = await asyncio.gather(*(connect_client(f"r{room_index}p{i}") for i in range(args.players)))
+			spectators = await asyncio.gather(*(connect_client(f"r{room_index}s{i}") for i in range(args.spectators)))
+			match args.game:
+				case "guess_word":
+					use_guess_word = True
+				case "arrange_number":
+					use_guess_word = False
+				case _:
+					use_guess_word = room_index % 2 == 0
+			options = { "spectators": spectators, "large": args.large_room }
+			if use_guess_word:
+				session = GuessWordSession(clients, args.rounds, stats, args.chat_interval, wrong_guesses=args.wrong_guesses, **options)
+			else:
+				session = ArrangeNumberSession(clients, args.rounds, stats, args.chat_interval, number_per_player=args.numbers, **options)
+			sessions.append(session)
+		print(f"已建立 {args.rooms * (args.players + args.spectators)} 條連線，耗時 {time.perf_counter() - start:.2f} 秒")
+
+		start = time.perf_counter()
+		await asyncio.gather(*(session.run() for session in sessions))
+		elapsed = time.perf_counter() - start
+
+		rss.stop()
+		await asyncio.gather(*(client.close() for session in sessions for client in session.clients + session.spectators))
+		report(stats, elapsed, rss)
+	finally:
+		if server_process:
+			server_process.terminate()
+			server_process.wait()
+			workdir.cleanup()
+
+if __name__ == "__main__":
+	asyncio.run(main())
@@ -0,0 +1,166 @@
+"""離線重播房間事件紀錄。
+
+依序把紀錄中的進出房間、更名、請求與計時器事件套用到新的房間實例上，亂數種子
+使用紀錄中的種子，因此可以重現當時的房間狀態 (用來重現錯誤或分析對局)。
+重播不等待真實時間，計時器只在紀錄中觸發過的時間點觸發。
+
+用法 (在 Server 目錄下執行)：
+	python tools/replay_journal.py <紀錄檔案>... [--repeat 1] [--snapshot <快照檔案>] [--verbose]
+
+--snapshot 會把重播後的房間狀態跟伺服器寫入的快照中同一個房間的狀態比對
+(用同一組設定啟動伺服器並設定 JOURNAL_DIR 與 SNAPSHOT_PATH)。
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_define import GAME_TYPE, JOURNAL_EVENT, PROTOCOL_CLIENT
+from game_rooms.base_game_room import BaseGameRoom
+from game_rooms.arrange_number_room import ArrangeNumberRoom
+from game_rooms.guess_word_room import GuessWordRoom
+import journal
+from managers.user_manager_interface import IUserManager
+import message_decoder
+import snapshot
+from snapshot import SnapshotReader
+from user import User
+
+
+ROOM_CLASSES: dict[GAME_TYPE, type[BaseGameRoom]] = {
+	GAME_TYPE.GUESS_WORD:		GuessWordRoom,
+	GAME_TYPE.ARRANGE_NUMBER:	ArrangeNumberRoom,
+}
+
+
+class ReplayUserManager(IUserManager):
+	"""只保存重播中出現過的使用者。"""
+	def __init__(self):
+		self.users: dict[int, User] = {}
+
+	def get_user(self, uid: int) -> User | None:
+		return self.users.get(uid)
+
+	def add_user(self, user: User):
+		self.users[user.uid] = user
+
+	async def remove_user(self, user: User):
+		self.users.pop(user.uid, None)
+
+	def get_or_create(self, uid: int, name: str) -> User:
+		user = self.users.get(uid)
+		if not user:
+			user = User(None, uid)
+			self.add_user(user)
+		user.name = name
+		return user
+
+
+def split_snapshot(record: bytes) -> tuple[int, bytes]:
+	"""拆出房間快照的房間編號與使用者列表之後的部分 (不含連線憑證，可以跟重播結果比對)。"""
+	reader = SnapshotReader(record)
+	reader.read_uint8()
+	room_id = reader.read_uint32()
+	reader.read_bool()
+	for _ in range(reader.read_uint16()):
+		reader.read_uint16()
+		reader.read_string()
+		reader.read_bytes(16)
+	return room_id, reader.read_remaining()
+
+def restore_room(manager: ReplayUserManager, room: BaseGameRoom, record: bytes):
+	"""從紀錄中的 SNAPSHOT 事件還原房間。"""
+	reader = SnapshotReader(record)
+	reader.read_uint8()
+	reader.read_uint32()
+	reader.read_bool()
+	users = []
+	for _ in range(reader.read_uint16()):
+		uid, name = reader.read_uint16(), reader.read_string()
+		reader.read_bytes(16)
+		users.append(manager.get_or_create(uid, name))
+	room.restore_snapshot(reader, users)
+
+async def replay(path: str, verbose: bool) -> tuple[BaseGameRoom, int]:
+	"""重播一個紀錄檔案，返回重播後的房間與套用的事件數量。"""
+	game_type, room_id, large, events = journal.read(path)
+	manager = ReplayUserManager()
+	room = ROOM_CLASSES[game_type].create_replay(manager, room_id, journal.ReplayJournal(events), large)
+
+	applied = 0
+	for event, elapsed, payload in events:
+		if verbose:
+			print(f"  {elapsed / 1000:9.3f}s {event.name:<8} {payload.hex()}")
+		match event:
+			case JOURNAL_EVENT.SNAPSHOT:
+				restore_room(manager, room, payload)
+			case JOURNAL_EVENT.JOIN:
+				uid, name = journal.parse_user(payload)
+				await room.add_user(manager.get_or_create(uid, name))
+			case JOURNAL_EVENT.LEAVE:
+				await room.remove_user(journal.parse_uid(payload))
+			case JOURNAL_EVENT.RENAME:
+				uid, name = journal.parse_user(payload)
+				manager.get_or_create(uid, name)
+				await room.broadcast_rename(uid, name)
+			case JOURNAL_EVENT.REQUEST:
+				uid, protocol, message = journal.parse_request(payload)
+				await room.process_request(manager.users[uid], message_decoder.decode_payload(PROTOCOL_CLIENT(protocol), message))
+			case JOURNAL_EVENT.TIMER:
+				await room.fire_timer(payload.decode("utf8"))
+			case JOURNAL_EVENT.SEED:
+				continue  # 由 ReplayJournal 在房間要求種子時提供
+			case JOURNAL_EVENT.CLOSE:
+				break
+		applied += 1
+	return room, applied
+
+def load_snapshot_states(path: str) -> dict[int, bytes]:
+	with open(path, "rb") as file:
+		data = file.read()
+	# 比對用的快照不受 SNAPSHOT_MAX_AGE 限制
+	snapshot.SNAPSHOT_MAX_AGE = float("inf")
+	return dict(split_snapshot(reader.read_remaining()) for reader in snapshot.decode(data))
+
+async def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("paths", nargs="+", help="房間紀錄檔案")
+	parser.add_argument("--repeat", type=int, default=1, help="每個檔案重播的次數 (計算平均耗時)")
+	parser.add_argument("--snapshot", help="跟伺服器寫入的快照比對重播結果")
+	parser.add_argument("--verbose", action="store_true", help="列出每一筆事件")
+	args = parser.parse_args()
+
+	journal.disable()
+	live_states = load_snapshot_states(args.snapshot) if args.snapshot else {}
+	mismatched = 0
+	for path in args.paths:
+		try:
+			started = time.perf_counter()
+			for _ in range(args.repeat):
+				room, applied = await replay(path, args.verbose)
+			seconds = (time.perf_counter() - started) / args.repeat
+		except journal.JournalError as e:
+			print(f"{path}: 無法重播：{e}")
+			mismatched += 1
+			continue
+
+		room_id, state = split_snapshot(room.get_snapshot())
+		print(
+			f"{path}: {type(room).__name__} #{room.get_id()} 事件 {applied} 筆，耗時 {seconds * 1000:.2f} ms，"
+			f"使用者 {len(room.get_user_ids())} 人，狀態 {room.get_game_state().name}，"
+			f"快照 {hashlib.sha1(state).hexdigest()[:12]}"
+		)
+		if room_id in live_states:
+			if state == live_states[room_id]:
+				print("  與快照一致")
+			else:
+				print("  與快照不一致")
+				mismatched += 1
+	sys.exit(1 if mismatched else 0)
+
+if __name__ == "__main__":
+	asyncio.run(main())
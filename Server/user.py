@@ -1,17 +1,29 @@
 import abc
+import time
 import websockets
 
 import id_generator
+import network
+from rate_limiter import RateLimiter
+from packet_builder import PacketWriter
+from snapshot import SnapshotReader
+from timer_wheel import Timer
 
 
 class User:
 	"""使用者類別，代表連線的客戶端。"""
-	def __init__(self, websocket: websockets.ServerConnection, id: int):
-		self.socket = websocket
+	def __init__(self, websocket: websockets.ServerConnection | None, id: int):
+		self.socket: websockets.ServerConnection | None = websocket  # 斷線等待重連期間為 None
+		self.sender = network.PacketSender(websocket)
 		self.uid = id
 		self.name = ""
 		self.version_checked = False
 		self.room_id = -1
+		self.relay = None  # 房間在其他 worker 時的轉送連線 (worker_pool.WorkerRelay)
+		self.last_active = time.monotonic()  # 最後一次收到客戶端訊息的時間
+		self.rate_limiter = RateLimiter(id)
+		self.session_token: bytes | None = None  # 斷線重連用的憑證
+		self.resume_timer: Timer | None = None  # 斷線後保留使用者的期限
 	
 	def __del__(self):
 		id_generator.release_user_id(self.uid)
@@ -27,20 +39,41 @@ class User:
 			return None
 		return cls(websocket, uid)
 	
+	def send(self, packet: bytes):
+		"""發送封包給使用者，不等待發送完成。"""
+		self.sender.send(packet)
+	
+	async def close(self):
+		"""送出剩餘的封包後中斷連線。"""
+		await self.sender.close()
+	
+	def is_detached(self) -> bool:
+		"""是否在斷線後等待重新連線。"""
+		return self.socket is None
+	
+	def detach(self, resume_timer: Timer):
+		"""連線中斷但保留使用者，`resume_timer` 到期前可以用 `attach` 接回。"""
+		self.socket = None
+		self.sender.detach()
+		self.resume_timer = resume_timer
+	
+	def attach(self, websocket: websockets.ServerConnection, header: bytes, received: int | None):
+		"""改用新的連線，參數見 `PacketSender.attach`。"""
+		if self.resume_timer:
+			self.resume_timer.cancel()
+			self.resume_timer = None
+		self.socket = websocket
+		self.sender.attach(websocket, header, received)
+	
 	async def check_version(self) -> bool:
 		if not self.version_checked:
-			await self.socket.close()
+			await self.close()
 			return False
 		return True
 	
-	def to_bytes(self) -> bytes:
-		"""將使用者資訊轉換為位元組格式。"""
-		data = bytes()
-		data += self.uid.to_bytes(2, byteorder="little")
-		encoded_name = self.name.encode("utf8")
-		data += len(encoded_name).to_bytes(1, byteorder="little")
-		data += encoded_name
-		return data
+	def write_to(self, writer: PacketWriter):
+		"""將使用者資訊寫入封包。"""
+		writer.write_uint16(self.uid).write_string(self.name)
 
 
 class BasePlayer(abc.ABC):
@@ -57,5 +90,13 @@ class BasePlayer(abc.ABC):
 		"""
 	
 	@abc.abstractmethod
-	def to_bytes(self) -> bytes:
-		"""將玩家資訊轉換為位元組格式。"""
+	def write_to(self, writer: PacketWriter):
+		"""將玩家資訊寫入封包。"""
+	
+	@abc.abstractmethod
+	def write_snapshot(self, writer: PacketWriter):
+		"""將玩家的完整資料寫入房間快照。"""
+	
+	@abc.abstractmethod
+	def read_snapshot(self, reader: SnapshotReader):
+		"""讀取 `write_snapshot` 寫入的內容。"""
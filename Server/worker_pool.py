@@ -0,0 +1,156 @@
+import asyncio
+import multiprocessing
+import signal
+import struct
+from collections.abc import Callable
+import websockets
+
+from config import CONFIG
+from game_define import PROTOCOL_CLIENT, PROTOCOL_SERVER, CONST
+import logger
+from logger import LOG_CATEGORY
+from user import User
+
+
+WORKER_COUNT: int = CONFIG.get("WORKERS", 1)
+WORKER_PORT_BASE: int = CONFIG.get("WORKER_PORT_BASE", CONFIG.get("PORT", 11451) + 1)
+
+# 當前行程負責的 worker 編號，由 `run_workers` 在子行程中設定
+worker_index = 0
+
+
+def is_enabled() -> bool:
+	"""是否以多行程模式執行。"""
+	return WORKER_COUNT > 1
+
+def get_internal_port(index: int) -> int:
+	"""取得 worker 之間轉送連線用的本機連接埠。"""
+	return WORKER_PORT_BASE + index
+
+def get_room_worker(room_id: int) -> int:
+	"""取得負責該房間的 worker 編號。
+
+	房間編號除以 worker 數量的餘數即為 worker 編號，見 `id_generator.configure_room_id_space`。
+	"""
+	return room_id % WORKER_COUNT
+
+def is_local_room(room_id: int) -> bool:
+	"""房間是否由當前 worker 負責。"""
+	return get_room_worker(room_id) == worker_index
+
+def _worker_entry(index: int, target: Callable[[], None]):
+	global worker_index
+	worker_index = index
+	# 終端機的 Ctrl+C 會送給整個行程群組，統一由主行程轉送 SIGTERM
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	try:
+		target()
+	finally:
+		# 子行程結束時不會執行 atexit
+		logger.shutdown()
+
+def run_workers(target: Callable[[], None]):
+	"""啟動 `WORKER_COUNT` 個共用監聽連接埠 (SO_REUSEPORT) 的子行程並等待它們結束。
+	
+	主行程收到 SIGTERM 或 SIGINT 時轉送 SIGTERM 給所有 worker，由各自進行關閉流程
+	"""
+	processes = [
+		multiprocessing.Process(target=_worker_entry, args=(index, target), name=f"worker-{index}")
+		for index in range(WORKER_COUNT)
+	]
+	for process in processes:
+		process.start()
+	
+	def forward_signal(signum, frame):
+		del frame  # unused parameter
+		logger.info(LOG_CATEGORY.SERVER, "收到訊號 %s，通知所有 worker 關閉", signal.Signals(signum).name)
+		for process in processes:
+			if process.is_alive():
+				process.terminate()
+	
+	signal.signal(signal.SIGTERM, forward_signal)
+	signal.signal(signal.SIGINT, forward_signal)
+	for process in processes:
+		process.join()
+
+
+class WorkerRelay:
+	"""把使用者的連線轉送到負責房間的其他 worker。
+
+	對目標 worker 而言這只是一個普通的客戶端連線，因此使用者在該房間內的 UID
+	由目標 worker 分配，離開房間時再改回原本的 UID。
+	"""
+	def __init__(self, user: User, worker: int):
+		self._user = user
+		self._worker = worker
+		self._socket = None
+		self._pump_task: asyncio.Task | None = None
+		self._closing = False
+		self._joined = False
+
+	async def open(self, room_id: int) -> bool:
+		"""連線到目標 worker 並加入房間。
+
+		無法連線時返回 False
+		"""
+		try:
+			self._socket = await websockets.connect(f"ws://127.0.0.1:{get_internal_port(self._worker)}")
+			await self._socket.send(struct.pack("<BI", PROTOCOL_CLIENT.VERSION, CONST.GAME_VERSION))
+			await self._socket.send(bytes([PROTOCOL_CLIENT.NAME]) + self._user.name.encode("utf8"))
+			await self._socket.send(struct.pack("<BI", PROTOCOL_CLIENT.JOIN_ROOM, room_id))
+		except (OSError, websockets.exceptions.WebSocketException):
+			return False
+
+		self._pump_task = asyncio.create_task(self._pump())
+		return True
+
+	async def forward(self, message: bytes):
+		"""轉送客戶端的訊息給目標 worker。"""
+		try:
+			await self._socket.send(message)
+		except websockets.exceptions.ConnectionClosed:
+			pass
+
+	async def close(self):
+		"""中斷轉送連線。"""
+		self._closing = True
+		if self._socket:
+			await self._socket.close()
+		if self._pump_task:
+			await asyncio.gather(self._pump_task, return_exceptions=True)
+
+	async def _pump(self):
+		"""把目標 worker 的封包轉給客戶端。"""
+		remote_uid_packet = None
+		try:
+			async for message in self._socket:
+				if self._joined:
+					self._user.send(message)
+					continue
+				
+				# 加入房間前的封包需要過濾
+				match message[0]:
+					case PROTOCOL_SERVER.UID:
+						# 確定加入房間後才讓客戶端改用目標 worker 的 UID
+						remote_uid_packet = message
+					case PROTOCOL_SERVER.INIT | PROTOCOL_SERVER.LARGE_INIT:
+						self._joined = True
+						self._user.send(remote_uid_packet)
+						self._user.send(message)
+					case PROTOCOL_SERVER.ROOM_ID:
+						# 房間已不存在或已滿
+						self._user.send(message)
+						break
+		except websockets.exceptions.ConnectionClosed:
+			pass
+		
+		if self._closing:
+			return
+		
+		if self._joined:
+			# 目標 worker 中斷了轉送連線，讓客戶端重新連線
+			await self._user.close()
+		else:
+			self._user.relay = None
+			self._user.room_id = -1
+			await self._socket.close()